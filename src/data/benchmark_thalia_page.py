@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the Thalia product page extraction on saved pages.
+
+  Compares the BeautifulSoup getters of get_thalia_features.py with the single pass parse_thalia_page and counts the
+  pages on which a feature differs. Any folder of saved product pages works, e.g. the response cache of the scrapers:
+
+    $ python src/data/benchmark_thalia_page.py data/external/http_cache --repeat 3
+"""
+
+import logging
+import os
+import time
+
+import click
+from bs4 import BeautifulSoup
+
+from src.data import get_thalia_features as getters
+from src.data.thalia_page import parse_thalia_page
+
+FEATURES = ['description', 'rating', 'number_pages', 'recommended_age', 'release_date', 'language',
+            'thalia_ranking', 'cover_url']
+
+
+def load_pages(pages_filepath):
+    """ Reads every file below pages_filepath as page.
+    """
+    pages = []
+    for folder, _, files in os.walk(pages_filepath):
+        for name in sorted(files):
+            with open(os.path.join(folder, name), 'rb') as f:
+                pages.append(f.read())
+    return pages
+
+
+def extract_with_getters(content):
+    """ Features of a page like scrape_book extracted them before parse_thalia_page.
+    """
+    soup = BeautifulSoup(content, "html.parser")
+    return {"description": getters.get_description(None, None, soup),
+            "rating": getters.get_rating(None, None, soup),
+            "number_pages": getters.get_number_pages(None, None, soup),
+            "recommended_age": getters.get_recommended_age(None, None, soup),
+            "release_date": getters.get_release_date(None, None, soup),
+            "language": getters.get_language(None, None, soup),
+            "thalia_ranking": getters.get_thalia_ranking(None, None, soup),
+            "cover_url": getters.get_cover(None, None, soup)}
+
+
+def extract_single_pass(content):
+    """ Features of a page like scrape_book extracts them.
+    """
+    return parse_thalia_page(content).to_dict()
+
+
+def time_extraction(extract, pages, repeat=1):
+    """ Best time in seconds of extracting all pages over repeat runs and the extracted features of the last run.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        features = [extract(content) for content in pages]
+        best = min(best, time.perf_counter() - start)
+    return best, features
+
+
+@click.command()
+@click.argument('pages_filepath', type=click.Path(exists=True))
+@click.option('--repeat', default=3, help='Number of timed runs, the best one is reported.')
+def main(pages_filepath, repeat):
+    """ Times both extractions on the pages in pages_filepath and reports differing features.
+    """
+    logger = logging.getLogger(__name__)
+    pages = load_pages(pages_filepath)
+    if not pages:
+        raise click.UsageError('no pages in {}'.format(pages_filepath))
+
+    seconds_getters, features_getters = time_extraction(extract_with_getters, pages, repeat)
+    seconds_single_pass, features_single_pass = time_extraction(extract_single_pass, pages, repeat)
+    logger.info('%d pages: getters %.2f ms/page, single pass %.2f ms/page, speedup %.1fx', len(pages),
+                1000 * seconds_getters / len(pages), 1000 * seconds_single_pass / len(pages),
+                seconds_getters / seconds_single_pass)
+
+    for feature in FEATURES:
+        differing = sum(old[feature] != new[feature] for old, new in zip(features_getters, features_single_pass))
+        if differing:
+            logger.info('%s differs on %d pages', feature, differing)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,89 @@
+"""itemID indexed access to the book catalog.
+
+  Looking up a book with df_items.loc[df_items['itemID'] == itemID] scans the whole catalog. A Catalog maps every
+  itemID to its row once, so single lookups are a dictionary access and bulk lookups a hash index lookup.
+
+  Typical usage example:
+
+    >> catalog = Catalog(df_items)
+    >> catalog.get_title(22120)
+    >> catalog.get_many([22120, 15606], "author")
+    >> catalog.get_rows([22120, 15606])
+
+  Functions that take either a Catalog or a dataframe call get_catalog, which indexes a dataframe on every call, so
+  callers that look up many books build the Catalog once and pass it instead.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class Catalog:
+    """Book catalog indexed by itemID, duplicate itemIDs resolve to their first row."""
+
+    def __init__(self, items_df, id_column='itemID'):
+        """
+        Args:
+            items_df (dataframe): Books with an itemID column and any further columns.
+            id_column (string): Column holding the itemID.
+        """
+        self.items_df = items_df.reset_index(drop=True)
+        self.id_column = id_column
+        self.columns = {column: self.items_df[column].to_numpy() for column in self.items_df.columns}
+        # the items_df files use 'mt', the raw items.csv 'main topic'
+        self.topic_column = 'mt' if 'mt' in self.columns else 'main topic'
+
+        item_ids = self.items_df[id_column]
+        self.positions = np.flatnonzero(~item_ids.duplicated(keep='first').to_numpy())
+        self.index = pd.Index(item_ids.to_numpy()[self.positions])
+        self.position_by_id = dict(zip(self.index.tolist(), self.positions.tolist()))
+
+    def __contains__(self, item_id):
+        return item_id in self.position_by_id
+
+    def __len__(self):
+        return len(self.items_df)
+
+    def get_position(self, item_id):
+        """Row of an itemID in items_df, raises a KeyError for unknown itemIDs."""
+        return self.position_by_id[item_id]
+
+    def get_positions(self, item_ids):
+        """Rows of many itemIDs in items_df, raises a KeyError if any itemID is unknown."""
+        found = self.index.get_indexer(np.asarray(item_ids))
+        if (found < 0).any():
+            raise KeyError(np.asarray(item_ids)[found < 0].tolist())
+        return self.positions[found]
+
+    def get(self, item_id, column):
+        """Value of a column for one itemID."""
+        return self.columns[column][self.get_position(item_id)]
+
+    def get_many(self, item_ids, column):
+        """Values of a column for many itemIDs as array in the order of item_ids."""
+        return self.columns[column][self.get_positions(item_ids)]
+
+    def get_title(self, item_id):
+        return self.get(item_id, 'title')
+
+    def get_author(self, item_id):
+        return self.get(item_id, 'author')
+
+    def get_language(self, item_id):
+        return self.get(item_id, 'language')
+
+    def get_header_id(self, item_id):
+        return self.get(item_id, 'headerID')
+
+    def get_topic(self, item_id):
+        return self.get(item_id, self.topic_column)
+
+    def get_rows(self, item_ids):
+        """Rows of the known itemIDs as dataframe, unknown itemIDs are left out like in a boolean filter."""
+        found = self.index.get_indexer(np.asarray(item_ids))
+        return self.items_df.iloc[self.positions[found[found >= 0]]]
+
+
+def get_catalog(items):
+    """Returns items if it already is a Catalog, otherwise indexes the dataframe."""
+    return items if isinstance(items, Catalog) else Catalog(items)
@@ -0,0 +1,211 @@
+"""Canonical, typed book catalog in columnar format.
+
+  The raw item files come with different separators and quoting and every model used to parse and merge them on its
+  own. load_books_csv reads the DMC items.csv with the cleaning of the models, build_catalog merges it once with the
+  scraped items into a typed catalog with the subtopics and the title tokens as lists and integer codes of the main
+  topic per hierarchy level. write_catalog stores a table as uncompressed Arrow
+  file, which read_catalog memory-maps so a model only loads the columns it needs, and as Parquet for compact
+  exchange. The books of items.csv are stored as well, they are the items of the transaction baseline.
+
+  Typical usage example:
+
+    >> books = load_books_csv("../data/raw/items.csv")
+    >> catalog = build_catalog("../data/raw", books)
+    >> write_catalog(catalog, "../data/processed")
+    >> write_catalog(books, "../data/processed", BOOKS_FILE)
+    >> items_df = read_catalog("../data/processed/catalog.arrow", columns=["itemID", "title", "language"])
+    >> df_items = read_books("../data/processed/books.arrow")
+"""
+
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather, parquet
+
+CATALOG_FILE = 'catalog.arrow'
+BOOKS_FILE = 'books.arrow'
+
+# columns of the items_df used by the hybrid model in recommendations.py
+ITEM_COLUMNS = ['itemID', 'headerID', 'title', 'author', 'language', 'mt']
+
+# columns of the books of items.csv used by the transaction baseline
+BOOK_COLUMNS = ['itemID', 'title', 'author']
+
+# columns of the items used by preprocess_books of the rule based model
+PREPROCESSING_COLUMNS = ['itemID', 'title', 'author', 'language', 'main topic', 'subtopics']
+
+CATEGORICAL_COLUMNS = ['author', 'publisher', 'language', 'mt', 'main topic', 'topic']
+
+# prefix length of every main topic hierarchy level (None is the full code) and the column of its codes, the levels
+# of src/features/topic_codes.py
+TOPIC_LEVELS = ((None, 'topic_code'), (3, 'topic_code_3'), (2, 'topic_code_2'))
+
+# subtopics of items.csv are a bracketed list on one line, e.g. [5AH,YFB]
+SUBTOPICS_PATTERN = r'\[[^\[\]\n]*\]'
+
+
+def load_items_csv(items_path, header_path, mt_path):
+    """ Merges the scraped items, their header information and the main topics into one dataframe.
+
+    Args:
+        items_path (string): Path of the 20210525_items_df.csv file.
+        header_path (string): Path of the 20210525_header_items_df.csv file.
+        mt_path (string): Path of the items_pp.csv file with the mt column in the order of the items.
+
+    Returns:
+        Dataframe of the items
+    """
+    items_df = pd.read_csv(items_path, delimiter=',', encoding='utf-8')
+    del items_df['description']
+    del items_df['recommended_age']
+    del items_df['number_pages']
+
+    header_df = pd.read_csv(header_path, lineterminator='\n')
+    del header_df['title']
+    del header_df['author']
+    del header_df['publisher']
+    del header_df['item_lang_en']
+
+    mt_df = pd.read_csv(mt_path, delimiter=',', encoding='utf-8')
+
+    items_df = pd.merge(items_df, header_df, how='left', left_on=['headerID'], right_on=['headerID'])
+    items_df['mt'] = mt_df['mt']
+
+    return items_df
+
+
+def load_books_csv(books_path):
+    """ Reads the DMC items.csv with main topic and subtopics, the subtopics are parsed into lists.
+
+    Every line is kept, like preprocess_books read the file. Subtopics that are no bracketed list, like the broken
+    ones preprocess_books dropped by row number, become empty lists.
+    """
+    books = pd.read_csv(books_path, sep='|', encoding='utf-8')
+    broken = books['subtopics'].notna() & ~books['subtopics'].astype(str).str.fullmatch(SUBTOPICS_PATTERN)
+    books.loc[broken, 'subtopics'] = '[]'
+
+    def to_list(x):
+        try:
+            return x.strip('][').split(', ')
+        except AttributeError:
+            return []
+
+    books['subtopics'] = books['subtopics'].map(to_list)
+    return books
+
+
+def tokenize_title(title):
+    """ Lower case word tokens of a title, missing titles have no tokens.
+    """
+    return re.findall(r'\w+', title.lower()) if isinstance(title, str) else []
+
+
+def build_catalog(input_filepath, books=None):
+    """ Builds the canonical catalog from the raw files in input_filepath.
+
+    Args:
+        input_filepath (string): Folder with items.csv, 20210525_items_df.csv, 20210525_header_items_df.csv and
+            items_pp.csv.
+        books (dataframe): items.csv as read by load_books_csv, it is read from input_filepath if None.
+
+    Returns:
+        Dataframe with one row per item of 20210525_items_df.csv. The main topic without brackets is in topic, its
+        codes per hierarchy level in the columns of TOPIC_LEVELS (-1 if missing) and the title tokens in title_tokens.
+    """
+    catalog = load_items_csv(os.path.join(input_filepath, '20210525_items_df.csv'),
+                             os.path.join(input_filepath, '20210525_header_items_df.csv'),
+                             os.path.join(input_filepath, 'items_pp.csv'))
+
+    if books is None:
+        books = load_books_csv(os.path.join(input_filepath, 'items.csv'))
+    books = books[['itemID'] + [column for column in books.columns if column not in catalog.columns]]
+    catalog = pd.merge(catalog, books, how='left', on='itemID')
+    catalog['subtopics'] = [subtopics if isinstance(subtopics, list) else [] for subtopics in catalog['subtopics']]
+
+    catalog['topic'] = catalog['mt'].str.strip(' []')
+    for length, column in TOPIC_LEVELS:
+        codes, _ = pd.factorize(catalog['topic'].str[:length])
+        catalog[column] = codes.astype(np.int32)
+
+    catalog['title_tokens'] = catalog['title'].map(tokenize_title)
+
+    return set_categories(catalog)
+
+
+def set_categories(books):
+    """ Stores the columns of CATEGORICAL_COLUMNS of a dataframe as categoricals.
+    """
+    for column in CATEGORICAL_COLUMNS:
+        if column in books.columns:
+            books[column] = books[column].astype('category')
+    return books
+
+
+def write_catalog(catalog, output_filepath, file_name=CATALOG_FILE):
+    """ Writes a table as uncompressed Arrow file for memory-mapping and as Parquet file of the same name.
+
+    The Arrow file is written as a single record batch, so read_catalog can map its numeric columns without copying.
+
+    Args:
+        catalog (dataframe): Catalog of build_catalog or books of load_books_csv.
+        output_filepath (string): Folder the files are written to.
+        file_name (string): Name of the Arrow file, CATALOG_FILE or BOOKS_FILE.
+    """
+    os.makedirs(output_filepath, exist_ok=True)
+    table = pa.Table.from_pandas(set_categories(catalog.copy()), preserve_index=False)
+    feather.write_feather(table, os.path.join(output_filepath, file_name), compression='uncompressed',
+                          chunksize=max(len(table), 1))
+    parquet.write_table(table, os.path.join(output_filepath, os.path.splitext(file_name)[0] + '.parquet'))
+
+
+def read_catalog(path, columns=None):
+    """ Reads columns of the catalog, the Arrow file is memory-mapped instead of parsed.
+
+    Numeric columns without missing values stay read-only views of the mapped file, only text, categorical and list
+    columns are converted.
+
+    Args:
+        path (string): Path of the catalog.arrow or catalog.parquet file.
+        columns (list): Columns to read, all if None.
+
+    Returns:
+        Dataframe with the columns, categorical columns stay categorical and list columns hold lists.
+    """
+    if path.endswith('.parquet'):
+        table = parquet.read_table(path, columns=columns, memory_map=True)
+    else:
+        table = feather.read_table(path, columns=columns, memory_map=True)
+
+    return pd.DataFrame({name: to_series(table.column(name)) for name in table.column_names}, copy=False)
+
+
+def read_books(path, columns=None):
+    """ Reads the books of items.csv from the store or, for a .csv path, from the raw file.
+
+    Args:
+        path (string): Path of the books.arrow, books.parquet or items.csv file.
+        columns (list): Columns to read, all if None.
+
+    Returns:
+        Dataframe of the books like load_books_csv returns it.
+    """
+    if path.endswith('.csv'):
+        books = load_books_csv(path)
+        return books if columns is None else books[columns]
+    return read_catalog(path, columns=columns)
+
+
+def to_series(column):
+    """ Column of an Arrow table as series, numeric columns without nulls in a single chunk are not copied.
+    """
+    if column.num_chunks == 1 and column.null_count == 0 and \
+            (pa.types.is_integer(column.type) or pa.types.is_floating(column.type)):
+        return pd.Series(column.chunk(0).to_numpy(zero_copy_only=True), copy=False)
+
+    series = column.to_pandas()
+    if pa.types.is_list(column.type):
+        series = pd.Series([[] if values is None else list(values) for values in series])
+    return series
@@ -11,14 +11,21 @@
     >> import pandas as pd
     >> data = pd.DataFrame({test_field_write: ['test_field_value_1', 'test_field_value_2']})
     >> write_documents_to_collection(firestore_client, data, collection="test_write_collection")
+    >> download_collection(firestore_client, "../data/external/test_collection.jsonl", collection="test_collection")
 """
 
+import json
+from concurrent.futures import ThreadPoolExecutor
+
 import firebase_admin
 from firebase_admin import firestore
 from tqdm import tqdm
 
 tqdm.pandas()
 
+# maximum number of operations in one firestore write batch
+MAX_BATCH_SIZE = 500
+
 
 def connect_to_firestore(credentials="../secrets/dmc-book-recommendation-firebase-adminsdk-yebqi-d805561028.json",
                          database_url="https://book-recommendation-website.firebaseio.com/"):
@@ -43,35 +50,108 @@ def connect_to_firestore(credentials="../secrets/dmc-book-recommendation-firebas
     return firestore_client
 
 
-def retrieve_documents_from_collection(firestore_client, collection="test_collection"):
+def stream_documents_from_collection(firestore_client, collection="test_collection", page_size=1000):
+    """Streams the documents of a specified firestore collection page by page.
+
+    The documents are ordered by their id and every page is a query that starts after the last document of the
+    previous page, so only one page is held in memory at a time.
+
+    Args:
+        collection: firestore collection of the documents that should be retrieved
+        firestore_client: specified firestore connection
+        page_size: number of documents per page
+
+    Yields:
+        Lists of dictionaries containing the content of the documents, one list per page.
+    """
+
+    query = firestore_client.collection(collection).order_by(firestore.FieldPath.document_id()).limit(page_size)
+    while True:
+        snapshots = list(query.stream())
+        if snapshots:
+            yield [snapshot.to_dict() for snapshot in snapshots]
+        if len(snapshots) < page_size:
+            break
+        query = query.start_after(snapshots[-1])
+
+
+def retrieve_documents_from_collection(firestore_client, collection="test_collection", page_size=1000):
     """Retrieves all documents of a specified firestore collection.
 
     Args:
         collection: firestore collection of the documents that should be retrieved
         firestore_client: specified firestore connection
+        page_size: number of documents read per request, see stream_documents_from_collection
 
     Returns:
         A list of dictionaries containing the content of the documents of the specified collection.
     """
 
-    docs_ref = firestore_client.collection(collection)
-    docs = docs_ref.get()
     results = []
-    for doc in tqdm(docs):
-        results.append(doc.to_dict())
+    with tqdm(unit="docs") as progress:
+        for page in stream_documents_from_collection(firestore_client, collection, page_size):
+            results.extend(page)
+            progress.update(len(page))
 
     return results
 
 
-def write_documents_to_collection(firestore_client, data, collection="test_write_collection"):
+def download_collection(firestore_client, path, collection="test_collection", page_size=1000):
+    """Writes all documents of a specified firestore collection to a JSON lines file.
+
+    The pages are written as they arrive, so collections larger than the memory can be downloaded.
+
+    Args:
+        collection: firestore collection of the documents that should be retrieved
+        firestore_client: specified firestore connection
+        path: path of the JSON lines file, one document per line
+        page_size: number of documents read per request, see stream_documents_from_collection
+
+    Returns:
+        The number of written documents.
+    """
+
+    count = 0
+    with open(path, "w", encoding="utf-8") as f, tqdm(unit="docs") as progress:
+        for page in stream_documents_from_collection(firestore_client, collection, page_size):
+            # timestamps and other firestore types are written as strings
+            f.writelines(json.dumps(document, default=str, ensure_ascii=False) + "\n" for document in page)
+            count += len(page)
+            progress.update(len(page))
+
+    return count
+
+
+def write_documents_to_collection(firestore_client, data, collection="test_write_collection", batch_size=MAX_BATCH_SIZE,
+                                  max_workers=4):
     """Writes documents from a dataframe to a specified collection.
 
+    The documents are written in batches of up to 500 operations, the firestore limit per batch, and up to max_workers
+    batches are committed at the same time. Every document gets an automatically generated id like with add.
+
     Args:
         collection: firestore collection where to the documents should be inserted
         data: dataframe
         firestore_client: specified firestore connection
+        batch_size: number of documents per batch, at most 500
+        max_workers: number of batches committed concurrently
     """
 
+    if not 0 < batch_size <= MAX_BATCH_SIZE:
+        raise ValueError("batch_size must be between 1 and {}".format(MAX_BATCH_SIZE))
+
     documents = data.to_dict(orient="records")
     collection_ref = firestore_client.collection(collection)
-    list(map(lambda x: collection_ref.add(x), tqdm(documents)))
+
+    def commit(batch_documents):
+        batch = firestore_client.batch()
+        for document in batch_documents:
+            batch.set(collection_ref.document(), document)
+        batch.commit()
+        return len(batch_documents)
+
+    batches = [documents[start:start + batch_size] for start in range(0, len(documents), batch_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            tqdm(total=len(documents), unit="docs") as progress:
+        for written in executor.map(commit, batches):
+            progress.update(written)
@@ -1,65 +1,277 @@
+import csv
+import hashlib
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
 import pandas as pd
 import requests
-from bs4 import BeautifulSoup
-import os
+from PIL import Image
+
+from src.data.catalog import Catalog
+from src.data.get_thalia_features import THALIA_URL, get_url
+from src.data.http_client import HttpClient, get_content
+from src.data.response_cache import CACHE_DIR, ResponseCache
+from src.data.thalia_page import parse_thalia_page
+
+logger = logging.getLogger(__name__)
 
+COVER_FOLDER = 'covers'
+THUMBNAIL_FOLDER = 'thumbnails'
+COVER_INDEX_FILE = 'covers.csv'
+COVER_INDEX_COLUMNS = ['itemID', 'sha256', 'cover_url']
+THUMBNAIL_SIZE = (200, 300)
+CHUNK_SIZE = 64 * 1024
 
-def get_covers(books, target_folder_name, book_source_path):
+
+def get_covers(books, target_folder_name, book_source_path, cache_dir=CACHE_DIR, client=None, max_workers=8,
+               thumbnail_workers=None, thumbnail_size=THUMBNAIL_SIZE, cover_urls=None, verify_covers=False):
     """ Function to get all covers of a list of books
 
+    The covers are downloaded concurrently and streamed to disk. Every cover is stored once under its SHA-256 in the
+    sharded layout covers/<first two hash digits>/<hash>.jpg and covers.csv maps the itemIDs to their cover. Books
+    whose cover is already in covers.csv and on disk are skipped, covers are only moved to their place once complete
+    so the file is trusted without hashing it again unless verify_covers is set. The thumbnails are resized in a
+    process pool while the downloads go on, a cover that cannot be resized is logged and skipped.
+
+    Search and product pages are read from the response cache in cache_dir, which get_thalia_features shares, so
+    books whose features were scraped before need no page request.
+
     Example: get_covers(books_evaluation_list, "Covers", "../tempData/sourceData/items.csv")
 
     Args:
         books (list): List of books with their unique ID from the data
         target_folder_name: Name of the folder we want our images to be saved in
         book_source_path: Path to the folder in which the item file is saved in
+        cache_dir (string): Folder of the response cache, pages are not cached if None
+        client (HttpClient): Client for the requests, one is created from max_workers and cache_dir if None
+        max_workers (int): Number of covers downloaded at the same time
+        thumbnail_workers (int): Number of processes resizing thumbnails, the number of CPUs if None
+        thumbnail_size (tuple): Maximum width and height of the thumbnails
+        cover_urls (dict): Known cover URLs by itemID, e.g. the cover_url column of get_thalia_features, these books
+            need no search
+        verify_covers (bool): Hash the covers of covers.csv and download those again whose file was changed
 
     Returns:
         Saves scraped cover images in a certain folder
     """
-    book_source = get_book_df(book_source_path)
-    try:
-        os.mkdir(os.path.join(os.getcwd(), target_folder_name))
-    except:
-        pass
-    os.chdir(os.path.join(os.getcwd(), target_folder_name))
-    for book_id in books:
-        get_cover(book_id, book_source)
+    book_source = Catalog(get_book_df(book_source_path))
+    if client is None:
+        client = HttpClient(max_connections=max_workers, cache=None if cache_dir is None else ResponseCache(cache_dir))
+    cover_urls = {} if cover_urls is None else cover_urls
 
+    os.makedirs(target_folder_name, exist_ok=True)
+    index_path = os.path.join(target_folder_name, COVER_INDEX_FILE)
+    index = load_cover_index(index_path)
 
+    books = list(dict.fromkeys(books))
+    todo = [book_id for book_id in books
+            if book_id not in index or not has_cover(target_folder_name, index[book_id], verify_covers)]
 
-def get_cover(book_id, book_source):
+    with ProcessPoolExecutor(max_workers=thumbnail_workers) as thumbnails, \
+            ThreadPoolExecutor(max_workers=max_workers) as downloads:
+        # one thumbnail job per cover, books with the same cover share it
+        thumbnail_jobs = {}
+        # covers that are already there may still lack their thumbnail
+        for sha256 in {index[book_id] for book_id in set(books).difference(todo) if book_id in index}:
+            thumbnail_jobs[sha256] = submit_thumbnail(thumbnails, target_folder_name, sha256, thumbnail_size)
+
+        futures = {downloads.submit(get_cover, book_id, book_source, target_folder_name, client, THALIA_URL,
+                                    cover_urls.get(book_id)): book_id for book_id in todo}
+        for future in as_completed(futures):
+            try:
+                cover_url, sha256 = future.result()
+            except Exception as e:
+                logger.warning('no cover for book %s: %s', futures[future], e)
+                continue
+            index[futures[future]] = sha256
+            save_cover_index(index_path, futures[future], sha256, cover_url)
+            if sha256 not in thumbnail_jobs:
+                thumbnail_jobs[sha256] = submit_thumbnail(thumbnails, target_folder_name, sha256, thumbnail_size)
+
+        resizing = {future: sha256 for sha256, future in thumbnail_jobs.items() if future is not None}
+        for future in as_completed(resizing):
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning('no thumbnail for cover %s: %s', resizing[future], e)
+
+
+def get_cover(book_id, book_source, target_folder_name, client=None, base_url=THALIA_URL, cover_url=None):
     """ Function to scrape a cover of a book based on its ID and save it in a certain folder
 
-        Example: get_cover(203421, book_source)
+        Example: get_cover(203421, book_source, "Covers")
+
+        Args:
+            book_id (id): unique ID of a book from the DMCUP
+            book_source (Catalog or dataframe): Catalog or DF containing all the books considered
+            target_folder_name: Name of the folder the cover is saved in
+            client (HttpClient): Client for the requests, plain requests.get if None
+            base_url (string): Thalia URL
+            cover_url (string): URL of the cover, it is scraped from Thalia if None
+
+        Returns:
+            Tuple of the cover URL and the SHA-256 of the saved cover
+        """
+    if cover_url is None:
+        cover_url = get_cover_url(book_id, book_source, client, base_url)
+    if not cover_url:
+        raise ValueError('no cover found')
+
+    return cover_url, download_cover(cover_url, target_folder_name, client)
+
+
+def get_cover_url(book_id, book_source, client=None, base_url=THALIA_URL):
+    """ Function to get the URL of the cover of a book from its Thalia product page
 
         Args:
             book_id (id): unique ID of a book from the DMCUP
-            book_source (dataframe): DF containing all the books considered
+            book_source (Catalog or dataframe): Catalog or DF containing all the books considered
+            client (HttpClient): Client for the requests, plain requests.get if None
+            base_url (string): Thalia URL
 
         Returns:
-            Saves a scraped cover image
+            URL of the cover as a String, '' if the book or its cover was not found
         """
-    # Get the title based on the itemID
-    title = book_source.loc[(book_source['itemID'] == book_id)]["title"].item()
-
-    # Get the Thalia URL based on the title
-    url_search = "https://www.thalia.de/suche?filterPATHROOT=&sq=" + title
-    page = requests.get(url_search)
-    soup = BeautifulSoup(page.content, 'html.parser')
-    href = soup.find_all('a', caption="suchergebnis-klick")[0]['href']
-    url_book = "https://www.thalia.de" + href
-
-    # Scrape the Cover from
-    page = requests.get(url_book)
-    soup = BeautifulSoup(page.content, "html.parser")
-    cover = soup.find_all('img', class_='largeImg')[0]['src']
-    name = str(book_id)
-
-    # Saves the Cover as a jpg in the Cover folder
-    with open(name + '.jpg', 'wb') as f:
-        im = requests.get(cover)
-        f.write(im.content)
+    url_book = get_url(book_id, book_source, client, base_url)
+    if url_book == '':
+        return ''
+
+    return parse_thalia_page(get_content(url_book, client)).cover_url or ''
+
+
+def download_cover(cover_url, target_folder_name, client=None):
+    """ Function to stream a cover to disk in chunks
+
+        The cover is written to a temporary file while its hash is computed and then moved to its place in the sharded
+        layout. A cover that is already stored, e.g. the same placeholder for several books, is kept once.
+
+        Args:
+            cover_url (string): URL of the cover image
+            target_folder_name: Name of the folder the cover is saved in
+            client (HttpClient): Client for the request, plain requests.get if None
+
+        Returns:
+            SHA-256 of the cover as hex String
+        """
+    folder = os.path.join(target_folder_name, COVER_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = os.path.join(folder, uuid.uuid4().hex + '.tmp')
+
+    if client is None:
+        response = requests.get(cover_url, stream=True)
+        response.raise_for_status()
+    else:
+        response = client.get(cover_url, stream=True)
+
+    sha256 = hashlib.sha256()
+    try:
+        with response, open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                sha256.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        # a broken download leaves no partial file behind
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    sha256 = sha256.hexdigest()
+
+    cover_path = get_cover_path(target_folder_name, COVER_FOLDER, sha256)
+    if os.path.exists(cover_path):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(cover_path), exist_ok=True)
+        os.replace(tmp_path, cover_path)
+
+    return sha256
+
+
+def get_cover_path(target_folder_name, folder, sha256):
+    """ Path of a cover or thumbnail in the layout <folder>/<first two hash digits>/<hash>.jpg
+    """
+    return os.path.join(target_folder_name, folder, sha256[:2], sha256 + '.jpg')
+
+
+def has_cover(target_folder_name, sha256, verify=False):
+    """ Whether the cover with the hash sha256 is on disk, with verify its content is hashed again
+    """
+    cover_path = get_cover_path(target_folder_name, COVER_FOLDER, sha256)
+    if verify:
+        return get_file_hash(cover_path) == sha256
+    return os.path.exists(cover_path)
+
+
+def get_file_hash(path):
+    """ SHA-256 of a file as hex String, None if the file does not exist
+    """
+    sha256 = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha256.update(chunk)
+    except FileNotFoundError:
+        return None
+    return sha256.hexdigest()
+
+
+def submit_thumbnail(executor, target_folder_name, sha256, size=THUMBNAIL_SIZE):
+    """ Submits the thumbnail of a cover to executor, returns None if the thumbnail exists already
+    """
+    thumbnail_path = get_cover_path(target_folder_name, THUMBNAIL_FOLDER, sha256)
+    if os.path.exists(thumbnail_path):
+        return None
+    return executor.submit(make_thumbnail, get_cover_path(target_folder_name, COVER_FOLDER, sha256), thumbnail_path,
+                           size)
+
+
+def make_thumbnail(cover_path, thumbnail_path, size=THUMBNAIL_SIZE):
+    """ Saves a copy of a cover that fits into size as JPEG, the aspect ratio is kept
+
+        The thumbnail is written to a temporary file and moved to thumbnail_path once complete, so an existing
+        thumbnail is never partial.
+
+        Args:
+            cover_path (string): Path of the cover
+            thumbnail_path (string): Path of the thumbnail
+            size (tuple): Maximum width and height of the thumbnail
+        """
+    os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+    tmp_path = os.path.join(os.path.dirname(thumbnail_path), uuid.uuid4().hex + '.tmp')
+    try:
+        with Image.open(cover_path) as image:
+            image.thumbnail(size)
+            image.convert('RGB').save(tmp_path, 'JPEG', quality=85)
+        os.replace(tmp_path, thumbnail_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_cover_index(index_path):
+    """ Function to load the itemID to cover hash mapping written by save_cover_index
+
+        Returns:
+            Dictionary from itemID to the SHA-256 of its cover, the last entry of an itemID wins
+        """
+    if not os.path.exists(index_path):
+        return {}
+
+    index_df = pd.read_csv(index_path, sep='|', encoding='utf-8')
+    return dict(zip(index_df['itemID'], index_df['sha256']))
+
+
+def save_cover_index(index_path, book_id, sha256, cover_url):
+    """ Function to append the cover of a book to the cover index
+    """
+    new_file = not os.path.exists(index_path)
+    with open(index_path, 'a', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, delimiter='|')
+        if new_file:
+            writer.writerow(COVER_INDEX_COLUMNS)
+        writer.writerow([book_id, sha256, cover_url])
+
 
 def get_book_df(path):
     """ Function to load a certain dataframe with ids and book titles from the DMCUP
@@ -72,8 +284,10 @@ def get_book_df(path):
             Returns:
                 Data Frame which contains the IDs and the titles
             """
-    book_df = pd.read_csv(path, delimiter='|', sep='.', encoding='utf-8')
+    book_df = pd.read_csv(path, delimiter='|', encoding='utf-8')
     book_df = book_df.drop('main topic', axis=1).drop('subtopics', axis=1)
     return book_df
 
-get_covers([15606],"Covers", "../tempData/sourceData/items.csv")
\ No newline at end of file
+
+if __name__ == '__main__':
+    get_covers([15606],"Covers", "../tempData/sourceData/items.csv")
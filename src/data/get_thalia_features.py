@@ -1,109 +1,197 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import pandas as pd
-import requests
 from bs4 import BeautifulSoup
 from datetime import datetime
 
+from src.data.catalog import Catalog, get_catalog
+from src.data.http_client import HttpClient, get_content
+from src.data.response_cache import CACHE_DIR, ResponseCache
+from src.data.thalia_page import parse_thalia_page
+
+logger = logging.getLogger(__name__)
+
+THALIA_URL = "https://www.thalia.de"
+FEATURES = ["itemID", "description", "rating", "number_pages", "recommended_age", "release_date", "language",
+            "thalia_ranking", "cover_url"]
+
 
-def get_thalia_features(books, book_source_path):
+def get_thalia_features(books, book_source_path, max_workers=8, requests_per_second=4, checkpoint_path=None,
+                        base_url=THALIA_URL, cache_dir=CACHE_DIR, client=None):
     """ Function to get all features scraped from Thalia for a list of books
 
+    The books are scraped concurrently by a pool of worker threads which share one HttpClient, so connections are
+    kept alive, failed requests are retried with backoff and the requests to Thalia are rate limited. With a
+    checkpoint_path every scraped book is appended to the checkpoint file and an interrupted run resumes with the
+    books that are not in it yet. Books whose scraping failed are not checkpointed, so the next run tries them again. Search and product pages are cached in cache_dir, which get_covers shares.
+
     Example: get_thalia_features(books_evaluation_list, "../tempData/sourceData/items.csv")
 
     Args:
         books (list): List of books with their unique ID from the data
         book_source_path: Path to the folder in which the item file is saved in
+        max_workers (int): Number of books scraped at the same time
+        requests_per_second (float): Maximum number of requests per second to Thalia
+        checkpoint_path (string): JSON lines file with the already scraped books, no checkpoint if None
+        base_url (string): Thalia URL, can point to a local stand-in server
+        cache_dir (string): Folder of the response cache, pages are not cached if None
+        client (HttpClient): Client for the requests, one is created from max_workers, requests_per_second and
+            cache_dir if None
 
     Returns:
         Data Frame of all books (itemIDs) and their descriptions, rating, number of pages, age recommendation, release date, language, sales rank
     """
-    book_source = get_book_df(book_source_path)
-
-    df_list =[]
-    count = 0
-    for book_id in books:
-        count = count +1
-        try:
-            # Get the Thalia URL based on the title
-            url_book = get_url(book_id, book_source)
-            if url_book != '':
-                page = requests.get(url_book)
-                soup = BeautifulSoup(page.content, "html.parser")
-                dict_description = {"itemID": book_id,
-                                    "description": get_description(book_id,book_source, soup),
-                                    "rating": get_rating(book_id, book_source, soup),
-                                    "number_pages": get_number_pages(book_id, book_source, soup),
-                                    "recommended_age": get_recommended_age(book_id, book_source, soup),
-                                    "release_date": get_release_date(book_id, book_source, soup),
-                                    "language": get_language(book_id, book_source, soup),
-                                    "thalia_ranking": get_thalia_ranking(book_id, book_source, soup),
-                                    "cover_url": get_cover(book_id, book_source, soup)}
-                df_list.append(dict_description)
-            else:
-                print("Error included:" + str(count))
-                dict_description = {"itemID": book_id,
-                                    "description": '',
-                                    "rating": '',
-                                    "number_pages": '',
-                                    "recommended_age": '',
-                                    "release_date": '',
-                                    "language": '',
-                                    "thalia_ranking": '',
-                                    "cover_url": ''}
-                df_list.append(dict_description)
-        except:
-            dict_description = {"itemID": book_id,
-                                        "description": 'error',
-                                        "rating": 'error',
-                                        "number_pages": 'error',
-                                        "recommended_age": 'error',
-                                        "release_date": 'error',
-                                        "language": 'error',
-                                        "thalia_ranking": 'error',
-                                        "cover_url": 'error'}
-            df_list.append(dict_description)
-        if count % 50 == 0:
-            print(count)
-    df_descriptions = pd.DataFrame.from_dict(df_list)
-    
+    book_source = Catalog(get_book_df(book_source_path))
+    if client is None:
+        cache = None if cache_dir is None else ResponseCache(cache_dir)
+        client = HttpClient(max_connections=max_workers, requests_per_second=requests_per_second, cache=cache)
+
+    scraped = load_checkpoint(checkpoint_path)
+    todo = [book_id for book_id in dict.fromkeys(books) if book_id not in scraped]
+
+    count = len(books) - len(todo)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(scrape_book, book_id, book_source, client, base_url) for book_id in todo]
+        for future in as_completed(futures):
+            dict_description = future.result()
+            scraped[dict_description["itemID"]] = dict_description
+            if not is_error(dict_description):
+                save_checkpoint(checkpoint_path, dict_description)
+            count = count + 1
+            if count % 50 == 0:
+                logger.info('scraped %d of %d books', count, len(books))
+
+    df_descriptions = pd.DataFrame.from_dict([scraped[book_id] for book_id in books])
+
     return df_descriptions
 
 
-def get_url(book_id, book_source):
-    """ Function to get the correct URL to scrape a book from Thalia
+def scrape_book(book_id, book_source, client, base_url=THALIA_URL):
+    """ Function to scrape all Thalia features of one book
 
-        Example: get_url(203421, book_source)
+        Example: scrape_book(203421, book_source, HttpClient())
 
         Args:
             book_id (id): unique ID of a book from the DMCUP
-            book_source (dataframe): DF containing all the books considered
+            book_source (Catalog or dataframe): Catalog or DF containing all the books considered
+            client (HttpClient): Client for the requests
+            base_url (string): Thalia URL
 
         Returns:
-            url to the Thalia webpage of the book as a String
+            Dictionary with the features of the book, they are '' if the book was not found and 'error' if scraping
+            failed
         """
     try:
-        # Get the title based on the itemID
-        title = book_source.loc[(book_source['itemID'] == book_id)]["title"].item()
-    
         # Get the Thalia URL based on the title
-        url_search = "https://www.thalia.de/suche?filterPATHROOT=&sq=" + title
-        page = requests.get(url_search)
-        soup = BeautifulSoup(page.content, 'html.parser')
-        href = soup.find_all('a', caption="suchergebnis-klick")[0]['href']
-        url_book = "https://www.thalia.de" + href
-    except:
-        url_book = ''
-    
-    return url_book
+        url_book = get_url(book_id, book_source, client, base_url)
+        if url_book != '':
+            page = parse_thalia_page(client.get_content(url_book))
+            dict_description = {"itemID": book_id, **page.to_dict()}
+        else:
+            logger.info('book %s not found on Thalia', book_id)
+            dict_description = dict.fromkeys(FEATURES, '')
+            dict_description["itemID"] = book_id
+    except Exception:
+        logger.warning('scraping book %s failed', book_id, exc_info=True)
+        dict_description = dict.fromkeys(FEATURES, 'error')
+        dict_description["itemID"] = book_id
+
+    return dict_description
+
+
+def is_error(dict_description):
+    """ Whether scrape_book failed for a book, its features are 'error' then
+        """
+    # the rating of a scraped book is a number or ''
+    return dict_description["rating"] == 'error'
+
+
+def load_checkpoint(checkpoint_path):
+    """ Function to load the books scraped by an earlier run, failed books of older checkpoints are skipped
+
+        Args:
+            checkpoint_path (string): JSON lines file written by save_checkpoint, nothing is loaded if None or missing
+
+        Returns:
+            Dictionary from itemID to the features of the book
+        """
+    scraped = {}
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return scraped
+
+    with open(checkpoint_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                dict_description = json.loads(line)
+            except ValueError:
+                # the last line is incomplete if the run was killed while writing it
+                continue
+            if is_error(dict_description):
+                continue
+            if dict_description["release_date"] != '':
+                dict_description["release_date"] = datetime.fromisoformat(dict_description["release_date"])
+            scraped[dict_description["itemID"]] = dict_description
+
+    return scraped
+
+
+def save_checkpoint(checkpoint_path, dict_description):
+    """ Function to append a scraped book to the checkpoint file, does nothing if checkpoint_path is None
+        """
+    if checkpoint_path is None:
+        return
+
+    # itemIDs may be numpy integers, which json does not serialize
+    dict_description = dict(dict_description, itemID=int(dict_description["itemID"]))
+    with open(checkpoint_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(dict_description, default=str, ensure_ascii=False) + '\n')
+
+
+def get_url(book_id, book_source, client=None, base_url=THALIA_URL):
+    """ Function to get the correct URL to scrape a book from Thalia
+
+        Example: get_url(203421, book_source)
+
+        Args:
+            book_id (id): unique ID of a book from the DMCUP
+            book_source (Catalog or dataframe): Catalog or DF containing all the books considered
+            client (HttpClient): Client for the request, plain requests.get if None
+            base_url (string): Thalia URL
+
+        Returns:
+            url to the Thalia webpage of the book as a String, '' if the book is not in book_source or the search found
+            nothing. Failed search requests raise, so the book is not mistaken for one that Thalia does not have
+        """
+    # Get the title based on the itemID
+    catalog = get_catalog(book_source)
+    if book_id not in catalog:
+        return ''
+    title = catalog.get_title(book_id)
+
+    # Get the Thalia URL based on the title
+    url_search = base_url + "/suche?filterPATHROOT=&sq=" + str(title)
+    soup = BeautifulSoup(get_content(url_search, client), 'html.parser')
+    links = soup.find_all('a', caption="suchergebnis-klick", href=True)
+    if not links:
+        return ''
+
+    return base_url + links[0]['href']
 
 
 def get_description(book_id, book_source, soup):
     """ Function to scrape a description of a book based on its ID
 
+        The getters parse a BeautifulSoup tree each, scrape_book uses the single pass parse_thalia_page of
+        thalia_page.py instead. They are the reference of benchmark_thalia_page.py.
+
         Example: get_description(203421, book_source)
 
         Args:
             book_id (id): unique ID of a book from the DMCUP
-            book_source (dataframe): DF containing all the books considered
+            book_source (Catalog or dataframe): Catalog or DF containing all the books considered
             soup (bs4.BeautifulSoup): Content of Thalia webpage of the book as BeautifulSoup object
 
         Returns:
@@ -119,35 +207,6 @@ def get_description(book_id, book_source, soup):
 
     return des
 
-def get_cover(book_id, book_source):
-    """ Function to scrape a cover of a book based on its ID and save it in a certain folder
-
-        Example: get_cover(203421, book_source)
-
-        Args:
-            book_id (id): unique ID of a book from the DMCUP
-            book_source (dataframe): DF containing all the books considered
-
-        Returns:
-            Saves a scraped cover image
-        """
-    # Get the title based on the itemID
-    title = book_source.loc[(book_source['itemID'] == book_id)]["title"].item()
-
-    # Get the Thalia URL based on the title
-    url_search = "https://www.thalia.de/suche?filterPATHROOT=&sq=" + title
-    page = requests.get(url_search)
-    soup = BeautifulSoup(page.content, 'html.parser')
-    href = soup.find_all('a', caption="suchergebnis-klick")[0]['href']
-    url_book = "https://www.thalia.de" + href
-
-    # Scrape the Cover from
-    page = requests.get(url_book)
-    soup = BeautifulSoup(page.content, "html.parser")
-    cover = soup.find_all('img', class_='largeImg')[0]['src']
-    name = str(book_id)
-    return image_
-
 def get_rating(book_id, book_source, soup):
     """ Function to scrape a rating of a book based on its ID
 
@@ -155,7 +214,7 @@ def get_rating(book_id, book_source, soup):
 
         Args:
             book_id (id): unique ID of a book from the DMCUP
-            book_source (dataframe): DF containing all the books considered
+            book_source (Catalog or dataframe): Catalog or DF containing all the books considered
             soup (bs4.BeautifulSoup): Content of Thalia webpage of the book as BeautifulSoup object
 
         Returns:
@@ -176,7 +235,7 @@ def get_number_pages(book_id, book_source, soup):
 
         Args:
             book_id (id): unique ID of a book from the DMCUP
-            book_source (dataframe): DF containing all the books considered
+            book_source (Catalog or dataframe): Catalog or DF containing all the books considered
             soup (bs4.BeautifulSoup): Content of Thalia webpage of the book as BeautifulSoup object
 
         Returns:
@@ -197,7 +256,7 @@ def get_recommended_age(book_id, book_source, soup):
 
         Args:
             book_id (id): unique ID of a book from the DMCUP
-            book_source (dataframe): DF containing all the books considered
+            book_source (Catalog or dataframe): Catalog or DF containing all the books considered
             soup (bs4.BeautifulSoup): Content of Thalia webpage of the book as BeautifulSoup object
 
         Returns:
@@ -218,7 +277,7 @@ def get_release_date(book_id, book_source, soup):
 
         Args:
             book_id (id): unique ID of a book from the DMCUP
-            book_source (dataframe): DF containing all the books considered
+            book_source (Catalog or dataframe): Catalog or DF containing all the books considered
             soup (bs4.BeautifulSoup): Content of Thalia webpage of the book as BeautifulSoup object
 
         Returns:
@@ -239,7 +298,7 @@ def get_language(book_id, book_source, soup):
 
         Args:
             book_id (id): unique ID of a book from the DMCUP
-            book_source (dataframe): DF containing all the books considered
+            book_source (Catalog or dataframe): Catalog or DF containing all the books considered
             soup (bs4.BeautifulSoup): Content of Thalia webpage of the book as BeautifulSoup object
 
         Returns:
@@ -260,7 +319,7 @@ def get_thalia_ranking(book_id, book_source, soup):
 
         Args:
             book_id (id): unique ID of a book from the DMCUP
-            book_source (dataframe): DF containing all the books considered
+            book_source (Catalog or dataframe): Catalog or DF containing all the books considered
             soup (bs4.BeautifulSoup): Content of Thalia webpage of the book as BeautifulSoup object
 
         Returns:
@@ -281,7 +340,7 @@ def get_cover(book_id, book_source, soup):
 
         Args:
             book_id (id): unique ID of a book from the DMCUP
-            book_source (dataframe): DF containing all the books considered
+            book_source (Catalog or dataframe): Catalog or DF containing all the books considered
 
         Returns:
             Saves a scraped cover image
@@ -305,11 +364,14 @@ def get_book_df(path):
             Returns:
                 Data Frame which contains the IDs and the titles
             """
-    book_df = pd.read_csv(path, delimiter='|', sep='.', encoding='utf-8')
+    book_df = pd.read_csv(path, delimiter='|', encoding='utf-8')
     book_df = book_df.drop('main topic', axis=1).drop('subtopics', axis=1)
     return book_df
 
-df = pd.read_csv('../../data/external/items.csv', delimiter = '|')
-list = df['itemID'].to_list()
-thalia_features = get_thalia_features(list[70000:], "../../data/external/items.csv")
-thalia_features.to_pickle('../../data/external/thalia_features_end.pkl')
\ No newline at end of file
+
+if __name__ == '__main__':
+    df = pd.read_csv('../../data/external/items.csv', delimiter = '|')
+    list = df['itemID'].to_list()
+    thalia_features = get_thalia_features(list[70000:], "../../data/external/items.csv",
+                                          checkpoint_path='../../data/external/thalia_features_end.jsonl')
+    thalia_features.to_pickle('../../data/external/thalia_features_end.pkl')
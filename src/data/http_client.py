@@ -0,0 +1,102 @@
+"""Shared HTTP client for the scrapers.
+
+  One requests session is shared by all worker threads, so connections are pooled and kept alive. Failed requests
+  are retried with exponential backoff and every host is rate limited to a number of requests per second. With a
+  ResponseCache, get_content serves pages that were downloaded before from disk.
+
+  Typical usage example:
+
+    >> client = HttpClient(max_connections=8, requests_per_second=4)
+    >> page = client.get("https://www.thalia.de/suche?filterPATHROOT=&sq=Tintenherz")
+"""
+
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class RateLimiter:
+    """Spaces the requests to every host by at least 1 / requests_per_second seconds."""
+
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self.next_request = {}
+        self.lock = threading.Lock()
+
+    def wait(self, host):
+        """Blocks until the next request to host is allowed."""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_request.get(host, now))
+            self.next_request[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class HttpClient:
+    """Thread-safe GET client with connection pooling, retries with backoff and per host rate limiting."""
+
+    def __init__(self, max_connections=8, requests_per_second=4, retries=3, backoff_factor=0.5, timeout=10,
+                 cache=None):
+        """
+        Args:
+            max_connections (int): Size of the connection pool per host, should match the number of workers.
+            requests_per_second (float): Maximum request rate per host, no limit if 0 or None.
+            retries (int): Number of retries of failed connections and of the status codes in RETRY_STATUS.
+            backoff_factor (float): Retry number n waits backoff_factor * 2 ** (n - 1) seconds.
+            timeout (float): Timeout of a single request in seconds.
+            cache (ResponseCache): Cache of the bodies returned by get_content, nothing is cached if None.
+        """
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUS,
+                      allowed_methods=frozenset(['GET']))
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.timeout = timeout
+        self.cache = cache
+
+    def get(self, url, stream=False):
+        """GET request, raises requests.HTTPError for error status codes that are left after the retries.
+
+        Args:
+            url (string): Requested url.
+            stream (bool): Do not download the body right away, see requests.Response.iter_content.
+
+        Returns:
+            The requests.Response.
+        """
+        self.rate_limiter.wait(urlparse(url).netloc)
+        response = self.session.get(url, timeout=self.timeout, stream=stream)
+        response.raise_for_status()
+        return response
+
+    def get_content(self, url):
+        """Body of a successful GET request, served from the cache if possible."""
+        if self.cache is not None:
+            content = self.cache.get(url)
+            if content is not None:
+                return content
+
+        content = self.get(url).content
+        if self.cache is not None:
+            self.cache.set(url, content)
+        return content
+
+
+def get_content(url, client=None):
+    """Body of url, downloaded with client or with a plain requests.get if client is None. Error status codes raise
+    requests.HTTPError either way."""
+    if client is None:
+        response = requests.get(url)
+        response.raise_for_status()
+        return response.content
+    return client.get_content(url)
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 import click
 import logging
+import os
 from pathlib import Path
 from dotenv import find_dotenv, load_dotenv
 
+from src.data.catalog_store import BOOKS_FILE, build_catalog, load_books_csv, write_catalog
+
 
 @click.command()
 @click.argument('input_filepath', type=click.Path(exists=True))
@@ -15,6 +18,12 @@ def main(input_filepath, output_filepath):
     logger = logging.getLogger(__name__)
     logger.info('making final data set from raw data')
 
+    books = load_books_csv(os.path.join(input_filepath, 'items.csv'))
+    catalog = build_catalog(input_filepath, books)
+    write_catalog(catalog, output_filepath)
+    write_catalog(books, output_filepath, BOOKS_FILE)
+    logger.info('wrote catalog of %d items and %d books to %s', len(catalog), len(books), output_filepath)
+
 
 if __name__ == '__main__':
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -1,101 +1,138 @@
+import functools
+import hashlib
+import logging
+import os
+import shelve
+
+import numpy as np
 import pandas as pd
-from textblob import TextBlob
+from scipy.sparse import csr_matrix
 from tqdm import tqdm
 
+from src import instrumentation
+from src.data.catalog_store import PREPROCESSING_COLUMNS, load_books_csv, read_catalog
+from src.features.language_detection import TitleLanguageDetector, detect_languages
+
 tqdm.pandas()
 
-def preprocess_books(items_path, books_path, evaluation_books_path):
-    evaluation_books = pd.read_csv(evaluation_books_path)
-    books = pd.read_csv(books_path, sep="|", dtype={"subtopic_query": "str"})
-    books["subtopics"][62923] = "[]"
+logger = logging.getLogger(__name__)
 
-    def to_list(x):
-        try:
-            return x.strip('][').split(', ')
-        except AttributeError:
-            return []
+# raw values of the language column and the language they are normalized to
+LANGUAGE_MAP = {
+    "Deutsch (Untertitel: Deutsch, Englisch, Dänisch, Holländisch, Finnisch, Französisch, Norwegisch, Schwedisch)": "Deutsch",
+    "Deutsch, Dänisch, Englisch, Finnisch, Französisch, Isländisch, Italienisch, Japanisch, Niederländisch, Norwegisch, Schwedisch, Spanisch (Untertitel: Deutsch, Englisch, Dänisch, Holländisch, Finnisch, Französisch, Italienisch, Japanisch, Norweg": "Deutsch",
+    "Deutsch, Dänisch, Englisch, Finnisch, Französisch, Italienisch, Niederländisch, Norwegisch, Schwedisch, Spanisch": "Deutsch",
+    "Deutsch, Englisch": "Englisch",
+    "Deutsch, Englisch (Untertitel: Deutsch)": "Englisch",
+    "Deutsch, Englisch, Französisch": "Englisch",
+    "Deutsch, Englisch, Französisch, Italienisch, Spanisch": "Deutsch",
+    "Deutsch, Englisch, Polnisch": "Englisch",
+    "Deutsch, Französisch (Untertitel: Deutsch)": "Englisch",
+    "Deutsch, Spanisch": "Deutsch",
+    "Englisch, Französisch": "Englisch",
+    "Finnisch": "Finnisch",
+    "Hindi": "Hindi",
+    "Portugiesisch": "Portugiesisch",
+    "Schwedisch": "Schwedisch",
+    "Ungarisch": "Ungarisch",
+    "Englisch, Spanisch": "Spanisch",
+    "Deutsch, Englisch (Untertitel: Deutsch, Englisch)": "Englisch",
+    "Deutsch, Japanisch (Untertitel: Deutsch)": "Englisch",
+    "Deutsch, Französisch": "Französisch",
+    "Deutsch (Untertitel: Deutsch)": "Englisch",
+    "Deutsch, Englisch (Untertitel: Englisch)": "Englisch",
+    "Deutsch, Englisch, Französisch, Italienisch, Niederländisch, Spanisch": "Deutsch",
+    "Deutsch, Italienisch": "Italienisch",
+    "Arabisch, Englisch": "Englisch",
+    "Deutsch, Japanisch": "Englisch",
+    "Deutsch, Englisch, Türkisch (Untertitel: Deutsch, Englisch, Türkisch)": "Englisch",
+    "Deutsch, Englisch, Französisch, Italienisch": "Englisch",
+    "Deutsch, Dänisch, Englisch, Französisch, Isländisch, Italienisch, Niederländisch, Norwegisch, Schwedisch, Spanisch (Untertitel: Englisch, Dänisch, Deutsch, Französisch, Holländisch, Italienisch, Norwegisch, Schwedisch, Spanisch)": "Englisch",
+    "Deutsch, Englisch, Französisch, Niederländisch (Untertitel: Deutsch, Englisch, Französisch)": "Englisch",
+    "Englisch, Italienisch": "Italienisch",
+    "Deutsch, Englisch, Spanisch": "Spanisch",
+    "Deutsch, Englisch, Französisch, Italienisch, Polnisch, Portugiesisch, Russisch, Spanisch": "Englisch",
+    "Deutsch, Englisch, Französisch, Niederländisch (Untertitel: Deutsch, Englisch, Französisch, Holländisch)": "Englisch",
+    "Arabisch, Deutsch, Dänisch, Englisch, Finnisch, Französisch, Hindi, Isländisch, Niederländisch, Norwegisch, Schwedisch, Spanisch (Untertitel: Deutsch, Englisch, Arabisch, Dänisch, Finnisch, Norwegisch, Schwedisch, Französisch, Holländisch, Hin": "Deutsch",
+    "Deutsch, Griechisch": "Deutsch",
+    "Deutsch (Untertitel: Deutsch, Englisch)": "Englisch",
+    "Chinesisch, Englisch": "Englisch",
+    "Deutsch, Schwedisch": "Schwedisch",
+    "Estnisch": "Baltisch",
+    "Litauisch": "Baltisch",
+    # codes of the former online language detection
+    "de": "Deutsch",
+    "en": "Englisch",
+    "haw": "Englisch",
+    "es": "Spanisch"
+}
 
-    books["subtopics"] = books.subtopics.progress_apply(to_list)
 
-    books.drop(["title", "author", "publisher"], axis=1, inplace=True)
+def normalize_categories(values, mapping):
+    """ Maps the values of a column with a normalization dict and returns them as categorical.
 
-    data = pd.read_csv(items_path, encoding='utf-8')
+    The mapping is applied once per distinct value through the categorical codes instead of once per row. Values that
+    are neither a key nor a target of the mapping are logged, see get_unknown_values.
 
-    data_merged = pd.merge(data, books, how="left", on="itemID")
+    Args:
+        values (series): Values to normalize, missing values stay missing.
+        mapping (dict): Mapping of raw value to normalized value, values without entry are kept.
+
+    Returns:
+        Categorical series with the index of values.
+    """
+    categorical = pd.Categorical(values)
+    unknown = get_unknown_values(values, mapping)
+    if len(unknown) > 0:
+        logger.warning("%d values of %s without normalization: %s", unknown.sum(), values.name, unknown.to_dict())
+
+    mapped = np.array([mapping.get(category, category) for category in categorical.categories], dtype=object)
+    categories, inverse = np.unique(mapped.astype(str), return_inverse=True)
+    codes = np.full(len(categorical), -1, dtype=np.int64)
+    present = categorical.codes >= 0
+    codes[present] = inverse[categorical.codes[present]]
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=values.index, name=values.name)
+
+
+def get_unknown_values(values, mapping):
+    """ Counts of the values that are neither a key nor a target of a normalization mapping.
+    """
+    known = set(mapping) | set(mapping.values())
+    counts = pd.Series(values).value_counts()
+    return counts[[value not in known for value in counts.index]]
+
+
+@instrumentation.timed("preprocessing.books")
+def preprocess_books(items_path, books_path, evaluation_books_path, language_cache_path=None, catalog_path=None):
+    evaluation_books = pd.read_csv(evaluation_books_path)
+    if catalog_path is not None:
+        # merged and cleaned once by make_dataset.py, see catalog_store.py
+        data_merged = read_catalog(catalog_path, columns=PREPROCESSING_COLUMNS)
+    else:
+        data_merged = load_books(items_path, books_path)
 
     data_merged.set_index("itemID", inplace=True)
 
-    data_merged.drop(
-        ["description", "number_pages", "recommended_age", "release_date", "publisher", "headerID", "mt_st_cl",
-         "description", "number_pages", "recommended_age", "release_date"], axis=1, inplace=True)
-
-    data_merged.replace(
-        {'language':
-             {
-                 "Deutsch (Untertitel: Deutsch, Englisch, Dänisch, Holländisch, Finnisch, Französisch, Norwegisch, Schwedisch)": "Deutsch",
-                 "Deutsch, Dänisch, Englisch, Finnisch, Französisch, Isländisch, Italienisch, Japanisch, Niederländisch, Norwegisch, Schwedisch, Spanisch (Untertitel: Deutsch, Englisch, Dänisch, Holländisch, Finnisch, Französisch, Italienisch, Japanisch, Norweg": "Deutsch",
-                 "Deutsch, Dänisch, Englisch, Finnisch, Französisch, Italienisch, Niederländisch, Norwegisch, Schwedisch, Spanisch": "Deutsch",
-                 "Deutsch, Englisch": "Englisch",
-                 "Deutsch, Englisch (Untertitel: Deutsch)": "Englisch",
-                 "Deutsch, Englisch, Französisch": "Englisch",
-                 "Deutsch, Englisch, Französisch, Italienisch, Spanisch": "Deutsch",
-                 "Deutsch, Englisch, Polnisch": "Englisch",
-                 "Deutsch, Französisch (Untertitel: Deutsch)": "Englisch",
-                 "Deutsch, Spanisch": "Deutsch",
-                 "Englisch, Französisch": "Englisch",
-                 "Finnisch": "Finnisch",
-                 "Hindi": "Hindi",
-                 "Portugiesisch": "Portugiesisch",
-                 "Schwedisch": "Schwedisch",
-                 "Ungarisch": "Ungarisch",
-                 "Englisch, Spanisch": "Spanisch",
-                 "Deutsch, Englisch (Untertitel: Deutsch, Englisch)": "Englisch",
-                 "Deutsch, Japanisch (Untertitel: Deutsch)": "Englisch",
-                 "Deutsch, Französisch": "Französisch",
-                 "Deutsch (Untertitel: Deutsch)": "Englisch",
-                 "Deutsch, Englisch (Untertitel: Englisch)": "Englisch",
-                 "Deutsch, Englisch, Französisch, Italienisch, Niederländisch, Spanisch": "Deutsch",
-                 "Deutsch, Italienisch": "Italienisch",
-                 "Arabisch, Englisch": "Englisch",
-                 "Deutsch, Japanisch": "Englisch",
-                 "Deutsch, Englisch, Türkisch (Untertitel: Deutsch, Englisch, Türkisch)": "Englisch",
-                 "Deutsch, Englisch, Französisch, Italienisch": "Englisch",
-                 "Deutsch, Dänisch, Englisch, Französisch, Isländisch, Italienisch, Niederländisch, Norwegisch, Schwedisch, Spanisch (Untertitel: Englisch, Dänisch, Deutsch, Französisch, Holländisch, Italienisch, Norwegisch, Schwedisch, Spanisch)": "Englisch",
-                 "Deutsch, Englisch, Französisch, Niederländisch (Untertitel: Deutsch, Englisch, Französisch)": "Englisch",
-                 "Englisch, Italienisch": "Italienisch",
-                 "Deutsch, Englisch, Spanisch": "Spanisch",
-                 "Deutsch, Englisch, Französisch, Italienisch, Polnisch, Portugiesisch, Russisch, Spanisch": "Englisch",
-                 "Deutsch, Englisch, Französisch, Niederländisch (Untertitel: Deutsch, Englisch, Französisch, Holländisch)": "Englisch",
-                 "Arabisch, Deutsch, Dänisch, Englisch, Finnisch, Französisch, Hindi, Isländisch, Niederländisch, Norwegisch, Schwedisch, Spanisch (Untertitel: Deutsch, Englisch, Arabisch, Dänisch, Finnisch, Norwegisch, Schwedisch, Französisch, Holländisch, Hin": "Deutsch",
-                 "Deutsch, Griechisch": "Deutsch",
-                 "Deutsch (Untertitel: Deutsch, Englisch)": "Englisch",
-                 "Chinesisch, Englisch": "Englisch",
-                 "Deutsch, Schwedisch": "Schwedisch",
-                 "Estnisch": "Baltisch",
-                 "Litauisch": "Baltisch"
-                 }
-         }, inplace=True)
+    data_merged["language"] = normalize_categories(data_merged["language"], LANGUAGE_MAP)
+    for column in ["author", "main topic"]:
+        data_merged[column] = data_merged[column].astype("category")
 
     query = data_merged.loc[evaluation_books.itemID]
     query.reset_index(inplace=True)
 
     index = query[pd.isna(query["language"])].itemID
     query.set_index("itemID", inplace=True)
-    for book_id in index:
-        text = query.loc[book_id]["title"]
-        lang = TextBlob(text)
-        query.at[book_id, 'language'] = lang.detect_language()
+    if len(index) > 0:
+        # offline detection trained on the catalog titles with known language, predictions are cached per itemID and
+        # the detector is only trained if a title is not in the cache
+        detector = functools.partial(TitleLanguageDetector.fit, data_merged["title"], data_merged["language"])
+        # cached languages may be outside the categories, they are normalized below
+        query["language"] = query["language"].astype(object)
+        query.loc[index, "language"] = detect_languages(detector, query.loc[index, "title"],
+                                                        cache_path=language_cache_path)
     query.reset_index(inplace=True)
 
-    query.replace(
-        {'language':
-            {
-                "de": "Deutsch",
-                "en": "Englisch",
-                "haw": "Englisch",
-                "es": "Spanisch"
-            }
-        }, inplace=True)
+    query["language"] = normalize_categories(query["language"], LANGUAGE_MAP)
 
     query.rename({"itemID": "id_query", "title": "title_query", "author": "author_query", "main topic": "topic_query",
                   "subtopics": "subtopic_query"}, axis=1, inplace=True)
@@ -109,14 +146,186 @@ def preprocess_books(items_path, books_path, evaluation_books_path):
     return query, data_merged
 
 
-def preprocess_language(query, document, nlp):
-    document["title_processed_document"] = document.title_document.progress_apply(
-        lambda sentence: [token.lemma_.lower() for token in nlp(sentence) if
-                          not token.is_punct and not token.is_stop])
-    query["title_processed_query"] = query.title_query.progress_apply(
-        lambda sentence: [token.lemma_.lower() for token in nlp(sentence) if
-                          not token.is_punct and not token.is_stop])
+def load_books(items_path, books_path):
+    """ Merges the scraped items with the main topic and subtopics of items.csv, like build_catalog does.
+    """
+    books = load_books_csv(books_path)
+    books.drop(["title", "author", "publisher"], axis=1, inplace=True)
+
+    data = pd.read_csv(items_path, encoding='utf-8')
+
+    data_merged = pd.merge(data, books, how="left", on="itemID")
+    data_merged["subtopics"] = [subtopics if isinstance(subtopics, list) else []
+                                for subtopics in data_merged["subtopics"]]
+    return data_merged[PREPROCESSING_COLUMNS]
+
+
+def tokenize_titles(query, document, nlp, cache_dir=None, batch_size=1000, n_process=1):
+    document["title_processed_document"] = lemmatize_titles(document.title_document, nlp, cache_dir=cache_dir,
+                                                            batch_size=batch_size, n_process=n_process)
+    query["title_processed_query"] = lemmatize_titles(query.title_query, nlp, cache_dir=cache_dir,
+                                                      batch_size=batch_size, n_process=n_process)
+
+
+@instrumentation.timed("preprocessing.lemmatize")
+def lemmatize_titles(titles, nlp, cache_dir=None, batch_size=1000, n_process=1):
+    """ Lower case lemmas of the titles without punctuation and stopwords.
+
+    Every distinct title is processed once with nlp.pipe, the parser, ner and textcat components are not run since
+    only lemmas and lexical attributes are needed. With a cache_dir the token lists are stored per model under the
+    sha1 of the title, so reruns only process titles that were not seen before.
+
+    Example: lemmatize_titles(document.title_document, nlp_en, cache_dir="../data/interim/token_cache")
+
+    Args:
+        titles (series): Titles to lemmatize.
+        nlp (spacy.Language): Loaded spacy pipeline.
+        cache_dir (string): Folder of the token cache, no cache is used if None.
+        batch_size (int): Number of titles per batch of nlp.pipe.
+        n_process (int): Number of worker processes of nlp.pipe.
+
+    Returns:
+        Series of token lists with the index of titles.
+    """
+    unique_titles = list(dict.fromkeys(titles))
+    cache = {}
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        meta = nlp.meta
+        cache = shelve.open(os.path.join(cache_dir, "{}_{}_{}".format(meta["lang"], meta["name"], meta["version"])))
+
+    try:
+        keys = {title: hashlib.sha1(title.encode("utf-8")).hexdigest() for title in unique_titles}
+        tokens = {title: cache[keys[title]] for title in unique_titles if keys[title] in cache}
+        missing = [title for title in unique_titles if title not in tokens]
+        instrumentation.count("preprocessing.cached_titles", len(tokens))
+        instrumentation.count("preprocessing.lemmatized_titles", len(missing))
+
+        disable = [name for name in ("parser", "ner", "textcat") if name in nlp.pipe_names]
+        docs = nlp.pipe(missing, batch_size=batch_size, n_process=n_process, disable=disable)
+        for title, doc in tqdm(zip(missing, docs), total=len(missing)):
+            tokens[title] = [token.lemma_.lower() for token in doc if not token.is_punct and not token.is_stop]
+            cache[keys[title]] = tokens[title]
+    finally:
+        if cache_dir is not None:
+            cache.close()
+
+    return titles.map(tokens)
+
+
+def preprocess_language(query, document, nlp, cache_dir=None, batch_size=1000, n_process=1):
+    tokenize_titles(query, document, nlp, cache_dir=cache_dir, batch_size=batch_size, n_process=n_process)
     cross = query.merge(document, how='cross')
     cross = cross[cross.id_query != cross.id_document]
 
-    return cross
\ No newline at end of file
+    return cross
+
+
+def preprocess_language_blocked(query, document, nlp, chunk_size=50, min_candidates=5, cache_dir=None,
+                                batch_size=1000, n_process=1):
+    """ Tokenizes the titles and yields the candidate pairs of generate_candidates instead of the full cross join.
+
+    Example: for cross in preprocess_language_blocked(query_en, document_en, nlp_en):
+                 search_recommendation(cross, recommendation_en)
+    """
+    tokenize_titles(query, document, nlp, cache_dir=cache_dir, batch_size=batch_size, n_process=n_process)
+    return generate_candidates(query, document, chunk_size=chunk_size, min_candidates=min_candidates)
+
+
+def get_blocking_keys(author, topic, subtopics, tokens):
+    """ Keys under which a book is put into the inverted index, two books are compared if they share a key.
+    """
+    keys = ["token:" + token for token in tokens]
+    if not pd.isna(author):
+        keys.append("author:" + author)
+    if not pd.isna(topic):
+        keys.append("topic:" + topic)
+    # books without subtopics have NaN instead of a list
+    if isinstance(subtopics, list):
+        keys.extend("subtopic:" + subtopic for subtopic in subtopics if subtopic != "")
+    return keys
+
+
+def get_incidence(frame, suffix, vocabulary, add_keys):
+    """ Sparse book x key matrix of the blocking keys of a query or document frame.
+    """
+    rows, columns = [], []
+    for row, book in enumerate(zip(frame["author_" + suffix], frame["topic_" + suffix],
+                                   frame["subtopic_" + suffix], frame["title_processed_" + suffix])):
+        for key in get_blocking_keys(*book):
+            if key not in vocabulary:
+                if not add_keys:
+                    continue
+                vocabulary[key] = len(vocabulary)
+            rows.append(row)
+            columns.append(vocabulary[key])
+    return rows, columns
+
+
+@instrumentation.timed("preprocessing.document_index")
+def get_document_index(document):
+    """ Inverted index of the blocking keys of the documents, generate_candidates can reuse it for many queries.
+
+    Returns:
+        Dictionary with the key vocabulary and the sparse key x document matrix.
+    """
+    vocabulary = {}
+    rows, columns = get_incidence(document.reset_index(drop=True), "document", vocabulary, add_keys=True)
+    document_keys = csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)),
+                               shape=(len(document), len(vocabulary)))
+    return {"vocabulary": vocabulary, "document_keys_t": document_keys.T.tocsr()}
+
+
+def generate_candidates(query, document, chunk_size=50, min_candidates=5, document_index=None):
+    """ Yields the query x document pairs that share an author, topic, subtopic or title token.
+
+    Inverted indexes over the documents replace the full cross join of preprocess_language. The pairs are yielded
+    in frames of chunk_size queries with the columns of the cross join, all pairs of a query are in the same frame,
+    so every frame can be passed to search_recommendation on its own. Every query is also paired with the first
+    min_candidates documents: the fill the rest step of the rule based model takes the pairs without a shared key in
+    document order, and the first of them that it can need are among these documents, so the recommendations are
+    those of the full cross join.
+
+    Args:
+        query (dataframe): Query books with title_processed_query column, see tokenize_titles.
+        document (dataframe): Document books with title_processed_document column.
+        chunk_size (int): Number of queries per yielded frame.
+        min_candidates (int): Number of first documents paired with every query, the number of recommendations.
+        document_index (dict): Index of get_document_index for document, it is built if None.
+
+    Returns:
+        Generator of cross join frames restricted to the candidate pairs.
+    """
+    query = query.reset_index(drop=True)
+    document = document.reset_index(drop=True)
+    if document_index is None:
+        document_index = get_document_index(document)
+
+    vocabulary = document_index["vocabulary"]
+    document_keys_t = document_index["document_keys_t"]
+    rows, columns = get_incidence(query, "query", vocabulary, add_keys=False)
+    query_keys = csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)),
+                            shape=(len(query), len(vocabulary)))
+    document_ids = document.id_document.to_numpy()
+    # one spare document in case the query is among them
+    first_documents = np.arange(min(len(document), min_candidates + 1))
+
+    for start in range(0, len(query), chunk_size):
+        # the stage ends before the yield, so the time the caller spends on the frame is not counted
+        with instrumentation.stage("preprocessing.candidates"):
+            shared = (query_keys[start:start + chunk_size] @ document_keys_t).tocsr()
+            query_rows, document_rows = [], []
+            for i in range(shared.shape[0]):
+                query_id = query.id_query.iat[start + i]
+                filler = first_documents[document_ids[first_documents] != query_id][:min_candidates]
+                candidates = np.union1d(shared.indices[shared.indptr[i]:shared.indptr[i + 1]], filler)
+                candidates = candidates[document_ids[candidates] != query_id]
+                query_rows.append(np.full(len(candidates), start + i))
+                document_rows.append(candidates.astype(int))
+
+            query_rows = np.concatenate(query_rows)
+            document_rows = np.concatenate(document_rows)
+            cross = query.iloc[query_rows].reset_index(drop=True).merge(
+                document.iloc[document_rows].reset_index(drop=True), left_index=True, right_index=True)
+        instrumentation.count("preprocessing.candidate_pairs", len(cross))
+        yield cross
@@ -0,0 +1,117 @@
+"""On-disk cache of HTTP response bodies.
+
+  The feature and cover scrapers request the same Thalia search and product pages. With a shared cache every page is
+  downloaded once, so features and cover of a book cost one product page fetch in total and re-runs are served from
+  disk. Bodies are stored in files named by the SHA-1 of their URL, entries expire after a time to live and the
+  oldest entries are evicted once the cache grows beyond its size limit. Eviction frees space down to a low-water
+  mark below the limit, so the cache directory is not walked again on every following write.
+
+  Typical usage example:
+
+    >> cache = ResponseCache("../../data/external/http_cache", ttl=7 * 24 * 3600)
+    >> client = HttpClient(cache=cache)
+    >> page = client.get_content("https://www.thalia.de/suche?filterPATHROOT=&sq=Tintenherz")
+"""
+
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+CACHE_DIR = '../../data/external/http_cache'
+
+
+class ResponseCache:
+    """Thread-safe URL to response body cache in a directory."""
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl=7 * 24 * 3600, max_bytes=2 * 1024 ** 3, low_water=0.9):
+        """
+        Args:
+            cache_dir (string): Directory of the cache, it is created if missing.
+            ttl (float): Seconds an entry is valid, entries never expire if None.
+            max_bytes (int): Size limit of all bodies, the oldest entries are evicted beyond it.
+            low_water (float): Fraction of max_bytes the cache is shrunk to by an eviction.
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.low_water_bytes = int(max_bytes * low_water)
+        self.lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.size = sum(size for _, _, size in self.get_entries())
+
+    def get_path(self, url):
+        """File of the body of url, the files are spread over subdirectories by the first two hash digits."""
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get_entries(self):
+        """Path, modification time and size of every cached body."""
+        entries = []
+        for folder, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def get(self, url):
+        """Cached body of url, None if it is not cached or expired."""
+        path = self.get_path(url)
+        try:
+            stat = os.stat(path)
+            if self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+                self.remove(path, stat.st_size)
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            # not cached or evicted by another thread
+            return None
+
+    def set(self, url, content):
+        """Caches the body of url and evicts the oldest entries if the cache is too large."""
+        path = self.get_path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temporary file first, so readers never see a partial body
+        tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+
+        with self.lock:
+            try:
+                self.size -= os.stat(path).st_size
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+            self.size += len(content)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def remove(self, path, size):
+        """Removes a cached body of known size."""
+        with self.lock:
+            try:
+                os.remove(path)
+                self.size -= size
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """Removes the oldest entries until the cache fits the low-water mark, the lock has to be held."""
+        for path, _, size in sorted(self.get_entries(), key=lambda entry: entry[1]):
+            if self.size <= self.low_water_bytes:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""Loader of the recommendation files the teams submitted.
+
+  The submissions come as CSV with or without header and index column, as Excel files or as itemID/predictions
+  lists. load_submission detects the format, normalizes the file to the columns of SUBMISSION_COLUMNS and validates
+  them. The normalized submission is stored once as uncompressed Arrow file with int32 ids and categorical model_id
+  and team_id, named by the hash of the file and the load options, so later loads memory-map it instead of parsing
+  the file again.
+
+  Typical usage example:
+
+    >> submission = load_submission("../data/processed/Team_05.csv", "../data/interim/submissions")
+    >> mannheimminers = load_submission("../data/processed/MannheimMinersModel3.csv", "../data/interim/submissions",
+                                        model_id="third")
+    >> submissions = load_submissions(["../data/processed/Team_05.csv", "../data/processed/team404_2.xlsx"],
+                                      "../data/interim/submissions")
+
+  All submissions of a folder can be converted into one file from the command line. The ids of the files in
+  KNOWN_OPTIONS are fixed on the way to the ids the website logged, further load options can be given as JSON file
+  by file name:
+
+    $ python src/data/submissions.py data/processed data/interim/submissions
+    $ python src/data/submissions.py data/processed data/interim/submissions --options submission_options.json
+"""
+
+import ast
+import hashlib
+import json
+import logging
+import os
+
+import click
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+RECOMMENDATION_COLUMNS = ['recommendation_{}'.format(i) for i in range(1, 6)]
+ID_COLUMNS = ['book_id'] + RECOMMENDATION_COLUMNS
+SUBMISSION_COLUMNS = ['book_id', 'model_id', 'team_id'] + RECOMMENDATION_COLUMNS
+SUBMISSIONS_FILE = 'submissions.arrow'
+
+CSV_EXTENSIONS = ('.csv', '.txt')
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+
+# part of the cache key, increase it when the normalization changes
+STORE_VERSION = 1
+
+# load options of the submission files whose ids differ from the ones the website logged, by file name
+KNOWN_OPTIONS = {
+    # the team_id column holds a different id in every row
+    'd2g2_results_2.xlsx': {'team_id': 'd2g2'},
+    # the model_id column holds 3, the website logged the model as third
+    'MannheimMinersModel3.csv': {'model_id': 'third'},
+    # the website logged model 2 as model_2
+    'MannheimMiners.csv': {'model_map': {'2': 'model_2'}},
+    # an itemID/predictions list without ids, the model was not live on the website
+    'evaluation_group7.csv': {'model_id': 'group7', 'team_id': 'group7'},
+}
+
+
+class MissingIdsError(ValueError):
+    """A submission without model_id or team_id, the ids have to be given as load options."""
+
+
+def read_submission_file(path):
+    """ Reads a submission file as it is, CSV files without header get the columns of SUBMISSION_COLUMNS.
+
+    Args:
+        path (string): Path of a CSV or Excel file.
+
+    Returns:
+        Dataframe of the file.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in EXCEL_EXTENSIONS:
+        return pd.read_excel(path)
+    if extension not in CSV_EXTENSIONS:
+        raise ValueError('unknown submission format {}'.format(extension))
+
+    with open(path, encoding='utf-8') as f:
+        header = f.readline()
+    if not any(column in header for column in ('book_id', 'itemID')):
+        return pd.read_csv(path, header=None, names=SUBMISSION_COLUMNS)
+    return pd.read_csv(path)
+
+
+def normalize_submission(frame, model_id=None, team_id=None, model_map=None):
+    """ Normalizes a read submission to SUBMISSION_COLUMNS.
+
+    Index columns are dropped, itemID/predictions lists are split into the recommendation columns, rows with
+    missing values are dropped like in the website pipeline and the ids are converted to int32.
+
+    Args:
+        frame (dataframe): Submission of read_submission_file.
+        model_id (string): Replaces the model_id column, e.g. to fix model ids or for files without it.
+        team_id (string): Replaces the team_id column.
+        model_map (dict): Renames single model ids of the model_id column, e.g. {"2": "model_2"}.
+
+    Returns:
+        Dataframe with the columns of SUBMISSION_COLUMNS, int32 ids and categorical model_id and team_id.
+    """
+    frame = frame.drop(columns=[column for column in frame.columns if str(column).startswith('Unnamed')])
+    frame = frame.rename(columns={'itemID': 'book_id'})
+
+    if 'predictions' in frame.columns:
+        predictions = [ast.literal_eval(value) if isinstance(value, str) else [] for value in frame['predictions']]
+        predictions = pd.DataFrame([values[:5] for values in predictions], index=frame.index)
+        frame[RECOMMENDATION_COLUMNS[:predictions.shape[1]]] = predictions
+    if model_id is not None:
+        frame['model_id'] = model_id
+    if team_id is not None:
+        frame['team_id'] = team_id
+
+    missing = [column for column in SUBMISSION_COLUMNS if column not in frame.columns]
+    if missing and set(missing) <= {'model_id', 'team_id'}:
+        raise MissingIdsError('submission misses the columns {}'.format(', '.join(missing)))
+    if missing:
+        raise ValueError('submission misses the columns {}'.format(', '.join(missing)))
+    frame = frame[SUBMISSION_COLUMNS].dropna().reset_index(drop=True)
+
+    ids = frame[ID_COLUMNS].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+    invalid = ~np.isfinite(ids) | (ids != np.round(ids)) | (ids < 0) | (ids > np.iinfo(np.int32).max)
+    if invalid.any():
+        rows = np.flatnonzero(invalid.any(axis=1))
+        raise ValueError('{} rows have ids that are no int32 itemIDs, first row {}'.format(len(rows), rows[0]))
+
+    frame[ID_COLUMNS] = ids.astype(np.int32)
+    for column in ['model_id', 'team_id']:
+        frame[column] = frame[column].astype(str).str.strip()
+    if model_map:
+        frame['model_id'] = frame['model_id'].replace({str(old): str(new) for old, new in model_map.items()})
+    frame[['model_id', 'team_id']] = frame[['model_id', 'team_id']].astype('category')
+    return frame
+
+
+def get_store_key(path, model_id=None, team_id=None, model_map=None):
+    """ SHA-256 of the file content and the load options, the name of the stored submission.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    sha256.update(json.dumps([STORE_VERSION, model_id, team_id, model_map], sort_keys=True).encode('utf-8'))
+    return sha256.hexdigest()
+
+
+def write_store(frame, path):
+    """ Writes a normalized submission as uncompressed Arrow file, written to a temporary file first.
+    """
+    tmp_path = path + '.tmp'
+    feather.write_feather(pa.Table.from_pandas(frame, preserve_index=False), tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+
+def read_store(path):
+    """ Memory-maps a stored submission.
+    """
+    return feather.read_table(path, memory_map=True).to_pandas()
+
+
+def load_submission(path, store_dir=None, model_id=None, team_id=None, model_map=None):
+    """ Loads a submission file, from the store if it was converted before.
+
+    Args:
+        path (string): Path of the submission file.
+        store_dir (string): Folder of the converted submissions, nothing is stored if None.
+        model_id (string): Replaces the model_id column, see normalize_submission.
+        team_id (string): Replaces the team_id column.
+        model_map (dict): Renames single model ids, see normalize_submission.
+
+    Returns:
+        Dataframe of normalize_submission.
+    """
+    if store_dir is None:
+        return normalize_submission(read_submission_file(path), model_id, team_id, model_map)
+
+    store_path = os.path.join(store_dir, get_store_key(path, model_id, team_id, model_map) + '.arrow')
+    if os.path.exists(store_path):
+        return read_store(store_path)
+
+    frame = normalize_submission(read_submission_file(path), model_id, team_id, model_map)
+    os.makedirs(store_dir, exist_ok=True)
+    write_store(frame, store_path)
+    return frame
+
+
+def load_submissions(paths, store_dir=None, options=None):
+    """ Loads several submission files into one dataframe.
+
+    Args:
+        paths (list): Paths of the submission files.
+        store_dir (string): Folder of the converted submissions, see load_submission.
+        options (dict): Keyword arguments of load_submission by path, e.g. {path: {"team_id": "d2g2"}}.
+
+    Returns:
+        Dataframe with the rows of all submissions, model_id and team_id stay categorical.
+    """
+    options = {} if options is None else options
+    frames = [load_submission(path, store_dir, **options.get(path, {})) for path in paths]
+    submissions = pd.concat(frames, ignore_index=True)
+    for column in ['model_id', 'team_id']:
+        submissions[column] = submissions[column].astype(str).astype('category')
+    return submissions
+
+
+def get_options(paths, options_path=None):
+    """ Load options of the submission files from KNOWN_OPTIONS and an options file.
+
+    Args:
+        paths (list): Paths of the submission files.
+        options_path (string): JSON file with the keyword arguments of load_submission by file name, e.g.
+            {"d2g2_results_2.xlsx": {"team_id": "d2g2"}}. Its entries replace those of KNOWN_OPTIONS.
+
+    Returns:
+        Dictionary with the options by path, see load_submissions.
+    """
+    options = dict(KNOWN_OPTIONS)
+    if options_path is not None:
+        with open(options_path, encoding='utf-8') as f:
+            options.update(json.load(f))
+    return {path: options[os.path.basename(path)] for path in paths if os.path.basename(path) in options}
+
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('store_dir', type=click.Path())
+@click.option('--options', 'options_path', type=click.Path(exists=True),
+              help='JSON file with model_id, team_id and model_map overrides by file name, added to KNOWN_OPTIONS.')
+def main(input_filepath, store_dir, options_path):
+    """ Converts every submission file in input_filepath and writes all of them to store_dir/submissions.arrow,
+        files that are no submissions are skipped.
+    """
+    logger = logging.getLogger(__name__)
+
+    names = [name for name in sorted(os.listdir(input_filepath)) if name.lower().endswith(CSV_EXTENSIONS +
+                                                                                          EXCEL_EXTENSIONS)]
+    options = get_options([os.path.join(input_filepath, name) for name in names], options_path)
+
+    paths = []
+    for name in names:
+        path = os.path.join(input_filepath, name)
+        try:
+            load_submission(path, store_dir, **options.get(path, {}))
+        except MissingIdsError as e:
+            logger.warning('skipped %s: %s, add its ids to the options', name, e)
+            continue
+        except ValueError as e:
+            logger.info('skipped %s: %s', name, e)
+            continue
+        paths.append(path)
+
+    submissions = load_submissions(paths, store_dir, options)
+    write_store(submissions, os.path.join(store_dir, SUBMISSIONS_FILE))
+    logger.info('stored %d recommendations of %d models from %d files', len(submissions),
+                submissions.groupby(['team_id', 'model_id'], observed=True).ngroups, len(paths))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
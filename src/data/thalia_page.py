@@ -0,0 +1,123 @@
+"""Extraction of the book features from a Thalia product page.
+
+  The page is parsed once with lxml and all features are read with precompiled XPath expressions, the product detail
+  rows in a single pass. The result is a typed ThaliaPage record with None for missing features.
+
+  Typical usage example:
+
+    >> page = parse_thalia_page(client.get_content(url_book))
+    >> page.number_pages
+    368
+"""
+
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+import lxml.html
+from lxml import etree
+
+# tags that are kept as text in the description, it ends at the first other tag
+DESCRIPTION_TAGS = frozenset(['p', 'b', 'br'])
+
+
+def has_class(name):
+    """XPath condition for elements with the CSS class name."""
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(name)
+
+
+DESCRIPTION = etree.XPath("(//div[{}])[1]".format(has_class('text-infos')))
+RATING = etree.XPath("count((//div[{}])[1]//span[{}])".format(has_class('oRating'), has_class('active')))
+HAS_RATING = etree.XPath("boolean(//div[{}])".format(has_class('oRating')))
+DETAILS = etree.XPath("//tr[@data-test][td]")
+COVER = etree.XPath("(//img[{}])[1]/@src".format(has_class('largeImg')))
+
+
+class ThaliaPage(NamedTuple):
+    """Features of a book on its Thalia product page, None if the page does not have them."""
+    description: Optional[str] = None
+    rating: Optional[int] = None
+    number_pages: Optional[int] = None
+    recommended_age: Optional[str] = None
+    release_date: Optional[datetime] = None
+    language: Optional[str] = None
+    thalia_ranking: Optional[int] = None
+    cover_url: Optional[str] = None
+
+    def to_dict(self):
+        """Features as dictionary with '' for missing features like the getters of get_thalia_features.py."""
+        return {feature: '' if value is None else value for feature, value in self._asdict().items()}
+
+
+def parse_thalia_page(content):
+    """ Extracts all features from a Thalia product page.
+
+    Args:
+        content (bytes): HTML of the product page.
+
+    Returns:
+        ThaliaPage with the features of the page.
+    """
+    try:
+        root = lxml.html.document_fromstring(content)
+    except etree.ParserError:
+        # empty or non-HTML page
+        return ThaliaPage()
+
+    details = {}
+    for row in DETAILS(root):
+        details.setdefault(row.get('data-test'), row.find('td').text_content().strip())
+
+    descriptions = DESCRIPTION(root)
+    covers = COVER(root)
+    return ThaliaPage(description=get_description_text(descriptions[0]) if descriptions else None,
+                      rating=int(RATING(root)) if HAS_RATING(root) else None,
+                      number_pages=to_int(details.get('produktdetails_seitenzahl')),
+                      recommended_age=details.get('produktdetails_altersempfehlung'),
+                      release_date=to_date(details.get('produktdetails_erscheinungsdatum')),
+                      language=details.get('produktdetails_sprache'),
+                      thalia_ranking=to_int(details.get('produktdetails_verkaufsrang')),
+                      cover_url=str(covers[0]) if covers else None)
+
+
+def get_description_text(element):
+    """ Text of the description div, paragraphs and bold text are kept and the text ends at the first other tag.
+
+    A line break right after bold text, as after a heading, becomes a space.
+    """
+    parts = [element.text or '']
+    collect_description_text(element, parts)
+    return ''.join(parts)
+
+
+def collect_description_text(element, parts):
+    """ Appends the text of the children of element to parts, returns False once a tag ends the description.
+    """
+    for child in element:
+        if not isinstance(child.tag, str) or child.tag not in DESCRIPTION_TAGS:
+            return False
+        previous = child.getprevious()
+        if child.tag == 'br' and previous is not None and previous.tag == 'b' and not previous.tail:
+            parts.append(' ')
+        parts.append(child.text or '')
+        if not collect_description_text(child, parts):
+            return False
+        parts.append(child.tail or '')
+    return True
+
+
+def to_int(text):
+    """ Integer of a detail value, None if it is missing or not an integer.
+    """
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_date(text):
+    """ Date of a detail value in the format dd.mm.yyyy, None if it is missing or invalid.
+    """
+    try:
+        return datetime.strptime(text, '%d.%m.%Y')
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,86 @@
+"""Fuzzy author similarity over the deduplicated authors of the catalog.
+
+  Authors repeat heavily across books, so every distinct author string is scored once per query and the score is
+  spread to the books afterwards. A character bigram index only passes authors sharing at least one bigram with the
+  query to the exact fuzzy matching, which is done in bulk with rapidfuzz.
+
+  The score is the one of get_authorscores_fuzzy in recommendations.py: 1 + ratio if the fuzzywuzzy partial ratio is
+  above 0.7 and the ratio above 0.5, 0 otherwise and for missing authors.
+
+  Typical usage example:
+
+    >> index = AuthorIndex(items_df['author'])
+    >> scores = index.get_scores(["Joanne K. Rowling", "Stephen King"])
+"""
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz
+from rapidfuzz import fuzz as rapid_fuzz, process
+from sklearn.feature_extraction.text import CountVectorizer
+
+
+class AuthorIndex:
+    """Distinct authors of a list of books with their character bigram incidence matrix."""
+
+    def __init__(self, authors, blocking=True):
+        """
+        Args:
+            authors (array): Author of every book, missing authors are allowed.
+            blocking (bool): Only score authors sharing a character bigram with the query. Without blocking every
+                distinct author is scored.
+        """
+        codes, uniques = pd.factorize(pd.Series(authors, dtype=object))
+        # missing authors point to an extra column that always scores 0
+        self.codes = np.where(codes < 0, len(uniques), codes)
+        self.authors = [str(author) for author in uniques]
+        self.blocking = blocking
+
+        self.vectorizer = CountVectorizer(analyzer='char', ngram_range=(2, 2), binary=True,
+                                          preprocessor=lambda x: ' ' + x.lower() + ' ')
+        self.incidence = self.vectorizer.fit_transform(self.authors) if self.authors else None
+
+    def get_candidates(self, authors):
+        """Returns for every query author the positions of the distinct authors it shares a bigram with."""
+        if not self.blocking:
+            return [np.arange(len(self.authors))] * len(authors)
+        shared = (self.vectorizer.transform(authors) @ self.incidence.T).tocsr()
+        return [shared.indices[shared.indptr[i]:shared.indptr[i + 1]] for i in range(len(authors))]
+
+    def get_unique_scores(self, authors):
+        """Author scores of the query authors against every distinct author.
+
+        Args:
+            authors (list): Query authors, empty strings are treated as missing.
+
+        Returns:
+            Dense array of shape (len(authors), number of distinct authors + 1), the last column belongs to
+            missing authors.
+        """
+        scores = np.zeros((len(authors), len(self.authors) + 1))
+        if not self.authors:
+            return scores
+
+        for i, (author, candidates) in enumerate(zip(authors, self.get_candidates(authors))):
+            if author == '' or len(candidates) == 0:
+                continue
+            names = [self.authors[j] for j in candidates]
+            # fuzzywuzzy rounds to whole percents, rapidfuzz ratio only differs by that rounding
+            ratio = np.rint(process.cdist([author], names, scorer=rapid_fuzz.ratio, workers=-1)[0]) / 100
+            # partial_ratio of rapidfuzz aligns differently than fuzzywuzzy, it is only needed for the few pairs
+            # that already pass the ratio cutoff
+            for j in np.flatnonzero(ratio > 0.5):
+                if fuzz.partial_ratio(author, names[j]) / 100 > 0.70:
+                    scores[i, candidates[j]] = 1 + ratio[j]
+        return scores
+
+    def get_scores(self, authors):
+        """Author scores of the query authors against every indexed book.
+
+        Args:
+            authors (list): Query authors, empty strings are treated as missing.
+
+        Returns:
+            Dense array of shape (len(authors), number of indexed books).
+        """
+        return self.get_unique_scores(authors)[:, self.codes]
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""Sparse item x item co-occurrence matrix built from the transactions.
+
+  For an item i and an item j the matrix holds, per channel, what recommend_based_on_transactions in
+  baseline_transaction.py sums up for j when asked for i: the clicks, baskets and orders of j in all sessions that
+  contain i. The sessions channel counts the shared sessions, so items that only co-occur without any interaction are
+  still candidates. A further matrix holds the first transaction row of j in the sessions of i, the baseline ranks
+  ties in that order. The matrix is built once offline and a query is a single row slice, a batch of queries one
+  slice of all its rows.
+
+  Typical usage example:
+
+    >> matrix = CooccurrenceMatrix.build(df_transactions)
+    >> matrix.save("../models/cooccurrence")
+    >> matrix = CooccurrenceMatrix.load("../models/cooccurrence")
+    >> item_ids, scores = matrix.get_ranking(22120)
+    >> rankings = matrix.get_rankings([22120, 15606])
+
+  The matrix can also be built from the command line:
+
+    $ python src/features/cooccurrence.py data/raw/transactions.csv models/cooccurrence
+"""
+
+import logging
+import os
+
+import click
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+CHANNELS = ('sessions', 'click', 'basket', 'order')
+
+# the baseline ranks by the plain sum of clicks, baskets and orders
+DEFAULT_WEIGHTS = {'sessions': 0, 'click': 1, 'basket': 1, 'order': 1}
+
+
+class CooccurrenceMatrix:
+    """One sparse item x item matrix per channel over the items seen in the transactions."""
+
+    def __init__(self, channels, item_ids, first_rows=None):
+        """
+        Args:
+            channels (dict): CSR matrix of every channel in CHANNELS, rows and columns follow item_ids.
+            item_ids (array): itemID of every row and column.
+            first_rows (scipy.sparse.csr_matrix): First transaction row plus one of every co-occurring item in the
+                sessions of the row item, see get_first_rows. Without it ties are ranked by first appearance in all
+                transactions.
+        """
+        self.channels = {name: sparse.csr_matrix(matrix) for name, matrix in channels.items()}
+        self.item_ids = np.asarray(item_ids)
+        self.first_rows = None if first_rows is None else sparse.csr_matrix(first_rows)
+        self.position_by_id = pd.Series(np.arange(len(self.item_ids)), index=self.item_ids)
+
+    @classmethod
+    def build(cls, df_transactions):
+        """Builds the matrices from the transactions.
+
+        Args:
+            df_transactions (dataframe): Transactions with sessionID, itemID, click, basket and order column.
+
+        Returns:
+            The CooccurrenceMatrix of the transactions.
+        """
+        session_codes, sessions = pd.factorize(df_transactions['sessionID'])
+        # items are numbered by first appearance in the transactions, ties are ranked in that order
+        item_codes, item_ids = pd.factorize(df_transactions['itemID'])
+        shape = (len(sessions), len(item_ids))
+
+        def session_item(values):
+            # duplicate (session, item) rows are summed up
+            return sparse.csr_matrix((values, (session_codes, item_codes)), shape=shape, dtype=np.float64)
+
+        contains = session_item(np.ones(len(df_transactions)))
+        contains.data[:] = 1
+        contains_t = contains.T.tocsr()
+
+        channels = {'sessions': contains_t @ contains}
+        for name in CHANNELS[1:]:
+            channels[name] = contains_t @ session_item(df_transactions[name].to_numpy())
+        return cls(channels, item_ids, get_first_rows(session_codes, item_codes, len(item_ids)))
+
+    @classmethod
+    def load(cls, path):
+        """Loads a matrix written by save.
+
+        Args:
+            path (string): Folder of the matrix.
+
+        Returns:
+            The stored CooccurrenceMatrix.
+        """
+        channels = {name: sparse.load_npz(os.path.join(path, name + '.npz')) for name in CHANNELS}
+        item_ids = np.load(os.path.join(path, 'item_ids.npy'), allow_pickle=True)
+        first_rows = None
+        if os.path.exists(os.path.join(path, 'first_rows.npz')):
+            first_rows = sparse.load_npz(os.path.join(path, 'first_rows.npz'))
+        return cls(channels, item_ids, first_rows)
+
+    def save(self, path):
+        """Writes every channel and the itemIDs into a folder.
+
+        Args:
+            path (string): Folder of the matrix, it is created if it does not exist.
+        """
+        os.makedirs(path, exist_ok=True)
+        for name, matrix in self.channels.items():
+            sparse.save_npz(os.path.join(path, name + '.npz'), matrix)
+        np.save(os.path.join(path, 'item_ids.npy'), self.item_ids, allow_pickle=True)
+        if self.first_rows is not None:
+            sparse.save_npz(os.path.join(path, 'first_rows.npz'), self.first_rows)
+
+    def get_scores(self, item_id, weights=None):
+        """Weighted co-occurrence of an item with every item it shares a session with.
+
+        Args:
+            item_id (int): itemID of the query book.
+            weights (dict): Weight per channel, DEFAULT_WEIGHTS if not given.
+
+        Returns:
+            Tuple of the co-occurring itemIDs (the item itself included) and their scores in item order. Both are
+            empty if the item never occurs in the transactions.
+        """
+        weights = DEFAULT_WEIGHTS if weights is None else weights
+        position = self.position_by_id.get(item_id)
+        if position is None:
+            return self.item_ids[:0], np.zeros(0)
+
+        row = self.channels['sessions'][position]
+        columns = row.indices
+        scores = np.zeros(len(columns))
+        for name, weight in weights.items():
+            if weight:
+                scores += weight * self.channels[name][position, columns].toarray().ravel()
+        order = np.argsort(columns, kind='stable')
+        return self.item_ids[columns[order]], scores[order]
+
+    def get_ranking(self, item_id, weights=None, k=None):
+        """Co-occurring items sorted by score like the sum ranking of the baseline.
+
+        Args:
+            item_id (int): itemID of the query book.
+            weights (dict): Weight per channel, DEFAULT_WEIGHTS if not given.
+            k (int): Only return the k best items, all if None.
+
+        Returns:
+            Tuple of itemIDs and scores, best first. Ties keep the order of first appearance in the transactions of
+            the sessions of the item.
+        """
+        return self.get_rankings([item_id], weights, k)[0]
+
+    def get_rankings(self, item_ids, weights=None, k=None):
+        """get_ranking for many items, every channel is sliced once for all of them.
+
+        Args:
+            item_ids (array): itemIDs of the query books.
+            weights (dict): Weight per channel, DEFAULT_WEIGHTS if not given.
+            k (int): Only return the k best items per query, all if None.
+
+        Returns:
+            List with a tuple of itemIDs and scores per query, best first. Both are empty for items that never occur
+            in the transactions.
+        """
+        weights = DEFAULT_WEIGHTS if weights is None else weights
+        positions = self.position_by_id.reindex(np.asarray(item_ids)).to_numpy()
+        known = ~np.isnan(positions)
+        rows = positions[known].astype(np.int64)
+
+        # the sessions channel holds every co-occurring item, the weighted channels are a subset of its pattern
+        pattern = self.channels['sessions'][rows]
+        pattern.sort_indices()
+        weighted = sparse.csr_matrix(pattern.shape)
+        for name, weight in weights.items():
+            if weight:
+                weighted = weighted + weight * self.channels[name][rows]
+        weighted = sparse.csr_matrix(weighted)
+        weighted.sort_indices()
+        first_rows = None
+        if self.first_rows is not None:
+            # same pattern as the sessions channel, so the sorted rows line up with the columns
+            first_rows = self.first_rows[rows]
+            first_rows.sort_indices()
+
+        rankings = [(self.item_ids[:0], np.zeros(0))] * len(positions)
+        for i, position in enumerate(np.flatnonzero(known)):
+            columns = pattern.indices[pattern.indptr[i]:pattern.indptr[i + 1]]
+            row = slice(weighted.indptr[i], weighted.indptr[i + 1])
+            scores = np.zeros(len(columns))
+            scores[np.searchsorted(columns, weighted.indices[row])] = weighted.data[row]
+            # ties in order of first appearance in the sessions of the query, like the dictionary of the baseline
+            ties = columns if first_rows is None else first_rows.data[first_rows.indptr[i]:first_rows.indptr[i + 1]]
+            best = np.lexsort((columns, ties, -scores))[:k]
+            rankings[position] = (self.item_ids[columns[best]], scores[best])
+        return rankings
+
+
+def get_first_rows(session_codes, item_codes, n_items):
+    """First transaction row of every item j in the sessions that contain item i.
+
+    Every session pairs each of its items with each of its items, the minimum over the sessions of i of the first
+    row of j in the session is kept. The pairs are the same the sessions channel sums up.
+
+    Args:
+        session_codes (array): Session code of every transaction row.
+        item_codes (array): Item code of every transaction row.
+        n_items (int): Number of item codes.
+
+    Returns:
+        CSR item x item matrix with the first row plus one, so row 0 is kept as explicit entry.
+    """
+    first = pd.DataFrame({'session': session_codes, 'item': item_codes, 'row': np.arange(len(session_codes))})
+    first = first.groupby(['session', 'item'], sort=True)['row'].min()
+    sessions = first.index.get_level_values('session').to_numpy()
+    items = first.index.get_level_values('item').to_numpy()
+    rows = first.to_numpy()
+
+    counts = np.bincount(sessions)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    sizes = counts[sessions]
+    left = np.repeat(np.arange(len(items)), sizes)
+    offsets = np.arange(len(left)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    right = np.repeat(starts[sessions], sizes) + offsets
+
+    pairs = pd.DataFrame({'i': items[left], 'j': items[right], 'row': rows[right]})
+    pairs = pairs.groupby(['i', 'j'], sort=False)['row'].min()
+    return sparse.csr_matrix((pairs.to_numpy() + 1, (pairs.index.get_level_values('i'),
+                                                     pairs.index.get_level_values('j'))),
+                             shape=(n_items, n_items), dtype=np.int64)
+
+
+@click.command()
+@click.argument('transactions_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+def main(transactions_filepath, output_filepath):
+    """ Builds the co-occurrence matrix of transactions.csv and saves it to output_filepath.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info('building co-occurrence matrix from transactions')
+
+    df_transactions = pd.read_csv(transactions_filepath, sep='|')
+    matrix = CooccurrenceMatrix.build(df_transactions)
+    matrix.save(output_filepath)
+
+    logger.info('saved co-occurrence of %d items', len(matrix.item_ids))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
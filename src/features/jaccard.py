@@ -1,4 +1,10 @@
+from itertools import chain
+
+import numpy as np
 import pandas as pd
+from scipy.sparse import csr_matrix
+
+from src import instrumentation
 
 
 def jaccard(vector_source, vector_target):
@@ -10,21 +16,99 @@ def jaccard(vector_source, vector_target):
         Returns:
             array: Array containing jaccard similarity.
     """
-    df = pd.DataFrame()
-    df['original'] = vector_source
-    df['translated'] = vector_target
-
-    def jaccard_similarity_score(original, translation):
-        """ Calculate jaccard similarity between two lists.
-        """
-        intersect = set(original).intersection(set(translation))
-        union = set(original).union(set(translation))
-        try:
-            return len(intersect) / len(union)
-        except ZeroDivisionError:
-            return 0
-
-    jaccard_vec = df.progress_apply(lambda x: jaccard_similarity_score(x.original,
-                                                                       x.translated),
-                                    axis=1)
-    return jaccard_vec
+    vocabulary = {}
+    source = get_token_incidence(vector_source, vocabulary)
+    target = get_token_incidence(vector_target, vocabulary)
+    index = vector_source.index if isinstance(vector_source, pd.Series) else None
+    return pd.Series(jaccard_pairs(source, target), index=index)
+
+
+@instrumentation.timed('jaccard.incidence')
+def get_token_incidence(token_lists, vocabulary=None):
+    """ Binary token incidence matrix of token lists.
+        Args:
+            token_lists (array): Array of token lists.
+            vocabulary (dict): Mapping of token to column, new tokens are added to it. Share it between source and
+                target so both matrices have the same columns.
+
+        Returns:
+            csr_matrix: One row per token list, 1 for every token it contains.
+    """
+    vocabulary = {} if vocabulary is None else vocabulary
+    token_lists = list(token_lists)
+    lengths = [len(tokens) for tokens in token_lists]
+    columns = [vocabulary.setdefault(token, len(vocabulary)) for token in chain.from_iterable(token_lists)]
+    rows = np.repeat(np.arange(len(token_lists)), lengths)
+    incidence = csr_matrix((np.ones(len(columns), dtype=np.int32), (rows, columns)),
+                           shape=(len(token_lists), len(vocabulary)))
+    # duplicate tokens are counted once like in a set
+    incidence.data[:] = 1
+    return incidence
+
+
+def align_columns(source, target):
+    """ Pads two incidence matrices to the same number of columns.
+
+        A shared vocabulary only grows, so the matrix built first may have fewer columns.
+    """
+    columns = max(source.shape[1], target.shape[1])
+    source = csr_matrix((source.data, source.indices, source.indptr), shape=(source.shape[0], columns))
+    target = csr_matrix((target.data, target.indices, target.indptr), shape=(target.shape[0], columns))
+    return source, target
+
+
+def jaccard_from_counts(intersection, size_source, size_target):
+    """ Jaccard similarity from intersection and set sizes, 0 if both sets are empty.
+    """
+    union = size_source + size_target - intersection
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, intersection / np.maximum(union, 1), 0.0)
+
+
+@instrumentation.timed('jaccard.pairs')
+def jaccard_pairs(source, target):
+    """ Calculate jaccard similarity between the rows of two incidence matrices with equal shape.
+        Args:
+            source (csr_matrix): Token incidence of the source token lists.
+            target (csr_matrix): Token incidence of the target token lists, row i is compared with row i of source.
+
+        Returns:
+            array: Array containing jaccard similarity of every row pair.
+    """
+    source, target = align_columns(source, target)
+    intersection = np.asarray(source.multiply(target).sum(axis=1)).ravel()
+    return jaccard_from_counts(intersection, np.diff(source.indptr), np.diff(target.indptr))
+
+
+@instrumentation.timed('jaccard.matrix')
+def jaccard_matrix(source, target):
+    """ Calculate jaccard similarity between all rows of two incidence matrices.
+        Args:
+            source (csr_matrix): Token incidence of the query token lists.
+            target (csr_matrix): Token incidence of the document token lists, same vocabulary as source.
+
+        Returns:
+            array: Dense array of shape (source rows, target rows) with the jaccard similarity of every pair.
+    """
+    source, target = align_columns(source, target)
+    intersection = (source @ target.T).toarray()
+    return jaccard_from_counts(intersection, np.diff(source.indptr)[:, np.newaxis],
+                               np.diff(target.indptr)[np.newaxis, :])
+
+
+def jaccard_top_k(source, target, k=5):
+    """ Find the k most jaccard similar target rows for every source row.
+        Args:
+            source (csr_matrix): Token incidence of the query token lists.
+            target (csr_matrix): Token incidence of the document token lists, same vocabulary as source.
+            k (int): Number of documents per query.
+
+        Returns:
+            tuple: Arrays of shape (source rows, k) with the target rows and their similarity, best first.
+    """
+    scores = jaccard_matrix(source, target)
+    k = min(k, scores.shape[1])
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.lexsort((best, -best_scores), axis=1)
+    return np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
@@ -0,0 +1,89 @@
+"""Offline language identification of book titles.
+
+  A character n-gram naive Bayes model is trained on the titles of the catalog whose language is known and predicts
+  the language of the remaining titles in one vectorized call. Predictions can be cached per itemID, so repeated
+  preprocessing runs are deterministic and need neither network access nor retraining.
+
+  Typical usage example:
+
+    >> detector = TitleLanguageDetector.fit(data_merged["title"], data_merged["language"])
+    >> languages = detect_languages(detector, query.loc[missing, "title"], cache_path="../data/interim/languages.json")
+
+    >> # trains the detector only if a title is not cached yet
+    >> fit = functools.partial(TitleLanguageDetector.fit, data_merged["title"], data_merged["language"])
+    >> languages = detect_languages(fit, query.loc[missing, "title"], cache_path="../data/interim/languages.json")
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.pipeline import make_pipeline
+
+
+class TitleLanguageDetector:
+    """Character n-gram classifier from title to the language names used in the catalog."""
+
+    def __init__(self, model):
+        self.model = model
+
+    @classmethod
+    def fit(cls, titles, languages, min_titles=5):
+        """Trains the classifier on titles with known language.
+
+        Args:
+            titles (array): Titles of the books.
+            languages (array): Language of every title, books without language are skipped.
+            min_titles (int): Languages with fewer titles are not learned.
+
+        Returns:
+            The fitted TitleLanguageDetector.
+        """
+        data = pd.DataFrame({'title': np.asarray(titles, dtype=object), 'language': np.asarray(languages, dtype=object)})
+        data = data.dropna()
+        counts = data['language'].value_counts()
+        data = data[data['language'].isin(counts[counts >= min_titles].index)]
+
+        model = make_pipeline(TfidfVectorizer(analyzer='char_wb', ngram_range=(1, 3), lowercase=True,
+                                              sublinear_tf=True),
+                              MultinomialNB(alpha=0.1))
+        model.fit(data['title'].astype(str), data['language'])
+        return cls(model)
+
+    def predict(self, titles):
+        """Predicts the language of every title."""
+        return self.model.predict([str(title) for title in titles])
+
+
+def detect_languages(detector, titles, cache_path=None):
+    """Languages of titles, served from a per itemID cache where possible.
+
+    Args:
+        detector (TitleLanguageDetector or callable): Fitted detector, or a function without arguments returning one,
+            which is only called if a title is not in the cache.
+        titles (series): Titles indexed by itemID.
+        cache_path (string): JSON file with the already detected languages, it is updated with the new ones.
+
+    Returns:
+        Series of languages with the index of titles.
+    """
+    cache = {}
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path, encoding='utf-8') as f:
+            cache = json.load(f)
+
+    keys = [str(item_id) for item_id in titles.index]
+    missing = [i for i, key in enumerate(keys) if key not in cache]
+    if missing:
+        if not isinstance(detector, TitleLanguageDetector):
+            detector = detector()
+        predicted = detector.predict(titles.iloc[missing])
+        cache.update({keys[i]: language for i, language in zip(missing, predicted)})
+        if cache_path is not None:
+            with open(cache_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False)
+
+    return pd.Series([cache[key] for key in keys], index=titles.index)
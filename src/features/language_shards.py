@@ -0,0 +1,72 @@
+"""Catalog split into one shard per language.
+
+  The shards reproduce filter_on_lang of recommendations.py: a query book is compared with all books of its language,
+  or with the full catalog if its language has too few books. The split is done once with a single groupby and every
+  shard keeps the features that were built for it, so scoring a query only touches the rows of its own shard.
+
+  Typical usage example:
+
+    >> shards = LanguageShards(items_df)
+    >> shard_df = shards.get_shard("Deutsch")
+    >> features = shards.get_features("Deutsch", lambda key, shard_df: {"size": len(shard_df)})
+"""
+
+import numpy as np
+
+
+class LanguageShards:
+    """Row positions of every language shard plus the features built per shard."""
+
+    def __init__(self, items_df, min_size=5):
+        """
+        Args:
+            items_df (dataframe): Catalog with a language column, its index is reset.
+            min_size (int): Languages with this many books or fewer fall back to the full catalog.
+        """
+        self.items_df = items_df.reset_index(drop=True)
+        self.min_size = min_size
+
+        groups = self.items_df.groupby('language', sort=False, observed=True).indices
+        self.rows = {language: np.sort(rows) for language, rows in groups.items() if len(rows) > min_size}
+        self.rows[None] = np.arange(len(self.items_df))
+        self.features = {}
+
+    def get_key(self, language):
+        """Returns the shard a language is served from, None is the full catalog."""
+        try:
+            return language if language in self.rows else None
+        except TypeError:
+            # unhashable values such as lists have no shard
+            return None
+
+    def get_keys(self, languages):
+        """Vectorized get_key for an array of languages."""
+        return np.array([self.get_key(language) for language in languages], dtype=object)
+
+    def get_rows(self, language):
+        """Catalog row positions of the shard of a language in catalog order."""
+        return self.rows[self.get_key(language)]
+
+    def get_shard(self, language):
+        """The rows of the catalog that filter_on_lang keeps for a language."""
+        return self.items_df.iloc[self.get_rows(language)]
+
+    def get_features(self, language, build):
+        """Returns the features of the shard of a language, building them on first use.
+
+        Args:
+            language (string): Language of the query book.
+            build (function): Called as build(key, shard_df) once per shard, its result is cached.
+
+        Returns:
+            The cached result of build for the shard.
+        """
+        key = self.get_key(language)
+        if key not in self.features:
+            self.features[key] = build(key, self.get_shard(key))
+        return self.features[key]
+
+    def build_all(self, build):
+        """Builds the features of every shard up front, e.g. before serving queries."""
+        for key in self.rows:
+            self.get_features(key, build)
@@ -0,0 +1,155 @@
+"""Persistent tf-idf index over book titles.
+
+  The index is fitted once on a set of titles (usually one language partition of the catalog) and stored on disk as
+  CSR matrix together with the vocabulary and idf weights, so title similarities can be served without refitting the
+  vectorizer for every query.
+
+  Typical usage example:
+
+    >> index = TitleIndex.fit(items_df['title'], items_df['itemID'])
+    >> path = os.path.join("../models/title_index", get_index_name("Deutsch"))
+    >> index.save(path)
+    >> index = TitleIndex.load(path)
+    >> index.is_current(items_df['title'], items_df['itemID'])
+    >> scores = index.get_scores([0, 1, 2])
+"""
+
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+
+def get_index_name(key):
+    """ Folder name of the index of a partition key, None is the partition of all books.
+
+    The readable part alone can collide, e.g. "Deutsch, Englisch" and "Deutsch Englisch", so the sha1 of the key is
+    appended.
+    """
+    key = '' if key is None else str(key)
+    readable = re.sub(r'\W+', '_', key).strip('_')[:40] or 'all'
+    return '{}_{}'.format(readable, hashlib.sha1(('key:' + key).encode('utf-8')).hexdigest()[:16])
+
+
+def get_titles_hash(titles):
+    """ SHA-256 of the titles as they are vectorized, detects changed titles under unchanged itemIDs.
+    """
+    sha256 = hashlib.sha256()
+    for title in titles:
+        sha256.update(str(np.str_(title)).encode('utf-8'))
+        sha256.update(b'\0')
+    return sha256.hexdigest()
+
+
+class TitleIndex:
+    """Row normalised tf-idf matrix of titles with the vectorizer state needed to transform new titles."""
+
+    def __init__(self, matrix, vocabulary, idf, item_ids, titles_hash=None):
+        """
+        Args:
+            matrix (scipy.sparse.csr_matrix): l2 normalised tf-idf vectors, one row per title.
+            vocabulary (dict): Mapping of token to column of the matrix.
+            idf (array): idf weight of every column.
+            item_ids (array): itemID of every row.
+            titles_hash (string): get_titles_hash of the indexed titles, unknown if None.
+        """
+        self.matrix = sparse.csr_matrix(matrix)
+        self.vocabulary = vocabulary
+        self.idf = np.asarray(idf)
+        self.item_ids = np.asarray(item_ids)
+        self.titles_hash = titles_hash
+        self._vectorizer = None
+
+    @classmethod
+    def fit(cls, titles, item_ids):
+        """Fits the tf-idf vectorizer on the titles the same way get_titlescores does.
+
+        Args:
+            titles (array): Titles of the books, missing titles are vectorized as 'nan' like in get_titlescores.
+            item_ids (array): itemID of every title.
+
+        Returns:
+            The fitted TitleIndex.
+        """
+        titles = list(titles)
+        vectorizer = TfidfVectorizer()
+        matrix = vectorizer.fit_transform([np.str_(title) for title in titles])
+        index = cls(matrix, vectorizer.vocabulary_, vectorizer.idf_, item_ids, get_titles_hash(titles))
+        index._vectorizer = vectorizer
+        return index
+
+    @classmethod
+    def load(cls, path):
+        """Loads an index written by save.
+
+        Args:
+            path (string): Folder of the index.
+
+        Returns:
+            The stored TitleIndex.
+        """
+        matrix = sparse.load_npz(os.path.join(path, 'matrix.npz'))
+        with open(os.path.join(path, 'vocabulary.json'), encoding='utf-8') as f:
+            vocabulary = json.load(f)
+        idf = np.load(os.path.join(path, 'idf.npy'))
+        item_ids = np.load(os.path.join(path, 'item_ids.npy'), allow_pickle=True)
+        titles_hash = None
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+                titles_hash = json.load(f)['titles_hash']
+        return cls(matrix, vocabulary, idf, item_ids, titles_hash)
+
+    def save(self, path):
+        """Writes the matrix, vocabulary, idf weights and itemIDs into a folder.
+
+        Args:
+            path (string): Folder of the index, it is created if it does not exist.
+        """
+        os.makedirs(path, exist_ok=True)
+        sparse.save_npz(os.path.join(path, 'matrix.npz'), self.matrix)
+        with open(os.path.join(path, 'vocabulary.json'), 'w', encoding='utf-8') as f:
+            json.dump({token: int(column) for token, column in self.vocabulary.items()}, f, ensure_ascii=False)
+        np.save(os.path.join(path, 'idf.npy'), self.idf)
+        np.save(os.path.join(path, 'item_ids.npy'), self.item_ids, allow_pickle=True)
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'titles_hash': self.titles_hash}, f)
+
+    def is_current(self, titles, item_ids):
+        """Whether the index was fitted on exactly these titles and itemIDs, indexes without titles hash are stale."""
+        return (self.titles_hash is not None and np.array_equal(self.item_ids, np.asarray(item_ids))
+                and self.titles_hash == get_titles_hash(titles))
+
+    def get_scores(self, positions):
+        """Cosine similarity of some indexed titles with all indexed titles.
+
+        Args:
+            positions (array): Rows of the query titles in the index.
+
+        Returns:
+            Dense array of shape (len(positions), number of indexed titles).
+        """
+        # rows are l2 normalised, so one sparse product gives the cosine similarities of the whole batch
+        return (self.matrix[positions] @ self.matrix.T).toarray()
+
+    def get_scores_for_titles(self, titles):
+        """Cosine similarity of titles that are not part of the index with all indexed titles.
+
+        Args:
+            titles (array): Query titles.
+
+        Returns:
+            Dense array of shape (len(titles), number of indexed titles).
+        """
+        query = self.transform(titles)
+        return (query @ self.matrix.T).toarray()
+
+    def transform(self, titles):
+        """Vectorizes titles with the vocabulary and idf weights of the index."""
+        if self._vectorizer is None:
+            self._vectorizer = TfidfVectorizer(vocabulary=self.vocabulary)
+            self._vectorizer.idf_ = self.idf
+        return self._vectorizer.transform([np.str_(title) for title in titles])
@@ -0,0 +1,80 @@
+"""Integer codes for the levels of the Thema main topic hierarchy.
+
+  get_mtopicscores in recommendations.py scores a book with 1 if its main topic equals the one of the query, with
+  0.7 if the first three characters match, with 0.3 if the first two characters match and 0 otherwise. Here every
+  level is encoded once into integers, so the scores of many queries are a few integer comparisons against the
+  distinct topics of the catalog.
+
+  Typical usage example:
+
+    >> topics = TopicCodes(items_df['mt'].str.strip(' []'))
+    >> scores = topics.get_scores(["FMB", "YFH"])
+"""
+
+import numpy as np
+import pandas as pd
+
+# prefix length of every hierarchy level (None is the full code) and its score
+LEVELS = ((None, 1), (3, 0.7), (2, 0.3))
+
+
+class TopicCodes:
+    """Distinct main topics of a list of books encoded per hierarchy level."""
+
+    def __init__(self, topics):
+        """
+        Args:
+            topics (array): Main topic of every book without brackets, missing topics are allowed.
+        """
+        codes, uniques = pd.factorize(pd.Series(topics, dtype=object))
+        # missing topics point to an extra column that always scores 0
+        self.codes = np.where(codes < 0, len(uniques), codes)
+        self.topics = [str(topic) for topic in uniques]
+
+        self.vocabularies = []
+        self.unique_codes = []
+        for length, _ in LEVELS:
+            prefixes = pd.Series([topic[:length] for topic in self.topics], dtype=object)
+            level_codes, level_uniques = pd.factorize(prefixes)
+            self.vocabularies.append({prefix: code for code, prefix in enumerate(level_uniques)})
+            self.unique_codes.append(level_codes.astype(np.int32))
+
+    def encode(self, topics):
+        """Integer codes of topics per level.
+
+        Args:
+            topics (array): Main topics without brackets, missing values are allowed.
+
+        Returns:
+            Array of shape (len(topics), number of levels). Missing or unknown values are -1 and never match.
+        """
+        encoded = np.full((len(topics), len(LEVELS)), -1, dtype=np.int32)
+        for i, topic in enumerate(topics):
+            if not isinstance(topic, str):
+                continue
+            for level, (length, _) in enumerate(LEVELS):
+                encoded[i, level] = self.vocabularies[level].get(topic[:length], -1)
+        return encoded
+
+    def get_unique_scores(self, topics):
+        """Topic scores of the query topics against every distinct topic.
+
+        Returns:
+            Dense array of shape (len(topics), number of distinct topics + 1), the last column belongs to missing
+            topics.
+        """
+        encoded = self.encode(topics)
+        conditions = [self.unique_codes[level][np.newaxis, :] == encoded[:, [level]] for level in range(len(LEVELS))]
+        scores = np.select(conditions, [score for _, score in LEVELS], default=0.0)
+        return np.hstack([scores, np.zeros((len(topics), 1))])
+
+    def get_scores(self, topics):
+        """Topic scores of the query topics against every encoded book.
+
+        Args:
+            topics (array): Main topics of the query books without brackets.
+
+        Returns:
+            Dense array of shape (len(topics), number of encoded books).
+        """
+        return self.get_unique_scores(topics)[:, self.codes]
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""Stage timers, counters and profiling of the recommendation pipelines.
+
+  The scoring code marks its stages with stage("hybrid.title") blocks and counts its work with count(). While the
+  instrumentation is disabled, which is the default, stage returns a shared no-op context and count returns at once,
+  so the marks can stay in the hot loops. Enabled, every stage records its calls and wall time, optionally with a
+  cProfile of the stage or a sampling profiler that attributes the stacks of the instrumented threads to the active
+  stages. The samples are written in the collapsed stack format of py-spy, flamegraph.pl and speedscope.
+
+  The instrumentation is switched at runtime with enable and disable, or at import with the environment variable
+  RECOMMENDER_INSTRUMENTATION set to 1 (timers), profile (timers and cProfile) or sample (timers and sampling). With
+  RECOMMENDER_INSTRUMENTATION_REPORT set to a path, the report is written there when the process exits, e.g.
+
+    $ RECOMMENDER_INSTRUMENTATION=profile RECOMMENDER_INSTRUMENTATION_REPORT=reports/timing.json \
+          python src/models/recommendations.py
+
+  Typical usage example:
+
+    >> from src import instrumentation
+    >> instrumentation.enable(profile=True, profile_stages=["hybrid.transactions"])
+    >> item_ids, scores = scorer.top_k(df_evaluation["itemID"])
+    >> instrumentation.write_report("../reports/top_k_timing.json")
+    >> instrumentation.disable()
+
+    >> with instrumentation.stage("rule_based.search"):
+    >>     search_recommendation(cross, recommendation)
+"""
+
+import atexit
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+ENVIRONMENT_VARIABLE = 'RECOMMENDER_INSTRUMENTATION'
+REPORT_VARIABLE = 'RECOMMENDER_INSTRUMENTATION_REPORT'
+
+NULL_STAGE = contextlib.nullcontext()
+
+
+class Stage:
+    """Context of one enabled stage, records its wall time and profiles it if requested."""
+
+    __slots__ = ('instrumentation', 'name', 'start', 'profile')
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.profile = None
+
+    def __enter__(self):
+        state = self.instrumentation.get_thread_state()
+        if not state['stack']:
+            self.instrumentation.register_thread(state['stack'])
+        state['stack'].append(self.name)
+        # a cProfile covers its nested stages, so only the outermost profiled stage of a thread gets one
+        if self.instrumentation.profiles_stage(self.name) and state['profile'] is None:
+            self.profile = state['profile'] = cProfile.Profile()
+            self.profile.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        state = self.instrumentation.get_thread_state()
+        if self.profile is not None:
+            self.profile.disable()
+            state['profile'] = None
+            self.instrumentation.add_profile(self.name, self.profile)
+        state['stack'].pop()
+        if not state['stack']:
+            self.instrumentation.unregister_thread()
+        self.instrumentation.record(self.name, seconds)
+        return False
+
+
+class Instrumentation:
+    """Stage timers, counters, cProfiles and stack samples of all threads."""
+
+    def __init__(self):
+        self.enabled = False
+        self.profile = False
+        self.profile_stages = None
+        self.sample_interval = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.threads = {}
+        self.sampler = None
+        self.reset()
+
+    def reset(self):
+        """Drops all recorded times, counts, profiles and samples."""
+        with self.lock:
+            self.stages = {}
+            self.counters = Counter()
+            self.profiles = {}
+            self.samples = Counter()
+            self.started = time.time()
+
+    def enable(self, profile=False, profile_stages=None, sample_interval=None):
+        """Starts recording.
+
+        Args:
+            profile (bool): Run a cProfile in the profiled stages.
+            profile_stages (list): Names of the profiled stages, all stages if None.
+            sample_interval (float): Seconds between two stack samples of the instrumented threads, no sampling if
+                None.
+        """
+        self.profile = profile
+        self.profile_stages = None if profile_stages is None else frozenset(profile_stages)
+        self.sample_interval = sample_interval
+        self.enabled = True
+        if sample_interval is not None and self.sampler is None:
+            self.sampler = Sampler(self, sample_interval)
+            self.sampler.start()
+
+    def disable(self):
+        """Stops recording, the recorded data is kept until reset."""
+        self.enabled = False
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler = None
+
+    def stage(self, name):
+        """Context manager timing the block as stage name."""
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name)
+
+    def count(self, name, n=1):
+        """Adds n to the counter name."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] += n
+
+    def get_thread_state(self):
+        """Stage stack and active cProfile of the current thread."""
+        state = getattr(self.local, 'state', None)
+        if state is None:
+            state = self.local.state = {'stack': [], 'profile': None}
+        return state
+
+    def register_thread(self, stack):
+        """Makes the stage stack of the current thread visible to the sampler while the thread is in a stage."""
+        with self.lock:
+            self.threads[threading.get_ident()] = stack
+
+    def unregister_thread(self):
+        with self.lock:
+            self.threads.pop(threading.get_ident(), None)
+
+    def profiles_stage(self, name):
+        return self.profile and (self.profile_stages is None or name in self.profile_stages)
+
+    def add_profile(self, name, profile):
+        """Merges the finished cProfile of one call of a stage into the stats of the stage."""
+        with self.lock:
+            stats = self.profiles.get(name)
+            if stats is None:
+                self.profiles[name] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+
+    def record(self, name, seconds):
+        with self.lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                self.stages[name] = {'calls': 1, 'total': seconds, 'min': seconds, 'max': seconds}
+            else:
+                stats['calls'] += 1
+                stats['total'] += seconds
+                stats['min'] = min(stats['min'], seconds)
+                stats['max'] = max(stats['max'], seconds)
+
+    def add_sample(self, stack):
+        with self.lock:
+            self.samples[stack] += 1
+
+    def get_report(self, top=20):
+        """Recorded data as JSON serializable dictionary.
+
+        Args:
+            top (int): Number of functions listed per profiled stage, by cumulative time.
+
+        Returns:
+            Dictionary with the stage times sorted by total time, the counters, the top functions of every profiled
+            stage and the number of samples per innermost stage.
+        """
+        with self.lock:
+            stages = {name: dict(stats) for name, stats in self.stages.items()}
+            counters = dict(self.counters)
+            profiles = {name: get_top_functions(stats, top) for name, stats in self.profiles.items()}
+            samples = Counter(self.samples)
+
+        report = {
+            'started': self.started,
+            'wall_seconds': time.time() - self.started,
+            'stages': {name: {'calls': stats['calls'],
+                              'total_seconds': stats['total'],
+                              'mean_seconds': stats['total'] / stats['calls'],
+                              'min_seconds': stats['min'],
+                              'max_seconds': stats['max']}
+                       for name, stats in sorted(stages.items(), key=lambda item: -item[1]['total'])},
+            'counters': counters,
+            'profiles': profiles,
+        }
+        if samples or self.sample_interval is not None:
+            by_stage = Counter()
+            for stack, n in samples.items():
+                by_stage[get_sample_stage(stack)] += n
+            report['samples'] = {'interval_seconds': self.sample_interval,
+                                 'count': sum(samples.values()),
+                                 'by_stage': dict(by_stage.most_common())}
+        return report
+
+    def write_report(self, path, top=20):
+        """Writes the report of get_report as JSON file."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.get_report(top), f, indent=2)
+
+    def write_samples(self, path):
+        """Writes the stack samples as collapsed stacks, one "frame;frame;frame count" line per stack."""
+        with self.lock:
+            samples = Counter(self.samples)
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, n in samples.most_common():
+                f.write('{} {}\n'.format(stack, n))
+
+    def dump_profiles(self, path):
+        """Writes the merged cProfile of every profiled stage as <stage>.prof into a folder, see pstats and
+        snakeviz."""
+        os.makedirs(path, exist_ok=True)
+        with self.lock:
+            for name, stats in self.profiles.items():
+                stats.dump_stats(os.path.join(path, name + '.prof'))
+
+
+class Sampler(threading.Thread):
+    """Daemon thread sampling the stacks of the threads that are inside a stage."""
+
+    def __init__(self, instrumentation, interval):
+        super().__init__(name='instrumentation-sampler', daemon=True)
+        self.instrumentation = instrumentation
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            with self.instrumentation.lock:
+                threads = [(thread_id, list(stack)) for thread_id, stack in self.instrumentation.threads.items()]
+            frames = sys._current_frames()
+            for thread_id, stack in threads:
+                if stack and thread_id in frames:
+                    self.instrumentation.add_sample(get_collapsed_stack(stack, frames[thread_id]))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def get_collapsed_stack(stages, frame):
+    """Collapsed stack of a sample, the active stages first and then the frames from the outermost to frame."""
+    functions = []
+    while frame is not None:
+        code = frame.f_code
+        functions.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+        frame = frame.f_back
+    return ';'.join(['stage:' + name for name in stages] + functions[::-1])
+
+
+def get_sample_stage(stack):
+    """Innermost stage of a collapsed stack."""
+    stages = [frame[len('stage:'):] for frame in stack.split(';') if frame.startswith('stage:')]
+    return stages[-1] if stages else None
+
+
+def get_top_functions(stats, top=20):
+    """Functions of a pstats.Stats with the highest cumulative time."""
+    functions = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:top]
+    return [{'function': '{} ({}:{})'.format(name, os.path.basename(filename), line),
+             'calls': calls,
+             'total_seconds': total,
+             'cumulative_seconds': cumulative}
+            for (filename, line, name), (_, calls, total, cumulative, _) in functions]
+
+
+def timed(name):
+    """Decorator timing every call of a function as stage name."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not INSTRUMENTATION.enabled:
+                return function(*args, **kwargs)
+            with Stage(INSTRUMENTATION, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+INSTRUMENTATION = Instrumentation()
+
+enable = INSTRUMENTATION.enable
+disable = INSTRUMENTATION.disable
+reset = INSTRUMENTATION.reset
+stage = INSTRUMENTATION.stage
+count = INSTRUMENTATION.count
+get_report = INSTRUMENTATION.get_report
+write_report = INSTRUMENTATION.write_report
+write_samples = INSTRUMENTATION.write_samples
+dump_profiles = INSTRUMENTATION.dump_profiles
+
+if os.environ.get(ENVIRONMENT_VARIABLE) in ('1', 'profile', 'sample'):
+    enable(profile=os.environ[ENVIRONMENT_VARIABLE] == 'profile',
+           sample_interval=0.005 if os.environ[ENVIRONMENT_VARIABLE] == 'sample' else None)
+    if os.environ.get(REPORT_VARIABLE):
+        atexit.register(write_report, os.environ[REPORT_VARIABLE])
@@ -1,47 +1,48 @@
 import sys
+from functools import lru_cache
+
 import nltk
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
+
+from src.data.catalog import get_catalog
+
 nltk.download('stopwords')
 
 
 def recommend_based_on_transactions(df_transactions, df_items, item_id, sort_by="sum",
-                                    max_number_recommendation=5, verbose=True):
-    original_book = convert_id_to_name(df_items, item_id)
-    original_title = original_book[["title"]].values[0][0]
-    original_author = original_book[["author"]].values[0][0]
+                                    max_number_recommendation=5, verbose=True, cooccurrence=None):
+    catalog = get_catalog(df_items)
     recommendation_id = []
 
-    if original_book.empty:
+    if item_id not in catalog:
         sys.exit("ITEM ID NOT FOUND!")
+    original_title = catalog.get_title(item_id)
+    original_author = catalog.get_author(item_id)
     if verbose:
         print("Find recommendations based on: ")
         print("{} by {}.".format(original_title, original_author))
         print("\n")
         print("We recommend: ")
-    session_ids = find_all_sessions_id(df_transactions, item_id)
-    itemID_rows = find_all_item_id(df_transactions, session_ids)
-    item_properties = find_number_click_basket_order(itemID_rows)
 
     if sort_by == "sum":
-        summed_item_properties = sum_click_basket_order(item_properties)
-        sorted_itemID = sorted(summed_item_properties, key=summed_item_properties.get, reverse=True)
-
-        number_recommendation = 0
-        for single_itemID in sorted_itemID:
-            rank_book = convert_id_to_name(df_items, single_itemID)
-            if single_itemID == item_id or compare_strings(original_title, rank_book[["title"]].values[0][0]):
-                continue
-            if number_recommendation < max_number_recommendation:
-                recommendation_id.append(single_itemID)
-                if verbose:
-                    print("{}. {} by {}.".format(number_recommendation + 1,
-                                                 rank_book[["title"]].values[0][0],
-                                                 rank_book[["author"]].values[0][0]))
-                number_recommendation += 1
-            else:
-                break
+        if cooccurrence is None:
+            session_ids = find_all_sessions_id(df_transactions, item_id)
+            itemID_rows = find_all_item_id(df_transactions, session_ids)
+            item_properties = find_number_click_basket_order(itemID_rows)
+            summed_item_properties = sum_click_basket_order(item_properties)
+            sorted_itemID = sorted(summed_item_properties, key=summed_item_properties.get, reverse=True)
+        else:
+            # precomputed sums of the co-occurrence matrix, see src/features/cooccurrence.py
+            sorted_itemID, _ = cooccurrence.get_ranking(item_id)
+
+        recommendation_id = select_recommendations(catalog, item_id, sorted_itemID, max_number_recommendation)
+        number_recommendation = len(recommendation_id)
         if verbose:
+            for i, single_itemID in enumerate(recommendation_id):
+                print("{}. {} by {}.".format(i + 1,
+                                             catalog.get_title(single_itemID),
+                                             catalog.get_author(single_itemID)))
             for i in range(max_number_recommendation):
                 if i + 1 >= number_recommendation + 1:
                     print("{}. Not enough data to give recommendation".format(i + 1))
@@ -52,6 +53,38 @@ def recommend_based_on_transactions(df_transactions, df_items, item_id, sort_by=
     return recommendation_id
 
 
+def recommend_based_on_transactions_batch(df_items, item_ids, cooccurrence, max_number_recommendation=5):
+    """ Sum ranking of recommend_based_on_transactions for many books from one slice of the co-occurrence matrix.
+
+    Args:
+        df_items (dataframe or Catalog): Items with itemID, title and author.
+        item_ids (array): itemIDs of the query books.
+        cooccurrence (CooccurrenceMatrix): Co-occurrence of the transactions, see src/features/cooccurrence.py.
+        max_number_recommendation (int): Number of recommendations per book.
+
+    Returns:
+        List with the recommended itemIDs of every query book, empty for books that are not in df_items.
+    """
+    catalog = get_catalog(df_items)
+    rankings = cooccurrence.get_rankings(item_ids)
+    return [select_recommendations(catalog, item_id, sorted_itemID, max_number_recommendation)
+            if item_id in catalog else [] for item_id, (sorted_itemID, _) in zip(item_ids, rankings)]
+
+
+def select_recommendations(catalog, item_id, sorted_itemID, max_number_recommendation=5):
+    """ First max_number_recommendation ranked items that are neither the book itself nor share its title.
+    """
+    original_title = catalog.get_title(item_id)
+    recommendation_id = []
+    for single_itemID in sorted_itemID:
+        if len(recommendation_id) >= max_number_recommendation:
+            break
+        if single_itemID == item_id or compare_strings(original_title, catalog.get_title(single_itemID)):
+            continue
+        recommendation_id.append(single_itemID)
+    return recommendation_id
+
+
 def find_all_sessions_id(df, item_id):
     session_ids = df.loc[df['itemID'] == item_id]["sessionID"].to_list()
     return session_ids
@@ -83,17 +116,27 @@ def sum_click_basket_order(item_properties):
 
 
 def convert_id_to_name(df_items, itemID):
-    return df_items.loc[df_items['itemID'] == itemID]
+    return get_catalog(df_items).get_rows([itemID])
 
 
 def compare_strings(text1, text2):
-    test1_wh_sw = remove_stopwords(text1)
-    test2_wh_sw = remove_stopwords(text2)
+    return normalize_title(text1) == normalize_title(text2)
+
+
+@lru_cache(maxsize=2 ** 17)
+def normalize_title(text):
+    """Title without stopwords in lower case, cached since the same candidates are compared for many books."""
+    return remove_stopwords(text).lower()
+
 
-    return test1_wh_sw.lower() == test2_wh_sw.lower()
+@lru_cache(maxsize=None)
+def get_stopwords():
+    """Stopwords of all NLTK languages, loaded once."""
+    return frozenset(stopwords.words())
 
 
 def remove_stopwords(text):
+    stop_words = get_stopwords()
     text_tokens = word_tokenize(text)
-    tokens_without_sw = [word for word in text_tokens if not word in stopwords.words()]
+    tokens_without_sw = [word for word in text_tokens if word not in stop_words]
     return " ".join(tokens_without_sw)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Ensemble of the team models from the decisions of the website users.
+
+  Every decision shows a user three recommendations for a book and records which one was chosen. The aggregates count
+  per book and recommendation how often it was shown and chosen. Recommendations that were chosen more than once and
+  in more than half of the cases they were shown form the first tier, all others the second tier. Within a tier the
+  recommendations are ranked by their share of choices and then by their number of choices, and the best five per
+  book are the ensemble recommendation.
+
+  The aggregates are kept on disk with the time of the newest decision they contain, so a new export of the
+  decisions collection only adds the decisions made since.
+
+  Typical usage example:
+
+    >> aggregates = DecisionAggregates.build(pd.read_csv("../data/processed/decisions.csv"))
+    >> aggregates.save("../models/ensemble")
+    >> aggregates = DecisionAggregates.load("../models/ensemble")
+    >> aggregates.update(pd.read_csv("../data/processed/decisions.csv"))
+    >> result = aggregates.get_recommendations(evaluation.itemID)
+
+  Or from the command line:
+
+    $ python src/models/ensemble.py data/processed/decisions.csv data/external/evaluation.csv models/ensemble \
+          data/processed/ensemble_v2_dataminerz.csv
+"""
+
+import json
+import logging
+import os
+
+import click
+import numpy as np
+import pandas as pd
+
+SHOWN_COLUMNS = ['recommendation_shown_0', 'recommendation_shown_1', 'recommendation_shown_2']
+DECISIONS = np.array(['recommendation_0', 'recommendation_1', 'recommendation_2'])
+COUNT_COLUMNS = ['book_id', 'recommendation_id', 'shown', 'chosen']
+
+
+def count_decisions(decisions):
+    """ Counts how often every recommendation of a book was shown and chosen.
+
+    Args:
+        decisions (dataframe): Decisions with book_id, decision and the recommendation_shown columns.
+
+    Returns:
+        Dataframe with the columns of COUNT_COLUMNS, one row per shown book and recommendation.
+    """
+    shown = decisions[SHOWN_COLUMNS].to_numpy()
+    chosen = decisions['decision'].to_numpy()[:, np.newaxis] == DECISIONS[np.newaxis, :]
+    counts = pd.DataFrame({'book_id': np.repeat(decisions['book_id'].to_numpy(), len(SHOWN_COLUMNS)),
+                           'recommendation_id': shown.ravel(),
+                           'shown': 1,
+                           'chosen': chosen.ravel().astype(np.int64)})
+    return counts.groupby(['book_id', 'recommendation_id'], as_index=False).sum()
+
+
+def select_recommendations(counts, book_ids, k=5):
+    """ Ensemble recommendation of every book from its counts.
+
+    Args:
+        counts (dataframe): Counts of count_decisions.
+        book_ids (array): Books to recommend for.
+        k (int): Number of recommendations per book.
+
+    Returns:
+        Dataframe with a book_id column in the order of book_ids and the columns recommendation_1 to recommendation_k,
+        missing recommendations are NA.
+    """
+    book_ids = pd.Index(book_ids)
+    counts = counts[counts['book_id'].isin(book_ids)]
+
+    chosen = counts['chosen'].to_numpy()
+    average = chosen / counts['shown'].to_numpy()
+    tier = np.where((chosen > 1) & (average > 0.5), 0, 1)
+    # ties are ranked by recommendation id
+    order = np.lexsort((counts['recommendation_id'].to_numpy(), -chosen, -average, tier,
+                        counts['book_id'].to_numpy()))
+
+    ranked = counts.iloc[order][['book_id', 'recommendation_id']]
+    ranked['rank'] = ranked.groupby('book_id').cumcount()
+    ranked = ranked[ranked['rank'] < k]
+
+    result = ranked.pivot(index='book_id', columns='rank', values='recommendation_id')
+    result = result.reindex(index=book_ids, columns=range(k)).astype('Int64')
+    result.columns = ['recommendation_{}'.format(rank + 1) for rank in range(k)]
+    result.index.name = 'book_id'
+    return result.reset_index()
+
+
+def shift_recommendations(result):
+    """ Moves the fifth recommendation of every book to the first place and the others one place down.
+    """
+    columns = [column for column in result.columns if column.startswith('recommendation_')]
+    return result.rename(columns=dict(zip(columns, columns[1:] + columns[:1])))[result.columns]
+
+
+class DecisionAggregates:
+    """Running shown and chosen counts of the decisions up to a point in time."""
+
+    def __init__(self, counts=None, last_time=None):
+        """
+        Args:
+            counts (dataframe): Counts with the columns of COUNT_COLUMNS, no decisions if None.
+            last_time (Timestamp): Time of the newest counted decision.
+        """
+        self.counts = pd.DataFrame(columns=COUNT_COLUMNS, dtype=np.int64) if counts is None else counts
+        self.last_time = last_time
+
+    @classmethod
+    def build(cls, decisions):
+        """Counts all decisions."""
+        aggregates = cls()
+        aggregates.update(decisions)
+        return aggregates
+
+    @classmethod
+    def load(cls, path):
+        """Loads aggregates written by save.
+
+        Args:
+            path (string): Folder of the aggregates.
+
+        Returns:
+            The stored DecisionAggregates.
+        """
+        counts = pd.read_feather(os.path.join(path, 'counts.arrow'))
+        with open(os.path.join(path, 'state.json'), encoding='utf-8') as f:
+            last_time = json.load(f)['last_time']
+        return cls(counts, None if last_time is None else pd.Timestamp(last_time))
+
+    def save(self, path):
+        """Writes the counts and the time of the newest decision into a folder.
+
+        Args:
+            path (string): Folder of the aggregates, it is created if it does not exist.
+        """
+        os.makedirs(path, exist_ok=True)
+        self.counts.reset_index(drop=True).to_feather(os.path.join(path, 'counts.arrow'))
+        with open(os.path.join(path, 'state.json'), 'w', encoding='utf-8') as f:
+            json.dump({'last_time': None if self.last_time is None else self.last_time.isoformat()}, f)
+
+    def update(self, decisions):
+        """Adds the decisions that are newer than the newest counted decision.
+
+        The decisions collection only grows, so decisions up to last_time are already counted and skipped.
+
+        Args:
+            decisions (dataframe): Export of the decisions collection with a time column.
+
+        Returns:
+            Number of added decisions.
+        """
+        times = pd.to_datetime(decisions['time'], utc=True)
+        if self.last_time is not None:
+            decisions = decisions[(times > self.last_time).to_numpy()]
+            times = times[times > self.last_time]
+        if decisions.empty:
+            return 0
+
+        counts = pd.concat([self.counts, count_decisions(decisions)])
+        self.counts = counts.groupby(['book_id', 'recommendation_id'], as_index=False).sum().astype(np.int64)
+        self.last_time = times.max()
+        return len(decisions)
+
+    def get_recommendations(self, book_ids, k=5):
+        """Ensemble recommendation of every book, see select_recommendations."""
+        return select_recommendations(self.counts, book_ids, k)
+
+
+@click.command()
+@click.argument('decisions_filepath', type=click.Path(exists=True))
+@click.argument('evaluation_filepath', type=click.Path(exists=True))
+@click.argument('aggregates_path', type=click.Path())
+@click.argument('output_filepath', type=click.Path())
+@click.option('--model-id', default='ensemble_v2', help='model_id column of the result.')
+@click.option('--shifted', is_flag=True, help='Move the fifth recommendation to the first place.')
+def main(decisions_filepath, evaluation_filepath, aggregates_path, output_filepath, model_id, shifted):
+    """ Adds the new decisions to the aggregates in aggregates_path and writes the ensemble recommendation of the
+        evaluation books.
+    """
+    logger = logging.getLogger(__name__)
+
+    if os.path.exists(os.path.join(aggregates_path, 'state.json')):
+        aggregates = DecisionAggregates.load(aggregates_path)
+    else:
+        aggregates = DecisionAggregates()
+    added = aggregates.update(pd.read_csv(decisions_filepath))
+    aggregates.save(aggregates_path)
+    logger.info('added %d decisions, newest decision from %s', added, aggregates.last_time)
+
+    evaluation = pd.read_csv(evaluation_filepath)
+    result = aggregates.get_recommendations(evaluation['itemID'])
+    if shifted:
+        result = shift_recommendations(result)
+    result['team_id'] = 'dataminerz'
+    result['model_id'] = model_id
+    result.to_csv(output_filepath)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""Offline replay of recommendation models against the decisions of the website users.
+
+  Every logged decision showed a user three recommendations for a book from three live models and recorded the one
+  the user chose. A candidate model is replayed by looking up its top 5 for the book of every decision:
+
+    coverage      share of the decisions whose book the model recommends for
+    hit_rate      share of the covered decisions whose chosen recommendation is in the model's top 5
+    shown_rate    share of the covered decisions with any shown recommendation in the model's top 5
+    win_rate      share of the decisions with a shown recommendation in the top 5 in which the model ranks the
+                  chosen recommendation above the other shown ones, i.e. the model would have picked like the user
+
+  Decisions that showed a recommendation of the evaluated model itself or of another live model of its team are
+  skipped by default, so models are not rewarded for their own exposure or that of a near copy. The live model ids
+  are matched to the submissions by model_id, see KNOWN_OPTIONS in src/data/submissions.py. All metrics are computed with array operations over all decisions at once,
+  the live models' own share of choices is available from get_live_scores for comparison.
+
+  Typical usage example:
+
+    >> decisions = prepare_decisions(pd.read_csv("../data/processed/decisions.csv"))
+    >> metrics = evaluate_models(read_store("../data/interim/submissions/submissions.arrow"), decisions)
+    >> metrics_by_team = evaluate_models(submissions, decisions, by_team=True)
+
+  Or from the command line:
+
+    $ python src/models/evaluation.py data/processed/decisions.csv data/interim/submissions/submissions.arrow \
+          reports/replay_evaluation.csv --by-team
+"""
+
+import logging
+import re
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data.submissions import RECOMMENDATION_COLUMNS, read_store
+from src.models.ensemble import DECISIONS, SHOWN_COLUMNS
+
+MODEL_COLUMNS = ['model_0_id', 'model_1_id', 'model_2_id']
+METRICS = ['decisions', 'coverage', 'hit_rate', 'shown_rate', 'win_rate']
+
+
+def normalize_team(team):
+    """ Team names of the voters are typed by hand, e.g. "The Dataworms", "the_dataworms" and "team_404" and
+        "team404" are the same teams. Pasted URLs are removed.
+    """
+    if not isinstance(team, str):
+        return 'unknown'
+    team = re.sub(r'https?://\S*', '', team.lower())
+    team = re.sub(r'^\W*the\W+', '', team)
+    return re.sub(r'[\W_]+', '', team) or 'unknown'
+
+
+def prepare_decisions(decisions):
+    """ Arrays of the decisions used by the replay.
+
+    Args:
+        decisions (dataframe): Export of the decisions collection.
+
+    Returns:
+        Dictionary with the sorted unique books and the position of the book of every decision in them, the (n, 3)
+        shown recommendations and the codes of their models in model_ids, the position of the chosen recommendation
+        and the position of the normalized team of the voter in teams of every decision.
+    """
+    chosen = pd.Categorical(decisions['decision'], categories=DECISIONS).codes
+    valid = chosen >= 0
+    decisions = decisions[valid]
+
+    books, book_index = np.unique(decisions['book_id'].to_numpy(dtype=np.int64), return_inverse=True)
+    model_codes, model_ids = pd.factorize(decisions[MODEL_COLUMNS].astype(str).to_numpy().ravel())
+    teams, team_index = np.unique([normalize_team(team) for team in decisions['team']], return_inverse=True)
+    return {'books': books,
+            'book_index': book_index,
+            'shown': decisions[SHOWN_COLUMNS].to_numpy(dtype=np.int64),
+            'models': model_codes.reshape(-1, len(MODEL_COLUMNS)),
+            'model_ids': pd.Index(model_ids),
+            'chosen': chosen[valid].astype(np.int64),
+            'teams': teams,
+            'team_index': team_index}
+
+
+def get_shown_ranks(recommendations, decisions):
+    """ Rank of every shown recommendation in the candidate's top 5.
+
+    Args:
+        recommendations (dataframe): Candidate with book_id and the recommendation columns, one row per book.
+        decisions (dict): Decisions of prepare_decisions.
+
+    Returns:
+        Tuple of the covered mask of the decisions and the (n, 3) ranks of the shown recommendations, 5 if a shown
+        recommendation is not in the top 5.
+    """
+    recommendations = recommendations.drop_duplicates('book_id')
+    book_ids = recommendations['book_id'].to_numpy(dtype=np.int64)
+    books = decisions['books']
+
+    # the top 5 of the books with decisions, the candidate is mapped once and not every decision is searched
+    positions = np.minimum(np.searchsorted(books, book_ids), len(books) - 1)
+    known = books[positions] == book_ids
+    top = np.full((len(books), len(RECOMMENDATION_COLUMNS)), -1, dtype=np.int64)
+    top[positions[known]] = recommendations[RECOMMENDATION_COLUMNS].to_numpy(dtype=np.int64)[known]
+    covered_books = np.zeros(len(books), dtype=bool)
+    covered_books[positions[known]] = True
+
+    covered = covered_books[decisions['book_index']]
+    top = top[decisions['book_index']]
+    ranks = np.full(decisions['shown'].shape, len(RECOMMENDATION_COLUMNS))
+    # from the last to the first place, so the best place of a recommendation is kept
+    for rank in reversed(range(len(RECOMMENDATION_COLUMNS))):
+        ranks[decisions['shown'] == top[:, rank:rank + 1]] = rank
+    return covered, ranks
+
+
+def get_replay_metrics(covered, ranks, chosen, mask=None):
+    """ Metrics of one model over the decisions in mask, see the module description.
+    """
+    if mask is not None:
+        covered, ranks, chosen = covered[mask], ranks[mask], chosen[mask]
+
+    rows = np.arange(len(chosen))
+    in_top = ranks < len(RECOMMENDATION_COLUMNS)
+    any_shown = in_top.any(axis=1)
+    hit = in_top[rows, chosen]
+    win = any_shown & (ranks.argmin(axis=1) == chosen)
+
+    n_covered = covered.sum()
+    return {'decisions': len(chosen),
+            'coverage': covered.mean() if len(chosen) else np.nan,
+            'hit_rate': hit[covered].mean() if n_covered else np.nan,
+            'shown_rate': any_shown[covered].mean() if n_covered else np.nan,
+            'win_rate': win[any_shown].mean() if any_shown.any() else np.nan}
+
+
+def evaluate_model(recommendations, decisions, model_id=None, by_team=False):
+    """ Replays one candidate model against the decisions.
+
+    Args:
+        recommendations (dataframe): Top 5 of the candidate with book_id and the recommendation columns.
+        decisions (dict): Decisions of prepare_decisions.
+        model_id (string or list): Live model id of the candidate or the live model ids of its team, decisions that
+            showed one of them are skipped. Nothing is skipped if None.
+        by_team (bool): Compute the metrics per team of the voters instead of over all decisions.
+
+    Returns:
+        Dataframe with the columns of METRICS, one row or one row per team.
+    """
+    covered, ranks = get_shown_ranks(recommendations, decisions)
+    mask = np.ones(len(covered), dtype=bool)
+    if model_id is not None:
+        model_ids = [model_id] if isinstance(model_id, str) else model_id
+        codes = decisions['model_ids'].get_indexer([str(value) for value in model_ids])
+        mask = ~np.isin(decisions['models'], codes[codes >= 0]).any(axis=1)
+
+    if not by_team:
+        return pd.DataFrame([get_replay_metrics(covered, ranks, decisions['chosen'], mask)], columns=METRICS)
+
+    metrics = [get_replay_metrics(covered, ranks, decisions['chosen'], mask & (decisions['team_index'] == i))
+               for i in range(len(decisions['teams']))]
+    return pd.DataFrame(metrics, index=pd.Index(decisions['teams'], name='team'), columns=METRICS).reset_index()
+
+
+def evaluate_models(submissions, decisions, by_team=False, exclude_shown_model=True):
+    """ Replays every model of a submissions frame, e.g. the store of submissions.py.
+
+    Args:
+        submissions (dataframe): Recommendations with team_id, model_id, book_id and the recommendation columns.
+        decisions (dict): Decisions of prepare_decisions.
+        by_team (bool): Compute the metrics per team of the voters.
+        exclude_shown_model (bool): Skip the decisions that showed a recommendation of the evaluated model or of
+            another live model of its team.
+
+    Returns:
+        Dataframe with team_id, model_id and the columns of METRICS, sorted by win rate.
+    """
+    if exclude_shown_model:
+        # the decisions of a live model are only skipped for the submission with the same model_id
+        missing = decisions['model_ids'].difference(submissions['model_id'].astype(str).unique())
+        if len(missing):
+            logging.getLogger(__name__).warning(
+                'live models %s have no submission with their model_id, the decisions that showed them are '
+                'replayed, see KNOWN_OPTIONS in src/data/submissions.py', ', '.join(missing))
+
+    live_models = get_live_models(submissions, decisions)
+    results = []
+    for (team_id, model_id), recommendations in submissions.groupby(['team_id', 'model_id'], observed=True,
+                                                                    sort=False):
+        shown_models = [str(model_id)] + live_models.get(team_id, []) if exclude_shown_model else None
+        metrics = evaluate_model(recommendations, decisions, shown_models, by_team)
+        metrics.insert(0, 'team_id', team_id)
+        metrics.insert(1, 'model_id', model_id)
+        results.append(metrics)
+
+    results = pd.concat(results, ignore_index=True)
+    return results.sort_values('win_rate', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def get_live_models(submissions, decisions):
+    """ Live model ids of every team with a submission.
+
+    Args:
+        submissions (dataframe): Recommendations with team_id and model_id.
+        decisions (dict): Decisions of prepare_decisions.
+
+    Returns:
+        Dictionary from team_id to the list of its model ids that were shown on the website.
+    """
+    models = submissions[['team_id', 'model_id']].astype(str).drop_duplicates()
+    models = models[models['model_id'].isin(decisions['model_ids'])]
+    return models.groupby('team_id')['model_id'].agg(list).to_dict()
+
+
+def get_live_scores(decisions, by_team=False):
+    """ How often the recommendations of every live model were shown and chosen.
+
+    Args:
+        decisions (dict): Decisions of prepare_decisions.
+        by_team (bool): Count per team of the voters.
+
+    Returns:
+        Dataframe with model_id, shown, chosen and their ratio chosen_rate.
+    """
+    chosen = np.arange(len(MODEL_COLUMNS))[np.newaxis, :] == decisions['chosen'][:, np.newaxis]
+    frame = pd.DataFrame({'model_id': decisions['model_ids'][decisions['models'].ravel()],
+                          'team': np.repeat(decisions['teams'][decisions['team_index']], len(MODEL_COLUMNS)),
+                          'chosen': chosen.ravel()})
+    keys = ['team', 'model_id'] if by_team else ['model_id']
+    scores = frame.groupby(keys)['chosen'].agg(shown='size', chosen='sum').reset_index()
+    scores['chosen_rate'] = scores['chosen'] / scores['shown']
+    return scores.sort_values('chosen_rate', ascending=False, kind='stable').reset_index(drop=True)
+
+
+@click.command()
+@click.argument('decisions_filepath', type=click.Path(exists=True))
+@click.argument('submissions_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+@click.option('--by-team', is_flag=True, help='Report the metrics per team of the voters.')
+@click.option('--include-shown-model', is_flag=True, help='Also replay the decisions that showed the model itself.')
+def main(decisions_filepath, submissions_filepath, output_filepath, by_team, include_shown_model):
+    """ Replays every model of the submissions store against the decisions and writes the metrics.
+    """
+    logger = logging.getLogger(__name__)
+
+    decisions = prepare_decisions(pd.read_csv(decisions_filepath))
+    submissions = read_store(submissions_filepath)
+    metrics = evaluate_models(submissions, decisions, by_team, exclude_shown_model=not include_shown_model)
+    metrics.to_csv(output_filepath, index=False)
+
+    logger.info('replayed %d models against %d decisions',
+                submissions.groupby(['team_id', 'model_id'], observed=True).ngroups, len(decisions['chosen']))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
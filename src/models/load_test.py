@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Load test of the recommendation service of service.py.
+
+  Sends requests for random books of an item list from concurrent clients and reports throughput and latency
+  percentiles. With --batch-size the batch endpoint is tested instead of the single one.
+
+    $ python src/models/load_test.py http://localhost:8000 data/external/evaluation.csv --requests 2000 --concurrency 8
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import numpy as np
+import pandas as pd
+import requests
+
+
+def run_load_test(url, item_ids, n_requests=1000, concurrency=8, batch_size=0, k=5, model=None, seed=0):
+    """ Sends n_requests requests with concurrency clients.
+
+    Args:
+        url (string): Base URL of the service.
+        item_ids (array): Books the requests are drawn from.
+        n_requests (int): Number of requests.
+        concurrency (int): Number of clients sending at the same time, every client keeps its connection.
+        batch_size (int): Books per request to the batch endpoint, the single endpoint is used if 0.
+        k (int): Number of recommendations per book.
+        model (string): Model of the service, its default model if None.
+        seed (int): Seed of the drawn books.
+
+    Returns:
+        Tuple of the latency of every request in seconds, the number of failed requests and the total seconds.
+    """
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(np.asarray(item_ids), size=(n_requests, max(batch_size, 1)))
+    sessions = threading.local()
+
+    def send(books):
+        if not hasattr(sessions, 'session'):
+            sessions.session = requests.Session()
+        start = time.perf_counter()
+        if batch_size:
+            response = sessions.session.post(url + '/recommendations/batch',
+                                             json={'item_ids': books.tolist(), 'k': k, 'model': model})
+        else:
+            params = {'item_id': int(books[0]), 'k': k}
+            if model is not None:
+                params['model'] = model
+            response = sessions.session.get(url + '/recommendations', params=params)
+        # unknown books are answered with 404 and count as successful requests
+        return time.perf_counter() - start, response.status_code not in (200, 404)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, queries))
+    total = time.perf_counter() - start
+
+    latencies = np.array([latency for latency, _ in results])
+    failed = sum(failed for _, failed in results)
+    return latencies, failed, total
+
+
+@click.command()
+@click.argument('url')
+@click.argument('items_filepath', type=click.Path(exists=True))
+@click.option('--requests', 'n_requests', default=1000, help='Number of requests.')
+@click.option('--concurrency', default=8, help='Number of concurrent clients.')
+@click.option('--batch-size', default=0, help='Books per request to the batch endpoint, 0 tests the single one.')
+@click.option('--k', default=5, help='Number of recommendations per book.')
+@click.option('--model', default=None, help='Model of the service, its default model if not given.')
+def main(url, items_filepath, n_requests, concurrency, batch_size, k, model):
+    """ Load tests the service at url with the itemIDs of items_filepath.
+    """
+    logger = logging.getLogger(__name__)
+    item_ids = pd.read_csv(items_filepath, sep='|')['itemID'].to_numpy()
+
+    latencies, failed, total = run_load_test(url.rstrip('/'), item_ids, n_requests, concurrency, batch_size, k,
+                                             model)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    logger.info('%d requests in %.1f s, %.0f requests/s, %d failed', n_requests, total, n_requests / total, failed)
+    logger.info('latency p50 %.1f ms, p95 %.1f ms, p99 %.1f ms, max %.1f ms', p50, p95, p99, latencies.max() * 1000)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
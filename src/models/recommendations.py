@@ -2,6 +2,10 @@
 #!pip install pyarrow
 #!pip install fuzzywuzzy
 #!pip install python-Levenshtein
+#!pip install rapidfuzz
+
+import logging
+import os
 
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
@@ -9,98 +13,30 @@ from fuzzywuzzy import fuzz
 import pandas as pd
 import numpy as np
 
-items_path = '20210525_items_df.csv'
-path = '20210525_header_items_df.csv'
-mt_path = 'items_pp.csv'
-
-df_items = pd.read_csv('items.csv', sep='|', quoting=csv.QUOTE_NONE, error_bad_lines=False)
-df_transactions = pd.read_csv('transactions.csv', sep = '|')
-df_evaluation = pd.read_csv('evaluation.csv', sep = '|')
-
-items_df = pd.read_csv(items_path, delimiter=',', encoding='utf-8')
-del items_df['description']
-del items_df['recommended_age']
-del items_df['number_pages']
-
-header_df = pd.read_csv(path, lineterminator='\n')
-del header_df['title']
-del header_df['author']
-del header_df['publisher']
-del header_df['item_lang_en']
-
-mt_df = pd.read_csv(mt_path, delimiter=',', encoding='utf-8')
-
-items_df = pd.merge(items_df, header_df,  how='left', left_on=['headerID'], right_on = ['headerID'])
-items_df['mt'] = mt_df['mt']
-
-
-final_df = pd.DataFrame(columns=['book_id', 'model_id', 'team_id', 'recommendation_1', 'recommendation_2',
-                                 'recommendation_3', 'recommendation_4', 'recommendation_5'])
-
-x = items_df.copy()
-for index, row in df_evaluation.iterrows():
-    items_df = x.copy()
-    print(items_df.shape)
-    base_book = row['itemID']
-    print(base_book)
-
-    author = items_df['author'][items_df['itemID'] == base_book].to_string(index=False).lstrip()
-    mtopic = items_df['mt'][items_df['itemID'] == base_book].to_string(index=False).strip(' []')
-    lang = items_df['language'][items_df['itemID'] == base_book].to_string(index=False).lstrip()
-    headerID = int(items_df['headerID'][items_df['itemID'] == base_book])
-
-    items_df = filter_on_lang(items_df, lang)
-    items_df.reset_index(drop=True, inplace=True)
+from src import instrumentation
+from src.data.catalog import Catalog, get_catalog
+from src.data.catalog_store import BOOK_COLUMNS, BOOKS_FILE, CATALOG_FILE, ITEM_COLUMNS, load_items_csv, read_books, \
+    read_catalog
+from src.features.author_index import AuthorIndex
+from src.features.cooccurrence import CooccurrenceMatrix
+from src.features.language_shards import LanguageShards
+from src.features.title_index import TitleIndex, get_index_name
+from src.features.topic_codes import TopicCodes
+from src.models.baseline_transaction import recommend_based_on_transactions, recommend_based_on_transactions_batch
 
-    df_authorscores = items_df[['itemID', 'title', 'author']]
-    df_authorscores['author_score'] = get_authorscores_fuzzy(df_authorscores, author)
-    # df_authorscores
-
-    df_topicscore = items_df[['headerID', 'itemID', 'title', 'mt']]
-    df_topicscore['mtopic_score'] = get_mtopicscores(df_topicscore, mtopic)
-    # df_topicscore
-    # df_authorscores
-
-    df_titlescores = items_df[['itemID', 'title', 'author']]
-    # pd.set_option('display.max_rows', 500)
-    df_titlescores['title_score'] = get_titlescores(df_titlescores, items_df, base_book)
-    # df_titlescores
-
-    result_transactions = recommend_based_on_transactions(df_transactions, df_items, base_book)
-    # result_transactions
-
-    pd.options.display.max_rows = 250
-    pd.options.display.min_rows = 250
-
-    result = get_totalscore(df_titlescores, df_authorscores, df_topicscore, result_transactions)
-    result = result[result['headerID'] != headerID]
-    result.drop_duplicates(subset='headerID', keep="first", inplace=True)
-    result = result.sort_values(by='total_score', ascending=False)
-
-    recommendations = result.iloc[0:5, :]
-
-    final_df = final_df.append({'book_id': row['itemID'],
-                                'model_id': 'first',
-                                'team_id': 'dataminerz',
-                                'recommendation_1': recommendations.iloc[0, 0],
-                                'recommendation_2': recommendations.iloc[1, 0],
-                                'recommendation_3': recommendations.iloc[2, 0],
-                                'recommendation_4': recommendations.iloc[3, 0],
-                                'recommendation_5': recommendations.iloc[4, 0]}, ignore_index=True)
-    print(len(final_df))
-
-final_df.to_csv('rec_final.csv')
+logger = logging.getLogger(__name__)
 
 
 def filter_on_lang(df_item, language):
-    if len(df_item[df_item['language'] == lang]) > 5:
+    df_lang = df_item[df_item['language'] == language]
+    if len(df_lang) > 5:
 
-        print(len(df_item[df_item['language'] == lang]))
-        return df_item[df_item['language'] == lang]
+        logger.debug('%d books in %s', len(df_lang), language)
+        return df_lang
 
     else:
 
-        print(len(df_item))
+        logger.debug('%d books, too few in %s', len(df_item), language)
         return df_item
 
 def get_authorscores_fuzzy(df_authorscores, author):
@@ -206,3 +142,263 @@ def get_totalscore(df1, df2, df3, df_trans):
                             result['trans_score'].astype(float)
 
     return result
+
+
+def load_items(items_path='20210525_items_df.csv', header_path='20210525_header_items_df.csv',
+               mt_path='items_pp.csv', catalog_path=CATALOG_FILE):
+    if os.path.exists(catalog_path):
+        # columnar catalog of make_dataset.py, only the needed columns are memory-mapped
+        return read_catalog(catalog_path, columns=ITEM_COLUMNS)
+
+    items_df = load_items_csv(items_path, header_path, mt_path)
+    for column in ['language', 'author', 'mt']:
+        items_df[column] = items_df[column].astype('category')
+
+    return items_df
+
+
+def load_books(books_path='items.csv', store_path=BOOKS_FILE):
+    # books of items.csv stored by make_dataset.py, read with the same cleaning from the csv otherwise
+    return read_books(store_path if os.path.exists(store_path) else books_path, columns=BOOK_COLUMNS)
+
+
+def get_recommendations(items_df, df_items, df_transactions, df_evaluation):
+    final_df = pd.DataFrame(columns=['book_id', 'model_id', 'team_id', 'recommendation_1', 'recommendation_2',
+                                     'recommendation_3', 'recommendation_4', 'recommendation_5'])
+
+    x = items_df.copy()
+    catalog = Catalog(x)
+    items_catalog = get_catalog(df_items)
+    for index, row in df_evaluation.iterrows():
+        items_df = x.copy()
+        base_book = row['itemID']
+        logger.debug('book %s', base_book)
+        instrumentation.count('first.queries')
+
+        author = str(catalog.get_author(base_book)).lstrip()
+        mtopic = str(catalog.get_topic(base_book)).strip(' []')
+        lang = str(catalog.get_language(base_book)).lstrip()
+        headerID = int(catalog.get_header_id(base_book))
+
+        with instrumentation.stage('first.lang_filter'):
+            items_df = filter_on_lang(items_df, lang)
+            items_df.reset_index(drop=True, inplace=True)
+
+        with instrumentation.stage('first.author'):
+            df_authorscores = items_df[['itemID', 'title', 'author']]
+            df_authorscores['author_score'] = get_authorscores_fuzzy(df_authorscores, author)
+
+        with instrumentation.stage('first.topic'):
+            df_topicscore = items_df[['headerID', 'itemID', 'title', 'mt']]
+            df_topicscore['mtopic_score'] = get_mtopicscores(df_topicscore, mtopic)
+
+        with instrumentation.stage('first.title'):
+            df_titlescores = items_df[['itemID', 'title', 'author']]
+            df_titlescores['title_score'] = get_titlescores(df_titlescores, items_df, base_book)
+
+        with instrumentation.stage('first.transactions'):
+            result_transactions = recommend_based_on_transactions(df_transactions, items_catalog, base_book)
+
+        with instrumentation.stage('first.total'):
+            result = get_totalscore(df_titlescores, df_authorscores, df_topicscore, result_transactions)
+            result = result[result['headerID'] != headerID]
+            result.drop_duplicates(subset='headerID', keep="first", inplace=True)
+            result = result.sort_values(by='total_score', ascending=False)
+
+        recommendations = result.iloc[0:5, :]
+
+        final_df = final_df.append({'book_id': row['itemID'],
+                                    'model_id': 'first',
+                                    'team_id': 'dataminerz',
+                                    'recommendation_1': recommendations.iloc[0, 0],
+                                    'recommendation_2': recommendations.iloc[1, 0],
+                                    'recommendation_3': recommendations.iloc[2, 0],
+                                    'recommendation_4': recommendations.iloc[3, 0],
+                                    'recommendation_5': recommendations.iloc[4, 0]}, ignore_index=True)
+        logger.debug('%d books recommended', len(final_df))
+
+    return final_df
+
+
+class HybridScorer:
+    """Batch version of the hybrid title/author/main topic/transaction score.
+
+    The catalog is prepared once and every query book is scored against its language partition in one matrix
+    operation per stage. Per query the result is the same ranking get_totalscore produces in get_recommendations:
+    books sharing the headerID of the query are removed, only the first book of every other headerID is kept and
+    the k books with the highest total score are returned.
+
+    Typical usage example:
+
+        >> scorer = HybridScorer(items_df, df_items, df_transactions)
+        >> item_ids, scores = scorer.top_k(df_evaluation['itemID'], k=5)
+    """
+
+    def __init__(self, items_df, df_items, df_transactions, min_lang_size=5, chunk_size=256, index_dir=None,
+                 cooccurrence=None):
+        """
+        Args:
+            items_df (dataframe): Catalog with itemID, headerID, title, author, language and mt column.
+            df_items (dataframe or Catalog): Raw items used by the transaction baseline.
+            df_transactions (dataframe): Sessions used by the transaction baseline.
+            min_lang_size (int): A language is only used as partition if it has more books than this.
+            chunk_size (int): Number of queries scored together, bounds the size of the dense score matrices.
+            index_dir (string): Folder in which the title index of every partition is stored. Without it the
+                indexes are only kept in memory.
+            cooccurrence (CooccurrenceMatrix): Precomputed co-occurrence of the transactions, built from
+                df_transactions if not given.
+        """
+        self.items_df = items_df.reset_index(drop=True)
+        self.items_catalog = get_catalog(df_items)
+        self.df_transactions = df_transactions
+        self.chunk_size = chunk_size
+        self.index_dir = index_dir
+        self.cooccurrence = CooccurrenceMatrix.build(df_transactions) if cooccurrence is None else cooccurrence
+
+        self.catalog = Catalog(self.items_df)
+
+        self.shards = LanguageShards(self.items_df, min_size=min_lang_size)
+
+    def prepare(self):
+        """Builds the features of all language shards instead of on first use."""
+        self.shards.build_all(self.build_partition)
+        return self
+
+    def get_partition(self, language):
+        """Returns the precomputed features of the books filter_on_lang keeps for this language."""
+        return self.shards.get_features(language, self.build_partition)
+
+    def build_partition(self, key, part):
+        return {
+            'rows': self.shards.rows[key],
+            'item_ids': part['itemID'].to_numpy(),
+            'header_ids': part['headerID'].to_numpy(),
+            'first_header': ~part['headerID'].duplicated(keep='first').to_numpy(),
+            'title_index': self.get_title_index(key, part),
+            'author_index': AuthorIndex(part['author'].to_numpy()),
+            'topic_codes': TopicCodes(part['mt'].str.strip(' []').to_numpy(dtype=object)),
+        }
+
+    def get_title_index(self, key, part):
+        """Loads the title index of a partition from index_dir or fits and stores it if it is missing or stale."""
+        path = None
+        if self.index_dir is not None:
+            path = os.path.join(self.index_dir, get_index_name(key))
+            if os.path.exists(os.path.join(path, 'matrix.npz')):
+                index = TitleIndex.load(path)
+                if index.is_current(part['title'], part['itemID'].to_numpy()):
+                    return index
+
+        index = TitleIndex.fit(part['title'], part['itemID'])
+        if path is not None:
+            index.save(path)
+        return index
+
+    def get_titlescores(self, partition, positions):
+        return partition['title_index'].get_scores(positions)
+
+    def get_authorscores(self, partition, authors):
+        return partition['author_index'].get_scores(authors)
+
+    def get_mtopicscores(self, partition, mtopics):
+        return partition['topic_codes'].get_scores(mtopics)
+
+    def get_transscores(self, partition, base_books):
+        # the baseline exits for books unknown to the items, the batch gives them no transaction score
+        recommended = recommend_based_on_transactions_batch(self.items_catalog, base_books, self.cooccurrence)
+        rows = np.repeat(np.arange(len(base_books)), [len(item_ids) for item_ids in recommended])
+        columns = pd.Index(partition['item_ids']).get_indexer([item_id for item_ids in recommended
+                                                               for item_id in item_ids])
+        scores = np.zeros((len(base_books), len(partition['item_ids'])))
+        scores[rows[columns >= 0], columns[columns >= 0]] = 1
+        return scores
+
+    def get_totalscores(self, partition, rows):
+        """Returns the total score of the query rows against all books of their partition.
+
+        Books that get_recommendations would drop (same headerID, duplicate headerID) are scored -inf.
+        """
+        queries = self.items_df.iloc[rows]
+        positions = np.searchsorted(partition['rows'], rows)
+
+        with instrumentation.stage('hybrid.title'):
+            total = self.get_titlescores(partition, positions)
+        with instrumentation.stage('hybrid.author'):
+            total += self.get_authorscores(partition,
+                                           queries['author'].astype(object).fillna('').astype(str).tolist())
+        with instrumentation.stage('hybrid.topic'):
+            total += self.get_mtopicscores(partition, queries['mt'].str.strip(' []').tolist())
+        with instrumentation.stage('hybrid.transactions'):
+            total += self.get_transscores(partition, queries['itemID'].tolist())
+
+        same_header = partition['header_ids'][np.newaxis, :] == queries['headerID'].to_numpy()[:, np.newaxis]
+        total[same_header | ~partition['first_header'][np.newaxis, :]] = -np.inf
+        return total
+
+    def top_k(self, base_books, k=5):
+        """Finds the k best recommendations for every query book.
+
+        Args:
+            base_books (array): itemIDs of the query books.
+            k (int): Number of recommendations per query book.
+
+        Returns:
+            Tuple of two (len(base_books), k) arrays with the recommended itemIDs and their total scores, best
+            first. Missing recommendations are NaN.
+        """
+        base_books = np.asarray(base_books)
+        instrumentation.count('hybrid.queries', len(base_books))
+        rows = self.catalog.get_positions(base_books)
+        item_ids = np.full((len(base_books), k), np.nan)
+        scores = np.full((len(base_books), k), np.nan)
+
+        keys = self.shards.get_keys(self.items_df['language'].iloc[rows].to_numpy())
+        for key in pd.unique(keys):
+            with instrumentation.stage('hybrid.lang_filter'):
+                partition = self.get_partition(key)
+                query_idx = np.flatnonzero(keys == key) if key is not None else np.flatnonzero(pd.isnull(keys))
+            for start in range(0, len(query_idx), self.chunk_size):
+                chunk = query_idx[start:start + self.chunk_size]
+                instrumentation.count('hybrid.scored_pairs', len(chunk) * len(partition['item_ids']))
+                with instrumentation.stage('hybrid.total'):
+                    total = self.get_totalscores(partition, rows[chunk])
+
+                n = min(k, total.shape[1])
+                best = np.argpartition(-total, n - 1, axis=1)[:, :n]
+                best_scores = np.take_along_axis(total, best, axis=1)
+                # sort by score, ties broken by catalog order
+                order = np.lexsort((best, -best_scores), axis=1)
+                best = np.take_along_axis(best, order, axis=1)
+                best_scores = np.take_along_axis(best_scores, order, axis=1)
+
+                found = np.isfinite(best_scores)
+                item_ids[chunk, :n] = np.where(found, partition['item_ids'][best], np.nan)
+                scores[chunk, :n] = np.where(found, best_scores, np.nan)
+
+        return item_ids, scores
+
+
+def get_recommendations_batch(items_df, df_items, df_transactions, df_evaluation, k=5, index_dir=None):
+    scorer = HybridScorer(items_df, df_items, df_transactions, index_dir=index_dir)
+    item_ids, _ = scorer.top_k(df_evaluation['itemID'].to_numpy(), k=k)
+
+    final_df = pd.DataFrame(item_ids, columns=['recommendation_{}'.format(i + 1) for i in range(k)]).astype('Int64')
+    final_df.insert(0, 'book_id', df_evaluation['itemID'].to_numpy())
+    final_df.insert(1, 'model_id', 'first')
+    final_df.insert(2, 'team_id', 'dataminerz')
+
+    return final_df
+
+
+def main():
+    df_items = load_books()
+    df_transactions = pd.read_csv('transactions.csv', sep='|')
+    df_evaluation = pd.read_csv('evaluation.csv', sep='|')
+    items_df = load_items()
+
+    final_df = get_recommendations_batch(items_df, df_items, df_transactions, df_evaluation, index_dir='title_index')
+    final_df.to_csv('rec_final.csv')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
+import numpy as np
 from tqdm import tqdm
 
+from src import instrumentation
 from src.features.jaccard import jaccard
 
 tqdm.pandas()
@@ -13,63 +15,47 @@ def add_to_recommendation(cross_cut, recommendation):
             recommendation[query_id].append(document_id)
 
 
-def search_recommendation(cross, recommendation):
-    cross["jaccard"] = jaccard(cross.title_processed_query, cross.title_processed_document)
-    cross = cross.sort_values("jaccard", ascending=False)
-
-    # Filter on author
-    try:
-        cross_author = cross[cross.author_query == cross.author_document]
-        cross_author_cutoff = cross_author[cross_author.jaccard >= 0.2].reset_index(
-            drop=True)
-        add_to_recommendation(cross_author_cutoff, recommendation)
-    except AttributeError:
-        print("No same author")
-
-    # Filter on categories
-    cross_category = cross[cross.topic_query == cross.topic_document]
-    try:
-        cross_filter = cross_category[cross_category["subtopic_query"].apply(lambda x: x != [""])]
-        cross_subtopic = cross_filter[(cross_filter.subtopic_query == cross_filter.subtopic_document)]
-        cross_subtopic_cutoff = cross_subtopic[cross_subtopic.jaccard >= 0.2].reset_index(
-            drop=True)
-        add_to_recommendation(cross_subtopic_cutoff, recommendation)
-    except AttributeError:
-        print("No same subtopic")
-
-    try:
-        cross_category_cutoff = cross_category[cross_category.jaccard >= 0.2].reset_index(
-            drop=True)
-        add_to_recommendation(cross_category_cutoff, recommendation)
-    except AttributeError:
-        print("No same category")
+def get_tiers(cross):
+    """ Priority of every pair, the order in which the filters of the rule based model consider it.
 
-    cross_cutoff = cross[cross.jaccard >= 0.2].reset_index(drop=True)
-    add_to_recommendation(cross_cutoff, recommendation)
+    0: same author, 1: same subtopic, 2: same category, 3: any pair, all with a jaccard of at least 0.2,
+    4 to 7: the same filters for the pairs below 0.2 that fill the rest.
+    """
+    cutoff = (cross.jaccard >= 0.2).to_numpy()
+    author = (cross.author_query == cross.author_document).to_numpy()
+    category = (cross.topic_query == cross.topic_document).to_numpy()
+    subtopic = category & np.array([query != [""] and query == document for query, document in
+                                    zip(cross.subtopic_query, cross.subtopic_document)], dtype=bool)
 
-    # Fill the rest
-    try:
-        cross_author_cut = cross_author[cross_author.jaccard < 0.2].reset_index(
-            drop=True)
-        add_to_recommendation(cross_author_cut, recommendation)
-    except (AttributeError,UnboundLocalError):
-        print("No same author")
+    return np.select([author & cutoff, subtopic & cutoff, category & cutoff, cutoff, author, subtopic, category],
+                     [0, 1, 2, 3, 4, 5, 6], default=7)
 
-    try:
-        cross_subtopic_cut = cross_subtopic[cross_subtopic.jaccard < 0.2].reset_index(
-            drop=True)
 
-        add_to_recommendation(cross_subtopic_cut, recommendation)
-    except (AttributeError,UnboundLocalError):
-        print("No same subtopic")
-
-    try:
-        cross_category_cut = cross_category[cross_category.jaccard < 0.2].reset_index(
-            drop=True)
-        add_to_recommendation(cross_category_cut, recommendation)
-    except (AttributeError,UnboundLocalError):
-        print("No same category")
-
-    cross_cut = cross[cross.jaccard < 0.2].reset_index(drop=True)
-
-    add_to_recommendation(cross_cut, recommendation)
\ No newline at end of file
+def search_recommendation(cross, recommendation):
+    instrumentation.count("rule_based.pairs", len(cross))
+    with instrumentation.stage("rule_based.jaccard"):
+        cross["jaccard"] = jaccard(cross.title_processed_query, cross.title_processed_document)
+
+    with instrumentation.stage("rule_based.rank"):
+        # a single stable sort by tier and jaccard replaces walking the filtered slices one after another
+        order = np.lexsort((-cross.jaccard.to_numpy(), get_tiers(cross)))
+        ranked = cross[["id_query", "id_document"]].iloc[order].drop_duplicates()
+        # at most 5 documents can already be in the recommendation, so 10 candidates per query are enough
+        ranked = ranked.groupby("id_query", sort=False).head(10)
+        candidates = ranked.groupby("id_query", sort=False).id_document.agg(list)
+
+    with instrumentation.stage("rule_based.select"):
+        for query_id, documents in candidates.items():
+            selected = recommendation[query_id]
+            for document_id in documents:
+                if len(selected) >= 5:
+                    break
+                if document_id not in selected:
+                    selected.append(document_id)
+
+
+def search_recommendation_chunked(crosses, recommendation):
+    """ Runs search_recommendation on every frame of candidate pairs, e.g. from generate_candidates.
+    """
+    for cross in crosses:
+        search_recommendation(cross, recommendation)
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""Resident recommendation service for any book of the catalog.
+
+  The website used to serve only the precomputed recommendations of the evaluation books. The service loads the
+  catalog, the indexes and the model artifacts once and answers "top k books similar to itemID" from memory for the
+  hybrid model of recommendations.py, the rule based model of rule_based.py and the transaction baseline of
+  baseline_transaction.py.
+
+  Endpoints, all answers are JSON:
+
+    GET  /health
+    GET  /recommendations?item_id=12&k=5&model=hybrid
+    POST /recommendations/batch  with the body {"item_ids": [12, 45274], "k": 5, "model": "hybrid"}
+    GET  /instrumentation        report of the stage timers, see src/instrumentation.py
+    POST /instrumentation        with the body {"enabled": true, "profile": false, "reset": true} switches them
+
+  Typical usage example:
+
+    $ python src/models/service.py data/processed/catalog.arrow data/processed/books.arrow data/raw/transactions.csv \
+          --cooccurrence models/cooccurrence --index-dir models/title_index --port 8000
+    $ curl "localhost:8000/recommendations?item_id=12"
+"""
+
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import click
+import numpy as np
+import pandas as pd
+
+from src import instrumentation
+from src.data.catalog import get_catalog
+from src.data.catalog_store import BOOK_COLUMNS, ITEM_COLUMNS, read_books, read_catalog
+from src.data.preprocessing import generate_candidates, get_document_index
+from src.features.cooccurrence import CooccurrenceMatrix
+from src.features.language_shards import LanguageShards
+from src.models.baseline_transaction import recommend_based_on_transactions
+from src.models.recommendations import HybridScorer
+from src.models.rule_based import search_recommendation_chunked
+
+MAX_K = 100
+
+
+class HybridRecommender:
+    """Hybrid title, author, main topic and transaction score of HybridScorer."""
+
+    def __init__(self, scorer):
+        """
+        Args:
+            scorer (HybridScorer): Scorer of the catalog, all its language shards are built up front.
+        """
+        self.scorer = scorer.prepare()
+
+    def __contains__(self, item_id):
+        return item_id in self.scorer.catalog
+
+    def top_k(self, item_ids, k=5):
+        """Lists of the k best itemIDs for every query book."""
+        recommended, _ = self.scorer.top_k(item_ids, k=k)
+        return [[int(item_id) for item_id in row if not np.isnan(item_id)] for row in recommended]
+
+
+class TransactionRecommender:
+    """Books bought, clicked or put into the basket in the sessions of the query book."""
+
+    def __init__(self, df_transactions, df_items, cooccurrence=None):
+        """
+        Args:
+            df_transactions (dataframe): Sessions with itemID, click, basket and order column.
+            df_items (dataframe or Catalog): Items with itemID and title.
+            cooccurrence (CooccurrenceMatrix): Precomputed co-occurrence, built from df_transactions if None.
+        """
+        self.df_transactions = df_transactions
+        self.catalog = get_catalog(df_items)
+        self.cooccurrence = CooccurrenceMatrix.build(df_transactions) if cooccurrence is None else cooccurrence
+
+    def __contains__(self, item_id):
+        return item_id in self.catalog
+
+    def top_k(self, item_ids, k=5):
+        """Lists of the k best itemIDs for every query book."""
+        return [[int(item_id) for item_id in recommend_based_on_transactions(
+            self.df_transactions, self.catalog, item_id, max_number_recommendation=k, verbose=False,
+            cooccurrence=self.cooccurrence)] for item_id in item_ids]
+
+
+class RuleBasedRecommender:
+    """Rule based model on the candidates of the language shard of the query book."""
+
+    def __init__(self, document, min_lang_size=5):
+        """
+        Args:
+            document (dataframe): Documents of preprocess_books with title_processed_document column, see
+                tokenize_titles. The query books are taken from it.
+            min_lang_size (int): Languages with this many books or fewer are served from all documents.
+        """
+        self.document = document.reset_index(drop=True)
+        # the first row of every document, so duplicate ids do not shift the rows of the others
+        first_rows = self.document.drop_duplicates('id_document')
+        self.positions = pd.Series(first_rows.index.to_numpy(), index=first_rows['id_document'])
+        self.shards = LanguageShards(self.document, min_size=min_lang_size)
+        self.shards.build_all(lambda key, shard: get_document_index(shard))
+
+    def __contains__(self, item_id):
+        return item_id in self.positions.index
+
+    def get_query(self, rows):
+        """Documents at rows as query frame."""
+        query = self.document.iloc[rows]
+        return query.rename(columns={column: column.replace('_document', '_query') for column in query.columns})
+
+    def top_k(self, item_ids, k=5):
+        """Lists of the best itemIDs for every query book, the rule based model recommends at most 5 books."""
+        rows = self.positions[list(item_ids)].to_numpy()
+        recommendation = {item_id: [] for item_id in item_ids}
+
+        keys = self.shards.get_keys(self.document['language'].iloc[rows].to_numpy())
+        for key in pd.unique(keys):
+            chunk = rows[np.array([shard_key == key for shard_key in keys])]
+            crosses = generate_candidates(self.get_query(chunk), self.shards.get_shard(key),
+                                          document_index=self.shards.features[key])
+            search_recommendation_chunked(crosses, recommendation)
+
+        return [[int(document_id) for document_id in recommendation[item_id][:k]] for item_id in item_ids]
+
+
+class RecommendationService:
+    """One API over several recommenders, every model answers with the itemIDs of its top k books."""
+
+    def __init__(self, models, default_model):
+        """
+        Args:
+            models (dict): Recommender by model name, a recommender supports `in` and top_k(item_ids, k).
+            default_model (string): Model used if a request names none.
+        """
+        self.models = models
+        self.default_model = default_model
+
+    def get_model(self, model):
+        model = self.default_model if model is None else model
+        if model not in self.models:
+            raise KeyError('unknown model {}'.format(model))
+        return self.models[model]
+
+    def recommend(self, item_id, k=5, model=None):
+        """Recommendation for one book, None if the model does not know it."""
+        return self.recommend_batch([item_id], k, model)[0]
+
+    def recommend_batch(self, item_ids, k=5, model=None):
+        """Recommendations for a list of books in one call, None for books the model does not know."""
+        recommender = self.get_model(model)
+        known = [item_id for item_id in item_ids if item_id in recommender]
+        recommended = dict(zip(known, recommender.top_k(known, k=k))) if known else {}
+        return [recommended.get(item_id) for item_id in item_ids]
+
+
+class RecommendationHandler(BaseHTTPRequestHandler):
+    """HTTP request handler answering with the RecommendationService in service, see make_handler."""
+
+    service = None
+
+    # method answering every path
+    GET_ROUTES = {'/health': 'send_health', '/instrumentation': 'send_instrumentation',
+                  '/recommendations': 'send_recommendation'}
+    POST_ROUTES = {'/instrumentation': 'switch_instrumentation', '/recommendations/batch': 'send_recommendations'}
+
+    def do_GET(self):
+        getattr(self, self.GET_ROUTES.get(urlparse(self.path).path, 'send_not_found'))()
+
+    def do_POST(self):
+        getattr(self, self.POST_ROUTES.get(urlparse(self.path).path, 'send_not_found'))()
+
+    def send_json(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_not_found(self):
+        self.send_json(404, {'error': 'not found'})
+
+    def send_invalid(self, error):
+        self.send_json(400, {'error': 'invalid request: {}'.format(error)})
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def send_health(self):
+        self.send_json(200, {'models': sorted(self.service.models)})
+
+    def send_instrumentation(self):
+        self.send_json(200, instrumentation.get_report())
+
+    def send_recommendation(self):
+        try:
+            item_id, k, model = parse_recommendation_query(self.service, urlparse(self.path).query)
+        except (KeyError, ValueError) as e:
+            return self.send_invalid(e)
+
+        recommendations = self.recommend([item_id], k, model)
+        if recommendations is None:
+            return
+        if recommendations[0] is None:
+            return self.send_json(404, {'error': 'unknown item_id {}'.format(item_id)})
+        self.send_json(200, {'item_id': item_id, 'recommendations': recommendations[0]})
+
+    def send_recommendations(self):
+        try:
+            item_ids, k, model = parse_batch_body(self.service, self.read_body())
+        except (KeyError, TypeError, ValueError) as e:
+            return self.send_invalid(e)
+
+        recommendations = self.recommend(item_ids, k, model)
+        if recommendations is not None:
+            self.send_json(200, {'item_ids': item_ids, 'recommendations': recommendations})
+
+    def recommend(self, item_ids, k, model):
+        """Recommendations of the service, a failing model is answered with status 500."""
+        try:
+            return self.service.recommend_batch(item_ids, k, model)
+        except Exception:
+            logging.getLogger(__name__).exception('recommendation for %s failed', item_ids)
+            self.send_json(500, {'error': 'recommendation failed'})
+            return None
+
+    def switch_instrumentation(self):
+        try:
+            enabled, profile, reset = parse_instrumentation_body(self.read_body())
+        except (AttributeError, TypeError, ValueError) as e:
+            return self.send_invalid(e)
+
+        instrumentation.disable()
+        if reset:
+            instrumentation.reset()
+        if enabled:
+            instrumentation.enable(profile=profile)
+        self.send_json(200, {'enabled': enabled, 'profile': enabled and profile})
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format, *args)
+
+
+def make_handler(service):
+    """RecommendationHandler class answering with service."""
+    return type('RecommendationHandler', (RecommendationHandler,), {'service': service})
+
+
+def parse_k(value):
+    k = int(value)
+    if not 0 < k <= MAX_K:
+        raise ValueError('k must be between 1 and {}'.format(MAX_K))
+    return k
+
+
+def parse_model(service, model):
+    if model is not None and model not in service.models:
+        raise ValueError('unknown model {}'.format(model))
+    return model
+
+
+def parse_recommendation_query(service, query):
+    """item_id, k and model of the query string of GET /recommendations, raises KeyError or ValueError."""
+    params = {name: values[0] for name, values in parse_qs(query).items()}
+    return int(params['item_id']), parse_k(params.get('k', 5)), parse_model(service, params.get('model'))
+
+
+def parse_batch_body(service, body):
+    """item_ids, k and model of the body of POST /recommendations/batch, raises KeyError, TypeError or ValueError."""
+    body = json.loads(body)
+    item_ids = [int(item_id) for item_id in body['item_ids']]
+    return item_ids, parse_k(body.get('k', 5)), parse_model(service, body.get('model'))
+
+
+def parse_instrumentation_body(body):
+    """enabled, profile and reset flags of the body of POST /instrumentation."""
+    body = json.loads(body)
+    return tuple(bool(body.get(name, False)) for name in ('enabled', 'profile', 'reset'))
+
+
+def serve(service, host='127.0.0.1', port=8000):
+    """Answers requests until interrupted, every request is handled in its own thread."""
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    logging.getLogger(__name__).info('serving %s on %s:%d', ', '.join(sorted(service.models)), host, port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+@click.command()
+@click.argument('catalog_filepath', type=click.Path(exists=True))
+@click.argument('items_filepath', type=click.Path(exists=True))
+@click.argument('transactions_filepath', type=click.Path(exists=True))
+@click.option('--cooccurrence', 'cooccurrence_path', type=click.Path(exists=True),
+              help='Folder of a saved CooccurrenceMatrix, built from the transactions if not given.')
+@click.option('--index-dir', type=click.Path(), help='Folder of the stored title indexes of the hybrid model.')
+@click.option('--rule-based-documents', type=click.Path(exists=True),
+              help='Pickled documents with title_processed_document column, enables the rule based model.')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8000)
+@click.option('--instrumentation', 'instrumented', is_flag=True,
+              help='Record the stage timers from the start, see GET /instrumentation.')
+def main(catalog_filepath, items_filepath, transactions_filepath, cooccurrence_path, index_dir, rule_based_documents,
+         host, port, instrumented):
+    """ Loads the models once and serves their recommendations.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info('loading models')
+    if instrumented:
+        instrumentation.enable()
+
+    items_df = read_catalog(catalog_filepath, columns=ITEM_COLUMNS)
+    df_items = read_books(items_filepath, columns=BOOK_COLUMNS)
+    df_transactions = pd.read_csv(transactions_filepath, sep='|')
+    cooccurrence = (CooccurrenceMatrix.build(df_transactions) if cooccurrence_path is None
+                    else CooccurrenceMatrix.load(cooccurrence_path))
+
+    models = {
+        'hybrid': HybridRecommender(HybridScorer(items_df, df_items, df_transactions, index_dir=index_dir,
+                                                 cooccurrence=cooccurrence)),
+        'transactions': TransactionRecommender(df_transactions, df_items, cooccurrence),
+    }
+    if rule_based_documents is not None:
+        models['rule_based'] = RuleBasedRecommender(pd.read_pickle(rule_based_documents))
+
+    serve(RecommendationService(models, default_model='hybrid'), host, port)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
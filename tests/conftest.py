@@ -0,0 +1,63 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import pytest
+
+
+class StubServer:
+    """Local stand-in of a website, answers the registered paths and records every request."""
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.make_handler())
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def add(self, path, body, status=200, failures=0, failure_status=503):
+        """Answers path with body, the first failures requests get failure_status instead."""
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.routes[path] = [(failure_status, b'')] * failures + [(status, body)]
+
+    def get_requests(self, path=None):
+        """Times of the requests to path, of all requests if None."""
+        with self.lock:
+            return [at for requested, at in self.requests if path is None or requested == path]
+
+    def answer(self, path):
+        with self.lock:
+            self.requests.append((path, time.monotonic()))
+            answers = self.routes.get(path)
+            if answers is None:
+                return 404, b''
+            # the last answer is repeated
+            return answers.pop(0) if len(answers) > 1 else answers[0]
+
+    def make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = stub.answer(unquote(self.path))
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def stub_server():
+    stub = StubServer()
+    thread = threading.Thread(target=stub.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
@@ -0,0 +1,185 @@
+import importlib
+import json
+import sys
+import threading
+import types
+import uuid
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+# maximum number of writes of a Firestore batch
+FIRESTORE_BATCH_LIMIT = 500
+
+
+class FakeSnapshot:
+    def __init__(self, document_id, data):
+        self.id = document_id
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class FakeDocumentReference:
+    def __init__(self, documents, document_id):
+        self.documents = documents
+        self.id = document_id
+
+
+class FakeQuery:
+    """Query on the documents of a collection, only ordering by document id is supported."""
+
+    def __init__(self, client, documents, after=None, limit_count=None):
+        self.client = client
+        self.documents = documents
+        self.after = after
+        self.limit_count = limit_count
+
+    def order_by(self, field_path):
+        return self
+
+    def limit(self, count):
+        return FakeQuery(self.client, self.documents, self.after, count)
+
+    def start_after(self, snapshot):
+        return FakeQuery(self.client, self.documents, snapshot.id, self.limit_count)
+
+    def stream(self):
+        self.client.queries.append(self)
+        document_ids = sorted(document_id for document_id in self.documents
+                              if self.after is None or document_id > self.after)
+        return iter([FakeSnapshot(document_id, self.documents[document_id])
+                     for document_id in document_ids[:self.limit_count]])
+
+
+class FakeCollection(FakeQuery):
+    def document(self):
+        # automatic ids are random, so the documents are not read in the order they were written
+        return FakeDocumentReference(self.documents, uuid.uuid4().hex)
+
+
+class FakeBatch:
+    def __init__(self, client):
+        self.client = client
+        self.writes = []
+
+    def set(self, reference, data):
+        self.writes.append((reference, data))
+
+    def commit(self):
+        if len(self.writes) > FIRESTORE_BATCH_LIMIT:
+            raise ValueError('maximum {} writes allowed per request'.format(FIRESTORE_BATCH_LIMIT))
+        with self.client.lock:
+            self.client.commits.append(len(self.writes))
+            for reference, data in self.writes:
+                reference.documents[reference.id] = dict(data)
+
+
+class FakeFirestore:
+    """In-memory stand-in of the firestore client with the calls used by firestore.py."""
+
+    def __init__(self):
+        self.collections = {}
+        self.commits = []
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def collection(self, name):
+        return FakeCollection(self, self.collections.setdefault(name, {}))
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+class FakeFieldPath:
+    @staticmethod
+    def document_id():
+        return '__name__'
+
+
+@pytest.fixture
+def firestore(monkeypatch):
+    """src.data.firestore, imported against stub firebase_admin modules if firebase_admin is not installed."""
+    try:
+        importlib.import_module('firebase_admin.firestore')
+    except ImportError:
+        firestore_stub = types.ModuleType('firebase_admin.firestore')
+        firestore_stub.FieldPath = FakeFieldPath
+        firebase_admin_stub = types.ModuleType('firebase_admin')
+        firebase_admin_stub.firestore = firestore_stub
+        monkeypatch.setitem(sys.modules, 'firebase_admin', firebase_admin_stub)
+        monkeypatch.setitem(sys.modules, 'firebase_admin.firestore', firestore_stub)
+        # a module imported by an earlier test holds the stubs of that test
+        monkeypatch.delitem(sys.modules, 'src.data.firestore', raising=False)
+    return importlib.import_module('src.data.firestore')
+
+
+@pytest.fixture
+def firestore_client():
+    return FakeFirestore()
+
+
+def add_documents(client, collection, count):
+    documents = client.collection(collection).documents
+    for i in range(count):
+        documents['{:04d}'.format(i)] = {'itemID': i}
+
+
+def test_writes_are_split_into_batches_of_at_most_500(firestore, firestore_client):
+    data = pd.DataFrame({'itemID': range(1234), 'title': ['Tintenherz'] * 1234})
+
+    firestore.write_documents_to_collection(firestore_client, data, collection='books')
+
+    assert sorted(firestore_client.commits) == [234, 500, 500]
+    documents = firestore_client.collections['books'].values()
+    assert sorted(document['itemID'] for document in documents) == list(range(1234))
+
+
+def test_batch_size_above_the_firestore_limit_is_rejected(firestore, firestore_client):
+    with pytest.raises(ValueError):
+        firestore.write_documents_to_collection(firestore_client, pd.DataFrame({'itemID': [1]}),
+                                                batch_size=firestore.MAX_BATCH_SIZE + 1)
+
+
+def test_pages_continue_after_the_last_document_of_the_previous_page(firestore, firestore_client):
+    add_documents(firestore_client, 'books', 25)
+
+    pages = list(firestore.stream_documents_from_collection(firestore_client, 'books', page_size=10))
+
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert [document['itemID'] for page in pages for document in page] == list(range(25))
+    assert [query.after for query in firestore_client.queries] == [None, '0009', '0019']
+
+
+def test_full_last_page_ends_with_an_empty_query(firestore, firestore_client):
+    add_documents(firestore_client, 'books', 20)
+
+    pages = list(firestore.stream_documents_from_collection(firestore_client, 'books', page_size=10))
+
+    assert [len(page) for page in pages] == [10, 10]
+    assert len(firestore_client.queries) == 3
+
+
+def test_written_documents_are_read_back(firestore, firestore_client):
+    firestore.write_documents_to_collection(firestore_client, pd.DataFrame({'itemID': range(1100)}),
+                                            collection='books', batch_size=300)
+
+    documents = firestore.retrieve_documents_from_collection(firestore_client, 'books', page_size=400)
+
+    assert sorted(document['itemID'] for document in documents) == list(range(1100))
+    assert len(firestore_client.queries) == 3
+
+
+def test_collection_is_downloaded_as_json_lines(firestore, firestore_client, tmp_path):
+    add_documents(firestore_client, 'decisions', 7)
+    firestore_client.collection('decisions').documents['0000']['time'] = datetime(2021, 6, 1)
+    path = tmp_path / 'decisions.jsonl'
+
+    count = firestore.download_collection(firestore_client, str(path), collection='decisions', page_size=3)
+
+    lines = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert count == 7
+    assert [line['itemID'] for line in lines] == list(range(7))
+    assert lines[0]['time'] == '2021-06-01 00:00:00'
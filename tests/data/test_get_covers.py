@@ -0,0 +1,87 @@
+import io
+import logging
+import os
+
+from PIL import Image
+
+from src.data import get_covers
+from src.data.get_covers import COVER_FOLDER, THUMBNAIL_FOLDER, get_cover_path, load_cover_index
+from src.data.http_client import HttpClient
+
+
+def get_image(color):
+    content = io.BytesIO()
+    Image.new('RGB', (400, 600), color).save(content, 'JPEG')
+    return content.getvalue()
+
+
+def write_items(tmp_path):
+    path = tmp_path / 'items.csv'
+    path.write_text('itemID|title|author|publisher|main topic|subtopics\n'
+                    '1|Tintenherz|Cornelia Funke|Dressler|YFH|[]\n'
+                    '2|Tintenblut|Cornelia Funke|Dressler|YFH|[]\n', encoding='utf-8')
+    return str(path)
+
+
+def test_corrupt_cover_does_not_stop_the_thumbnails(stub_server, tmp_path, caplog):
+    stub_server.add('/cover/1.jpg', get_image('red'))
+    stub_server.add('/cover/2.jpg', b'not an image')
+    target = str(tmp_path / 'covers')
+    cover_urls = {book_id: '{}/cover/{}.jpg'.format(stub_server.url, book_id) for book_id in (1, 2)}
+    client = HttpClient(retries=0, requests_per_second=None)
+
+    with caplog.at_level(logging.WARNING, logger=get_covers.__name__):
+        get_covers.get_covers([1, 2], target, write_items(tmp_path), cache_dir=None, client=client,
+                              thumbnail_workers=1, cover_urls=cover_urls)
+
+    index = load_cover_index(os.path.join(target, get_covers.COVER_INDEX_FILE))
+    assert sorted(index) == [1, 2]
+    assert os.path.exists(get_cover_path(target, THUMBNAIL_FOLDER, index[1]))
+    assert not os.path.exists(get_cover_path(target, THUMBNAIL_FOLDER, index[2]))
+    assert 'no thumbnail for cover {}'.format(index[2]) in caplog.text
+
+
+def test_indexed_covers_are_not_hashed_again(stub_server, tmp_path, monkeypatch):
+    stub_server.add('/cover/1.jpg', get_image('red'))
+    stub_server.add('/cover/2.jpg', get_image('blue'))
+    target = str(tmp_path / 'covers')
+    items_path = write_items(tmp_path)
+    cover_urls = {book_id: '{}/cover/{}.jpg'.format(stub_server.url, book_id) for book_id in (1, 2)}
+    client = HttpClient(retries=0, requests_per_second=None)
+    get_covers.get_covers([1], target, items_path, cache_dir=None, client=client, thumbnail_workers=1,
+                          cover_urls=cover_urls)
+
+    def get_file_hash(path):
+        raise AssertionError('hashed {}'.format(path))
+
+    monkeypatch.setattr(get_covers, 'get_file_hash', get_file_hash)
+    get_covers.get_covers([1, 2], target, items_path, cache_dir=None, client=client, thumbnail_workers=1,
+                          cover_urls=cover_urls)
+
+    assert len(stub_server.get_requests('/cover/1.jpg')) == 1
+    assert len(stub_server.get_requests('/cover/2.jpg')) == 1
+    index = load_cover_index(os.path.join(target, get_covers.COVER_INDEX_FILE))
+    assert all(os.path.exists(get_cover_path(target, COVER_FOLDER, sha256)) for sha256 in index.values())
+
+
+def test_shared_cover_gets_one_thumbnail_job(stub_server, tmp_path, monkeypatch):
+    stub_server.add('/cover/placeholder.jpg', get_image('grey'))
+    target = str(tmp_path / 'covers')
+    cover_urls = {book_id: '{}/cover/placeholder.jpg'.format(stub_server.url) for book_id in (1, 2)}
+    client = HttpClient(retries=0, requests_per_second=None)
+    submitted = []
+    submit_thumbnail = get_covers.submit_thumbnail
+
+    def count_thumbnail(executor, target_folder_name, sha256, size):
+        submitted.append(sha256)
+        return submit_thumbnail(executor, target_folder_name, sha256, size)
+
+    monkeypatch.setattr(get_covers, 'submit_thumbnail', count_thumbnail)
+    get_covers.get_covers([1, 2], target, write_items(tmp_path), cache_dir=None, client=client,
+                          thumbnail_workers=1, cover_urls=cover_urls)
+
+    index = load_cover_index(os.path.join(target, get_covers.COVER_INDEX_FILE))
+    assert index[1] == index[2]
+    assert submitted == [index[1]]
+    assert os.path.exists(get_cover_path(target, THUMBNAIL_FOLDER, index[1]))
+    assert not [name for _, _, names in os.walk(target) for name in names if name.endswith('.tmp')]
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from src.data.get_thalia_features import get_thalia_features, load_checkpoint
+from src.data.http_client import HttpClient
+
+SEARCH = '/suche?filterPATHROOT=&sq={}'
+SEARCH_RESULT = '<html><body><a caption="suchergebnis-klick" href="/artikel/{}">Treffer</a></body></html>'
+NO_SEARCH_RESULT = '<html><body><p>Keine Treffer</p></body></html>'
+PRODUCT_PAGE = ('<html><body><div class="text-infos"><p>{}</p></div><table>'
+                '<tr data-test="produktdetails_seitenzahl"><td>{}</td></tr></table></body></html>')
+
+
+@pytest.fixture
+def items_path(tmp_path):
+    path = tmp_path / 'items.csv'
+    path.write_text('itemID|title|author|publisher|main topic|subtopics\n'
+                    '1|Tintenherz|Cornelia Funke|Dressler|YFH|[]\n'
+                    '2|Tintenblut|Cornelia Funke|Dressler|YFH|[]\n'
+                    '3|Unbekannt|Niemand|Niemand|YFH|[]\n', encoding='utf-8')
+    return str(path)
+
+
+@pytest.fixture
+def thalia(stub_server):
+    for item_id, title, pages in [(1, 'Tintenherz', 576), (2, 'Tintenblut', 720)]:
+        stub_server.add(SEARCH.format(title), SEARCH_RESULT.format(item_id))
+        stub_server.add('/artikel/{}'.format(item_id), PRODUCT_PAGE.format(title + ' Beschreibung', pages))
+    stub_server.add(SEARCH.format('Unbekannt'), NO_SEARCH_RESULT)
+    return stub_server
+
+
+def get_client():
+    return HttpClient(retries=1, backoff_factor=0, requests_per_second=None)
+
+
+def test_books_are_scraped_from_base_url(thalia, items_path):
+    features = get_thalia_features([1, 3], items_path, base_url=thalia.url, cache_dir=None, client=get_client())
+
+    assert features['itemID'].tolist() == [1, 3]
+    assert features['description'].tolist() == ['Tintenherz Beschreibung', '']
+    assert features['number_pages'].tolist() == [576, '']
+
+
+def test_interrupted_run_resumes_with_failed_books(thalia, items_path, tmp_path):
+    checkpoint_path = str(tmp_path / 'features.jsonl')
+    thalia.add('/artikel/2', '', status=500)
+
+    features = get_thalia_features([1, 2, 3], items_path, checkpoint_path=checkpoint_path, base_url=thalia.url,
+                                   cache_dir=None, client=get_client())
+    assert features['description'].tolist() == ['Tintenherz Beschreibung', 'error', '']
+    with open(checkpoint_path, encoding='utf-8') as f:
+        assert sorted(json.loads(line)['itemID'] for line in f) == [1, 3]
+
+    thalia.add('/artikel/2', PRODUCT_PAGE.format('Tintenblut Beschreibung', 720))
+    features = get_thalia_features([1, 2, 3], items_path, checkpoint_path=checkpoint_path, base_url=thalia.url,
+                                   cache_dir=None, client=get_client())
+    assert features['description'].tolist() == ['Tintenherz Beschreibung', 'Tintenblut Beschreibung', '']
+    assert features['number_pages'].tolist() == [576, 720, '']
+    # the checkpointed books are not requested again
+    assert len(thalia.get_requests('/artikel/1')) == 1
+    assert len(thalia.get_requests(SEARCH.format('Unbekannt'))) == 1
+    assert sorted(load_checkpoint(checkpoint_path)) == [1, 2, 3]
+
+
+def test_failed_search_is_not_checkpointed(thalia, items_path, tmp_path):
+    checkpoint_path = str(tmp_path / 'features.jsonl')
+    thalia.add(SEARCH.format('Tintenblut'), '', status=503)
+
+    features = get_thalia_features([1, 2], items_path, checkpoint_path=checkpoint_path, base_url=thalia.url,
+                                   cache_dir=None, client=get_client())
+
+    assert features['description'].tolist() == ['Tintenherz Beschreibung', 'error']
+    assert sorted(load_checkpoint(checkpoint_path)) == [1]
+
+
+def test_failed_books_of_older_checkpoints_are_skipped(tmp_path):
+    checkpoint_path = tmp_path / 'features.jsonl'
+    books = [{'itemID': 1, 'description': 'error', 'rating': 'error', 'release_date': 'error'},
+             {'itemID': 2, 'description': '', 'rating': '', 'release_date': '2008-09-01 00:00:00'}]
+    checkpoint_path.write_text(''.join(json.dumps(book) + '\n' for book in books), encoding='utf-8')
+
+    scraped = load_checkpoint(str(checkpoint_path))
+
+    assert list(scraped) == [2]
+    assert scraped[2]['release_date'].year == 2008
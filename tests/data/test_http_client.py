@@ -0,0 +1,53 @@
+import time
+
+import pytest
+import requests
+
+from src.data.http_client import HttpClient, RateLimiter
+
+
+def test_failed_requests_are_retried(stub_server):
+    stub_server.add('/page', 'content', failures=2)
+    client = HttpClient(retries=3, backoff_factor=0, requests_per_second=None)
+
+    assert client.get_content(stub_server.url + '/page') == b'content'
+    assert len(stub_server.get_requests('/page')) == 3
+
+
+def test_error_is_raised_when_the_retries_are_used_up(stub_server):
+    stub_server.add('/page', 'content', failures=5)
+    client = HttpClient(retries=2, backoff_factor=0, requests_per_second=None)
+
+    with pytest.raises(requests.RequestException):
+        client.get(stub_server.url + '/page')
+    assert len(stub_server.get_requests('/page')) == 3
+
+
+def test_client_errors_are_not_retried(stub_server):
+    client = HttpClient(retries=3, backoff_factor=0, requests_per_second=None)
+
+    with pytest.raises(requests.HTTPError):
+        client.get(stub_server.url + '/missing')
+    assert len(stub_server.get_requests('/missing')) == 1
+
+
+def test_requests_to_a_host_are_rate_limited(stub_server):
+    stub_server.add('/page', 'content')
+    client = HttpClient(requests_per_second=20)
+
+    for _ in range(5):
+        client.get(stub_server.url + '/page')
+
+    times = stub_server.get_requests('/page')
+    assert times[-1] - times[0] >= 4 / 20 * 0.9
+
+
+def test_rate_limiter_spaces_every_host_on_its_own():
+    limiter = RateLimiter(10)
+
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.wait('a.example')
+    limiter.wait('b.example')
+
+    assert 0.2 <= time.monotonic() - start < 0.3
@@ -0,0 +1,27 @@
+import os
+
+from src.data.response_cache import ResponseCache
+
+
+def test_eviction_frees_space_down_to_the_low_water_mark(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path), ttl=None, max_bytes=1000, low_water=0.5)
+    for i in range(10):
+        cache.set('https://example.org/{}'.format(i), b'x' * 100)
+        # distinct modification times, the oldest entries are evicted first
+        os.utime(cache.get_path('https://example.org/{}'.format(i)), (i, i))
+
+    evictions = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, 'evict', lambda: evictions.append(1) or evict())
+    cache.set('https://example.org/10', b'x' * 100)
+
+    assert len(evictions) == 1
+    assert cache.size <= 500
+    assert cache.get('https://example.org/0') is None
+    assert cache.get('https://example.org/10') == b'x' * 100
+
+    # the freed space takes further writes without walking the cache again
+    for i in range(11, 14):
+        cache.set('https://example.org/{}'.format(i), b'x' * 100)
+    assert len(evictions) == 1
+    assert cache.size == sum(size for _, _, size in cache.get_entries())
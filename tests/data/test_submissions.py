@@ -0,0 +1,33 @@
+import pytest
+
+from src.data.submissions import MissingIdsError, load_submission
+
+SUBMISSION = (',book_id,model_id,team_id,recommendation_1,recommendation_2,recommendation_3,recommendation_4,'
+              'recommendation_5\n'
+              '0,12,1,mannheimminers,56148,33530,10698,72004,70402\n'
+              '1,12,2,mannheimminers,7262,15116,6210,65147,32030\n')
+
+
+def test_model_map_renames_single_model_ids(tmp_path):
+    path = tmp_path / 'MannheimMiners.csv'
+    path.write_text(SUBMISSION, encoding='utf-8')
+
+    submission = load_submission(str(path), str(tmp_path / 'store'), model_map={'2': 'model_2'})
+
+    assert submission['model_id'].tolist() == ['1', 'model_2']
+    assert submission['team_id'].tolist() == ['mannheimminers'] * 2
+    # the stored submission belongs to the load options
+    assert load_submission(str(path), str(tmp_path / 'store'))['model_id'].tolist() == ['1', '2']
+
+
+def test_predictions_without_ids_need_load_options(tmp_path):
+    path = tmp_path / 'evaluation_group7.csv'
+    path.write_text('itemID,predictions\n12,"[\'48859\', \'76706\', \'50697\', \'19693\', \'11750\']"\n',
+                    encoding='utf-8')
+
+    with pytest.raises(MissingIdsError):
+        load_submission(str(path))
+    submission = load_submission(str(path), model_id='group7', team_id='group7')
+
+    assert submission['recommendation_5'].tolist() == [11750]
+    assert submission['model_id'].tolist() == ['group7']